@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'QueryPilot.settings')
 
 application = get_asgi_application()
+
+# Load models and clients before serving instead of on the first request.
+from django.conf import settings  # noqa: E402
+
+if settings.WARMUP_RESOURCES:
+    from api_gateway.registry import warmup  # noqa: E402
+
+    warmup(settings.WARMUP_RESOURCES)
@@ -129,6 +129,115 @@ LOGGING = {
 }
 
 
+# QueryPilot pipeline
+# Resources loaded by the WSGI/ASGI entry point before serving, comma separated
+# (e.g. "embedding_model,llm_tokenizer,llm_model"). Everything else loads on first use.
+WARMUP_RESOURCES = [name for name in os.getenv("QUERYPILOT_WARMUP", "").split(",") if name]
+# Redis for caches and sessions, and the connection pool size per client.
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+# Session hashes expire SESSION_TTL seconds after their last write (0 = never);
+# values above SESSION_COMPRESS_THRESHOLD bytes are stored zlib-compressed.
+SESSION_TTL = int(os.getenv("SESSION_TTL", "86400"))
+SESSION_COMPRESS_THRESHOLD = int(os.getenv("SESSION_COMPRESS_THRESHOLD", "1024"))
+# Seconds between catalog fingerprint checks; a changed fingerprint triggers a
+# background refresh of the cached schema snapshot.
+SCHEMA_CACHE_CHECK_INTERVAL = float(os.getenv("SCHEMA_CACHE_CHECK_INTERVAL", "30"))
+# Lifetime of shared schema snapshots in Redis.
+SCHEMA_CACHE_REDIS_TTL = int(os.getenv("SCHEMA_CACHE_REDIS_TTL", "86400"))
+# Index manifest and local embedding cache for incremental schema indexing.
+SCHEMA_INDEX_DIR = os.getenv("SCHEMA_INDEX_DIR", str(BASE_DIR / ".querypilot"))
+# Schema indexing pipeline: texts per encoder batch, encoder processes (0 = in-process),
+# vectors per upsert request and concurrent upsert requests.
+SCHEMA_INDEX_ENCODE_BATCH_SIZE = int(os.getenv("SCHEMA_INDEX_ENCODE_BATCH_SIZE", "256"))
+SCHEMA_INDEX_ENCODE_PROCESSES = int(os.getenv("SCHEMA_INDEX_ENCODE_PROCESSES", "0"))
+SCHEMA_INDEX_UPSERT_BATCH_SIZE = int(os.getenv("SCHEMA_INDEX_UPSERT_BATCH_SIZE", "100"))
+SCHEMA_INDEX_UPSERT_CONCURRENCY = int(os.getenv("SCHEMA_INDEX_UPSERT_CONCURRENCY", "4"))
+# Vector store for schema embeddings: "pinecone" or "local" (memory-mapped, in-process).
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone")
+LOCAL_VECTOR_INDEX_DIR = os.getenv("LOCAL_VECTOR_INDEX_DIR", str(Path(SCHEMA_INDEX_DIR) / "vectors"))
+# Above this many vectors the local index is partitioned (IVF) and only the
+# LOCAL_VECTOR_INDEX_NPROBE closest partitions are scanned per query.
+LOCAL_VECTOR_INDEX_IVF_THRESHOLD = int(os.getenv("LOCAL_VECTOR_INDEX_IVF_THRESHOLD", "50000"))
+LOCAL_VECTOR_INDEX_NPROBE = int(os.getenv("LOCAL_VECTOR_INDEX_NPROBE", "8"))
+# Query embedding and retrieval result caches (process-local LRU, shared via Redis).
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "10000"))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "3600"))
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", "600"))
+QUERY_CACHE_REDIS = os.getenv("QUERY_CACHE_REDIS", "true").lower() == "true"
+# Hybrid schema retrieval: questions naming their tables and columns verbatim
+# (at least RETRIEVAL_LEXICAL_COVERAGE of their terms) skip the vector search;
+# otherwise the top RETRIEVAL_CANDIDATES BM25 and vector hits are fused by
+# reciprocal rank with constant RETRIEVAL_RRF_K.
+RETRIEVAL_LEXICAL_ENABLED = os.getenv("RETRIEVAL_LEXICAL_ENABLED", "true").lower() == "true"
+RETRIEVAL_LEXICAL_COVERAGE = float(os.getenv("RETRIEVAL_LEXICAL_COVERAGE", "0.5"))
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+RETRIEVAL_RRF_K = int(os.getenv("RETRIEVAL_RRF_K", "60"))
+# SQL generation backend: "cuda", "cpu" or "auto" (CUDA when a GPU is visible).
+LLM_BACKEND = os.getenv("LLM_BACKEND", "auto")
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "defog/sqlcoder-7b-2")
+# CPU backend: optional smaller compatible checkpoint, torch threads (default: all
+# cores) and dynamic int8 quantization of Linear layers.
+LLM_CPU_MODEL_NAME = os.getenv("LLM_CPU_MODEL_NAME") or None
+LLM_CPU_THREADS = int(os.getenv("LLM_CPU_THREADS", "0")) or None
+LLM_CPU_QUANTIZE = os.getenv("LLM_CPU_QUANTIZE", "true").lower() == "true"
+# Micro-batching: prompts per generate() call and how long (ms) the first pending
+# prompt waits for others to join its batch.
+LLM_MAX_BATCH_SIZE = int(os.getenv("LLM_MAX_BATCH_SIZE", "8"))
+LLM_MAX_BATCH_WAIT_MS = float(os.getenv("LLM_MAX_BATCH_WAIT_MS", "10"))
+# Memory budget (bytes, on the generation device) for cached schema-prefix
+# past_key_values; 0 disables prefix reuse.
+LLM_PREFIX_CACHE_BYTES = int(os.getenv("LLM_PREFIX_CACHE_BYTES", str(2 * 1024 ** 3)))
+# Upper bound (tokens) on the generation prompt. Tables and columns are packed by
+# retrieval score and key membership; 0 includes every mapped column.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2048"))
+# Part of PROMPT_TOKEN_BUDGET set aside for the question. The schema always gets
+# the rest, so its prefix (and KV cache entry) is the same for every question over
+# the same tables; longer questions run past the budget instead.
+PROMPT_QUESTION_TOKENS = int(os.getenv("PROMPT_QUESTION_TOKENS", "256"))
+# Restrict table names and qualified column references in generated SQL to the
+# identifiers of the mapped schema while decoding.
+LLM_CONSTRAINED_DECODING = os.getenv("LLM_CONSTRAINED_DECODING", "false").lower() == "true"
+# Generated SQL cache per (question, mapped schema, catalog fingerprint). Paraphrases
+# hit when their embedding's cosine similarity reaches the threshold.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+# Streamed query results: rows per server-side fetch, and caps on rows and
+# encoded bytes per response (the response is marked truncated past them).
+QUERY_FETCH_SIZE = int(os.getenv("QUERY_FETCH_SIZE", "1000"))
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "100000"))
+QUERY_MAX_BYTES = int(os.getenv("QUERY_MAX_BYTES", str(64 * 1024 * 1024)))
+# Pre-execution guard: LIMIT injected into unbounded SELECTs, EXPLAIN cost/row
+# estimates above which a query needs "confirm" or is refused (0 disables a
+# check), and the per-statement timeout in milliseconds.
+QUERY_AUTO_LIMIT = int(os.getenv("QUERY_AUTO_LIMIT", "1000"))
+QUERY_GUARD_CONFIRM_COST = float(os.getenv("QUERY_GUARD_CONFIRM_COST", "1e6"))
+QUERY_GUARD_MAX_COST = float(os.getenv("QUERY_GUARD_MAX_COST", "1e8"))
+QUERY_GUARD_CONFIRM_ROWS = float(os.getenv("QUERY_GUARD_CONFIRM_ROWS", "1e6"))
+QUERY_GUARD_MAX_ROWS = float(os.getenv("QUERY_GUARD_MAX_ROWS", "1e8"))
+QUERY_STATEMENT_TIMEOUT_MS = int(os.getenv("QUERY_STATEMENT_TIMEOUT_MS", "30000"))
+# Cached query results per (database, normalized SQL), invalidated by the change
+# counters of the tables read; results above the compressed size cap aren't cached.
+QUERY_RESULT_CACHE_ENABLED = os.getenv("QUERY_RESULT_CACHE_ENABLED", "true").lower() == "true"
+QUERY_RESULT_CACHE_TTL = int(os.getenv("QUERY_RESULT_CACHE_TTL", "300"))
+QUERY_RESULT_CACHE_MAX_BYTES = int(os.getenv("QUERY_RESULT_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+# Pooled connections to user databases (connect_to_db): per credential set and in
+# total, idle lifetime, idle time before a health check ping, and wait/connect timeouts.
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "5"))
+DB_POOL_MAX_TOTAL = int(os.getenv("DB_POOL_MAX_TOTAL", "50"))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+DB_POOL_HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10"))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+# Async pipeline (query/async/): threads for model inference and for blocking
+# I/O, and the asyncpg pool size for query execution.
+ASYNC_CPU_WORKERS = int(os.getenv("ASYNC_CPU_WORKERS", "4"))
+ASYNC_IO_WORKERS = int(os.getenv("ASYNC_IO_WORKERS", "16"))
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "10"))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
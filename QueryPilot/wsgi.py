@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'QueryPilot.settings')
 
 application = get_wsgi_application()
+
+# Load models and clients before serving instead of on the first request.
+from django.conf import settings  # noqa: E402
+
+if settings.WARMUP_RESOURCES:
+    from api_gateway.registry import warmup  # noqa: E402
+
+    warmup(settings.WARMUP_RESOURCES)
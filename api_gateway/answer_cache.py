@@ -0,0 +1,145 @@
+# api_gateway/answer_cache.py
+import hashlib
+import json
+import logging
+
+import numpy as np
+from django.conf import settings
+
+from .cache import CacheCounters, LRUCache
+from .embedding_service import embed_query, normalize_query
+from .utils import get_binary_redis
+
+logger = logging.getLogger(__name__)
+
+# Generated SQL per (scope, question digest); the scope covers the catalog
+# fingerprint and the mapped schema, so any schema change moves to a new scope.
+ANSWER_KEY = "qp:answer:{scope}:{digest}"
+# Per scope: question digest -> float32 question embedding, for paraphrase lookups.
+ANSWER_INDEX_KEY = "qp:answer_index:{scope}"
+
+local_answers = LRUCache("answer.local", maxsize=4096, ttl=300)
+exact_counters = CacheCounters("answer.exact")
+semantic_counters = CacheCounters("answer.semantic")
+
+
+def _enabled():
+    return getattr(settings, "ANSWER_CACHE_ENABLED", True)
+
+
+def _ttl():
+    return getattr(settings, "ANSWER_CACHE_TTL", 86400)
+
+
+def answer_scope(mapped_schema, schema_version):
+    """
+    Fingerprint of everything a generated answer depends on besides the question.
+
+    Args:
+        mapped_schema (dict): Schema passed to the prompt.
+        schema_version (str): Catalog fingerprint of the current schema snapshot.
+
+    Returns:
+        str: Short hex digest.
+    """
+    # Retrieval scores differ per question; only the schema itself scopes answers
+    tables = {
+        name: {"columns": info["columns"], "relations": info["relations"]}
+        for name, info in mapped_schema.get("tables", {}).items()
+    }
+    payload = json.dumps(tables, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{schema_version}\0{payload}".encode()).hexdigest()[:24]
+
+
+def _question_digest(question):
+    return hashlib.sha256(normalize_query(question).encode()).hexdigest()[:24]
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def lookup_answer(question, mapped_schema, schema_version):
+    """
+    Find previously generated SQL for this question, or for a close paraphrase of it.
+
+    The exact (normalized question) match is checked first; on a miss, the question
+    embedding is compared with those of every question answered in the same scope
+    and the best match is used if its cosine similarity reaches
+    ``ANSWER_CACHE_SIMILARITY_THRESHOLD``.
+
+    Returns:
+        str: Cached SQL, or None on a miss.
+    """
+    if not _enabled():
+        return None
+
+    scope = answer_scope(mapped_schema, schema_version)
+    digest = _question_digest(question)
+    sql_query = local_answers.get((scope, digest))
+    if sql_query is not None:
+        return sql_query
+
+    try:
+        redis = get_binary_redis()
+        payload = redis.get(ANSWER_KEY.format(scope=scope, digest=digest))
+        if payload:
+            exact_counters.hit()
+            sql_query = payload.decode()
+            local_answers.set((scope, digest), sql_query)
+            return sql_query
+        exact_counters.miss()
+
+        index = redis.hgetall(ANSWER_INDEX_KEY.format(scope=scope))
+        if not index:
+            semantic_counters.miss()
+            return None
+
+        digests = list(index)
+        matrix = np.frombuffer(b"".join(index[d] for d in digests), dtype=np.float32).reshape(len(digests), -1)
+        similarities = matrix @ _unit(embed_query(question))
+        best = int(np.argmax(similarities))
+        if similarities[best] < getattr(settings, "ANSWER_CACHE_SIMILARITY_THRESHOLD", 0.92):
+            semantic_counters.miss()
+            return None
+
+        payload = redis.get(ANSWER_KEY.format(scope=scope, digest=digests[best].decode()))
+        if not payload:
+            semantic_counters.miss()
+            return None
+        semantic_counters.hit()
+        sql_query = payload.decode()
+        local_answers.set((scope, digest), sql_query)
+        logger.info(f"Answer cache paraphrase hit (similarity {similarities[best]:.3f})")
+        return sql_query
+
+    except Exception as e:
+        logger.warning(f"Answer cache lookup failed: {e}")
+        return None
+
+
+def store_answer(question, mapped_schema, schema_version, sql_query):
+    """
+    Remember generated SQL for a question and make it findable by paraphrases.
+    """
+    if not _enabled() or not sql_query:
+        return
+
+    scope = answer_scope(mapped_schema, schema_version)
+    digest = _question_digest(question)
+    local_answers.set((scope, digest), sql_query)
+
+    try:
+        redis = get_binary_redis()
+        index_key = ANSWER_INDEX_KEY.format(scope=scope)
+        pipe = redis.pipeline(transaction=False)
+        pipe.set(ANSWER_KEY.format(scope=scope, digest=digest), sql_query.encode(), ex=_ttl())
+        # Bound the per-scope similarity scan; exact hits still work past the cap.
+        if redis.hlen(index_key) < getattr(settings, "ANSWER_CACHE_MAX_ENTRIES", 5000):
+            pipe.hset(index_key, digest, _unit(embed_query(question)).tobytes())
+            pipe.expire(index_key, _ttl())
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not store answer: {e}")
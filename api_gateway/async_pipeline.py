@@ -0,0 +1,190 @@
+# api_gateway/async_pipeline.py
+import asyncio
+import json
+import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+
+from .answer_cache import lookup_answer, store_answer
+from .embedding_service import retrieve_relevant_schema
+from .llm_service import agenerate_sql_from_nl
+from .registry import LazyResource
+from .result_cache import lookup_result, store_result
+from .schema_cache import get_schema_snapshot
+from .schema_extractor import map_relevant_schemas_to_tables, standardize_table_names
+from .query_guard import QueryRejected, guard_query
+from .sql_service import (
+    PG_TYPE_NAMES, STATEMENT_TIMEOUT_SQL, ResultSet, execute_sql_result, process_query_pipeline, statement_timeout_ms,
+)
+from .utils import update_session
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+# Bounded pools for the blocking parts of the pipeline: model inference (embedding,
+# tokenization) on one, database/Redis/network calls on the other.
+_cpu_executor = LazyResource("async CPU executor", lambda: ThreadPoolExecutor(
+    max_workers=getattr(settings, "ASYNC_CPU_WORKERS", 4), thread_name_prefix="qp-cpu"
+))
+_io_executor = LazyResource("async I/O executor", lambda: ThreadPoolExecutor(
+    max_workers=getattr(settings, "ASYNC_IO_WORKERS", 16), thread_name_prefix="qp-io"
+))
+
+# Event loop -> task creating its asyncpg pool (asyncpg pools are bound to one loop)
+_asyncpg_pools = weakref.WeakKeyDictionary()
+
+
+async def _init_connection(conn):
+    # json/jsonb as Python objects, like psycopg2, so both paths fill the result cache alike
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+
+async def _create_asyncpg_pool():
+    database = settings.DATABASES["default"]
+    return await asyncpg.create_pool(
+        host=database.get("HOST") or None,
+        port=int(database["PORT"]) if database.get("PORT") else None,
+        user=database.get("USER"),
+        password=database.get("PASSWORD"),
+        database=database.get("NAME"),
+        min_size=1,
+        max_size=getattr(settings, "ASYNC_DB_POOL_SIZE", 10),
+        init=_init_connection,
+    )
+
+
+async def get_asyncpg_pool():
+    """
+    asyncpg pool for the default database on the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    task = _asyncpg_pools.get(loop)
+    if task is None or (task.done() and task.exception() is not None):
+        # Concurrent first callers await the same creation task
+        task = _asyncpg_pools[loop] = loop.create_task(_create_asyncpg_pool())
+    return await task
+
+
+async def execute_sql_result_async(sql_query, use_asyncpg=True):
+    """
+    Execute the SQL query on the default database without blocking the event loop.
+
+    Uses asyncpg when installed and ``use_asyncpg`` is set; otherwise the
+    synchronous ``execute_sql_result`` runs on the I/O executor. Either way the
+    statement runs under ``QUERY_STATEMENT_TIMEOUT_MS`` and the result carries the
+    same column types and values.
+
+    Args:
+        sql_query (str): SQL to run.
+        use_asyncpg (bool): asyncpg pools live as long as their event loop; pass
+            False when the loop is created per call (async views under WSGI).
+
+    Returns:
+        ResultSet: Fetched rows, or ``{"error": str}`` if execution failed.
+    """
+    if asyncpg is None or not use_asyncpg:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_io_executor.get(), execute_sql_result, sql_query)
+
+    try:
+        pool = await get_asyncpg_pool()
+        timeout = statement_timeout_ms()
+        async with pool.acquire() as conn, conn.transaction():
+            if timeout:
+                await conn.execute(STATEMENT_TIMEOUT_SQL.replace("%s", "$1"), str(timeout))
+            statement = await conn.prepare(sql_query)
+            records = await statement.fetch()
+            attributes = statement.get_attributes()
+        logger.info("SQL query executed successfully")
+        return ResultSet(
+            [attribute.name for attribute in attributes],
+            [PG_TYPE_NAMES.get(attribute.type.oid, "unknown") for attribute in attributes],
+            [tuple(record) for record in records],
+        )
+    except Exception as e:
+        logger.error(f"Error executing SQL query: {e}")
+        return {"error": str(e)}
+
+
+async def execute_cached_async(sql_query, use_asyncpg=True):
+    """
+    ``execute_sql_result_async()`` behind the result cache; the cache lookup and
+    store run on the I/O executor.
+    """
+    loop = asyncio.get_running_loop()
+    io = _io_executor.get()
+    result, token = await loop.run_in_executor(io, lookup_result, sql_query)
+    if result is not None:
+        return result
+    result = await execute_sql_result_async(sql_query, use_asyncpg)
+    await loop.run_in_executor(io, store_result, token, result)
+    return result
+
+
+async def run_query_pipeline(nl_query, session_id, confirmed=False, use_asyncpg=True):
+    """
+    The QueryView pipeline as a coroutine.
+
+    The schema snapshot and the schema retrieval are independent and run
+    concurrently; generation is awaited on the scheduler's future; the query
+    guard then runs on the I/O executor, and execution, answer caching and
+    session writes overlap at the end. ``use_asyncpg`` is passed on to
+    ``execute_sql_result_async()``.
+
+    Returns:
+        tuple: ``(payload, status_code)``.
+    """
+    loop = asyncio.get_running_loop()
+    cpu, io = _cpu_executor.get(), _io_executor.get()
+
+    try:
+        snapshot, relevant_schemas = await asyncio.gather(
+            loop.run_in_executor(io, get_schema_snapshot),
+            loop.run_in_executor(cpu, retrieve_relevant_schema, nl_query),
+        )
+        schema_info = snapshot.schema_info if snapshot else None
+        mapped_schema_info = map_relevant_schemas_to_tables(
+            relevant_schemas, schema_info, catalog=snapshot.catalog if snapshot else None
+        )
+        logger.info(f"Mapped schema info: {mapped_schema_info}")
+
+        schema_version = snapshot.fingerprint if snapshot else ""
+        sql_query = await loop.run_in_executor(cpu, lookup_answer, nl_query, mapped_schema_info, schema_version)
+        generated = sql_query is None
+        if generated:
+            sql_query = await agenerate_sql_from_nl(nl_query, mapped_schema_info, executor=cpu)
+        if not sql_query:
+            return {"error": "Failed to generate SQL query."}, 500
+        logger.info(f"Generated SQL Query: {sql_query}")
+
+        std_query = standardize_table_names(sql_query, mapped_schema_info)
+        corrected_query = await loop.run_in_executor(cpu, process_query_pipeline, std_query, mapped_schema_info)
+        if not corrected_query.startswith("Error:"):
+            std_query = corrected_query
+        try:
+            guarded = await loop.run_in_executor(io, partial(guard_query, std_query, confirmed=confirmed))
+        except QueryRejected as e:
+            return {"sql_query": sql_query, **e.payload()}, e.status_code
+
+        side_effects = [
+            loop.run_in_executor(io, partial(update_session, session_id, last_query=nl_query, last_sql=sql_query)),
+        ]
+        if generated:
+            side_effects.append(
+                loop.run_in_executor(cpu, store_answer, nl_query, mapped_schema_info, schema_version, sql_query)
+            )
+        results, *_ = await asyncio.gather(execute_cached_async(guarded.sql, use_asyncpg), *side_effects)
+
+        return {"sql_query": sql_query, "results": results}, 200
+
+    except Exception as e:
+        logger.error(f"Error processing query: {e}")
+        return {"error": f"An error occurred while processing the query. {e}"}, 500
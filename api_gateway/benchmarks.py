@@ -0,0 +1,296 @@
+# api_gateway/benchmarks.py
+"""
+Standalone benchmarks for QueryPilot hot paths.
+
+Usage:
+    python -m api_gateway.benchmarks schema [--repeat N]
+    python -m api_gateway.benchmarks startup [--repeat N]
+    python -m api_gateway.benchmarks rewrite [--tables N] [--columns N] [--repeat N]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from .schema_extractor import connect_schema_db, introspect_catalog
+from .sql_rewriter import SQLRewriter
+
+
+def legacy_get_schema(conn):
+    """
+    The original per-schema information_schema loop, kept as the benchmark baseline.
+    """
+    schema_info = {"schemas": {}}
+    cursor = conn.cursor()
+
+    # Step 1: Retrieve all schemas except system schemas
+    cursor.execute("""
+        SELECT schema_name 
+        FROM information_schema.schemata 
+        WHERE schema_name NOT IN ('pg_catalog', 'information_schema', 'pg_toast');
+    """)
+    schemas = [row[0] for row in cursor.fetchall()]
+
+    for schema in schemas:
+        schema_info["schemas"][schema] = {"tables": {}}
+
+        # Step 2: Retrieve table and column details for each schema
+        cursor.execute("""
+            SELECT table_name, column_name, data_type, is_nullable
+            FROM information_schema.columns
+            WHERE table_schema = %s;
+        """, [schema])
+        columns = cursor.fetchall()
+
+        for table_name, column_name, data_type, is_nullable in columns:
+            if table_name not in schema_info["schemas"][schema]["tables"]:
+                schema_info["schemas"][schema]["tables"][table_name] = {
+                    "columns": {},
+                    "constraints": {
+                        "primary_key": [],
+                        "foreign_keys": [],
+                        "unique": [],
+                        "check": [],
+                    }
+                }
+            schema_info["schemas"][schema]["tables"][table_name]["columns"][column_name] = {
+                "data_type": data_type,
+                "is_nullable": is_nullable
+            }
+
+        # Step 3: Retrieve constraints (primary key, foreign key, unique, and check)
+        cursor.execute("""
+            SELECT
+                tc.constraint_type,
+                kcu.table_name AS table_name,
+                kcu.column_name AS column_name,
+                ccu.table_name AS related_table,
+                ccu.column_name AS related_column,
+                tc.constraint_name AS constraint_name
+            FROM information_schema.table_constraints AS tc
+            LEFT JOIN information_schema.key_column_usage AS kcu
+                ON tc.constraint_name = kcu.constraint_name
+            LEFT JOIN information_schema.constraint_column_usage AS ccu
+                ON ccu.constraint_name = tc.constraint_name
+            WHERE tc.table_schema = %s;
+        """, [schema])
+        constraints = cursor.fetchall()
+
+        for (
+            constraint_type,
+            table_name,
+            column_name,
+            related_table,
+            related_column,
+            constraint_name,
+        ) in constraints:
+            if table_name in schema_info["schemas"][schema]["tables"]:
+                if constraint_type == "PRIMARY KEY":
+                    schema_info["schemas"][schema]["tables"][table_name]["constraints"]["primary_key"].append(column_name)
+                elif constraint_type == "FOREIGN KEY":
+                    schema_info["schemas"][schema]["tables"][table_name]["constraints"]["foreign_keys"].append({
+                        "column": column_name,
+                        "related_table": related_table,
+                        "related_column": related_column,
+                        "constraint_name": constraint_name
+                    })
+                elif constraint_type == "UNIQUE":
+                    schema_info["schemas"][schema]["tables"][table_name]["constraints"]["unique"].append({
+                        "column": column_name,
+                        "constraint_name": constraint_name
+                    })
+
+        # Step 4: Retrieve check constraints
+        cursor.execute("""
+            SELECT 
+                tc.table_name,
+                tc.constraint_name,
+                cc.check_clause
+            FROM information_schema.table_constraints AS tc
+            JOIN information_schema.check_constraints AS cc
+                ON tc.constraint_name = cc.constraint_name
+            WHERE tc.table_schema = %s AND tc.constraint_type = 'CHECK';
+        """, [schema])
+        check_constraints = cursor.fetchall()
+
+        for table_name, constraint_name, check_clause in check_constraints:
+            if table_name in schema_info["schemas"][schema]["tables"]:
+                schema_info["schemas"][schema]["tables"][table_name]["constraints"]["check"].append({
+                    "constraint_name": constraint_name,
+                    "check_clause": check_clause
+                })
+
+    return schema_info
+
+
+def _time_call(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, timings
+
+
+def _summarize(schema_info):
+    tables = sum(len(s["tables"]) for s in schema_info["schemas"].values())
+    columns = sum(
+        len(t["columns"]) for s in schema_info["schemas"].values() for t in s["tables"].values()
+    )
+    return len(schema_info["schemas"]), tables, columns
+
+
+def bench_schema(repeat):
+    """
+    Compare the per-schema information_schema loop with the pg_catalog bulk introspection.
+    """
+    conn = connect_schema_db()
+    try:
+        for label, func in (
+            ("information_schema loop", lambda: legacy_get_schema(conn)),
+            ("pg_catalog bulk", lambda: introspect_catalog(conn)),
+        ):
+            schema_info, timings = _time_call(func, repeat)
+            conn.rollback()
+            schemas, tables, columns = _summarize(schema_info)
+            print(
+                f"{label:<26} median {statistics.median(timings) * 1000:9.1f} ms  "
+                f"min {min(timings) * 1000:9.1f} ms  "
+                f"({schemas} schemas, {tables} tables, {columns} columns)"
+            )
+    finally:
+        conn.close()
+
+
+# Modules timed by the startup benchmark, in dependency order.
+STARTUP_MODULES = (
+    "api_gateway.utils",
+    "api_gateway.schema_extractor",
+    "api_gateway.sql_service",
+    "api_gateway.prompt_service",
+    "api_gateway.embedding_service",
+    "api_gateway.llm_service",
+    "api_gateway.views",
+)
+
+STARTUP_PROBE = """
+import importlib, os, time
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "QueryPilot.settings")
+import django
+django.setup()
+start = time.perf_counter()
+importlib.import_module({module!r})
+print(time.perf_counter() - start)
+"""
+
+
+def bench_startup(repeat):
+    """
+    Import each service module in a fresh interpreter (after django.setup()) and
+    report its cumulative import time, including everything it pulls in.
+    """
+    for module in STARTUP_MODULES:
+        timings = []
+        for _ in range(repeat):
+            output = subprocess.run(
+                [sys.executable, "-c", STARTUP_PROBE.format(module=module)],
+                capture_output=True, text=True, check=True,
+            ).stdout
+            timings.append(float(output.strip().splitlines()[-1]))
+        print(f"{module:<32} median {statistics.median(timings) * 1000:9.1f} ms  "
+              f"min {min(timings) * 1000:9.1f} ms")
+
+
+def legacy_standardize_table_names(sql_query, mapped_schema):
+    """
+    The original per-table ``str.replace`` passes, kept as the benchmark baseline.
+    """
+    for table_name, table_info in mapped_schema["tables"].items():
+        short_table_name = table_name.split(".")[-1]
+        sql_query = sql_query.replace(f"{short_table_name} ", f"{table_name} ")
+        sql_query = sql_query.replace(f"{short_table_name}(", f"{table_name}(")
+    return sql_query
+
+
+def legacy_correct_sql_query(sql_query, table_map, corrected_columns):
+    """
+    The original per-alias and per-column ``str.replace`` passes.
+    """
+    for alias, full_table_name in table_map.items():
+        if alias and isinstance(full_table_name, str):
+            sql_query = sql_query.replace(f"{alias}.", f"{full_table_name}.")
+    for original, corrected in corrected_columns.items():
+        sql_query = sql_query.replace(original, corrected)
+    return sql_query
+
+
+def generated_query(tables, columns):
+    """
+    A large generated-looking query: every table joined in, every column selected
+    and filtered on, with string literals that mention the table names.
+
+    Returns:
+        tuple: ``(sql, mapped_schema, aliases, corrected_columns)``.
+    """
+    names = [f"table_{index}" for index in range(tables)]
+    mapped_schema = {"tables": {f"schema_{index % 8}.{name}": {"columns": {}} for index, name in enumerate(names)}}
+    aliases = {f"t{index}": f"schema_{index % 8}.{name}" for index, name in enumerate(names)}
+
+    select, where, corrected = [], [], {}
+    for index in range(tables):
+        for column in range(columns):
+            select.append(f"t{index}.col_{column}")
+            # Every tenth column was misspelled by the model
+            if column % 10 == 0:
+                corrected[f"t{index}.colm_{column}"] = f"t{index}.col_{column}"
+                where.append(f"t{index}.colm_{column} <> 'table_{index} value'")
+    joins = " ".join(f"JOIN table_{index} t{index} ON t{index}.id = t0.id" for index in range(1, tables))
+    sql = f"SELECT {', '.join(select)} FROM table_0 t0 {joins} WHERE {' AND '.join(where)};"
+    return sql, mapped_schema, aliases, corrected
+
+
+def bench_rewrite(tables, columns, repeat):
+    """
+    Compare the repeated ``str.replace`` passes with the single-pass token rewriter.
+    """
+    sql, mapped_schema, aliases, corrected = generated_query(tables, columns)
+    rewriter = SQLRewriter(mapped_schema["tables"])
+    print(f"{len(sql)} chars, {tables} tables, {tables * columns} column references")
+    for label, func in (
+        ("str.replace passes", lambda: legacy_correct_sql_query(
+            legacy_standardize_table_names(sql, mapped_schema), aliases, corrected)),
+        ("single-pass rewriter", lambda: rewriter.rewrite(sql, aliases=aliases, columns=corrected)),
+    ):
+        _, timings = _time_call(func, repeat)
+        print(f"{label:<26} median {statistics.median(timings) * 1000:9.2f} ms  "
+              f"min {min(timings) * 1000:9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QueryPilot benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    schema_parser = subparsers.add_parser("schema", help="Schema introspection")
+    schema_parser.add_argument("--repeat", type=int, default=5)
+
+    startup_parser = subparsers.add_parser("startup", help="Per-module import cost")
+    startup_parser.add_argument("--repeat", type=int, default=3)
+
+    rewrite_parser = subparsers.add_parser("rewrite", help="Table/column rewriting of generated SQL")
+    rewrite_parser.add_argument("--tables", type=int, default=50)
+    rewrite_parser.add_argument("--columns", type=int, default=40)
+    rewrite_parser.add_argument("--repeat", type=int, default=5)
+
+    args = parser.parse_args()
+    if args.benchmark == "schema":
+        bench_schema(args.repeat)
+    elif args.benchmark == "startup":
+        bench_startup(args.repeat)
+    elif args.benchmark == "rewrite":
+        bench_rewrite(args.tables, args.columns, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# api_gateway/cache.py
+import threading
+import time
+from collections import OrderedDict
+
+# name -> CacheCounters, for every cache layer in the process
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+class CacheCounters:
+    """
+    Thread-safe hit/miss counters for one cache layer, registered by name.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with _counters_lock:
+            _counters[name] = self
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def snapshot(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe LRU cache with an optional per-entry TTL.
+
+    Args:
+        name (str): Name the cache's counters are reported under.
+        maxsize (int): Maximum number of entries; the least recently used is evicted.
+        ttl (float): Seconds an entry stays valid, or None for no expiry.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.counters = CacheCounters(name)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.counters.hit()
+                    return value
+                del self._data[key]
+        self.counters.miss()
+        return default
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def cache_stats():
+    """
+    Hit/miss counters of every cache layer in this process.
+
+    Returns:
+        dict: ``{name: {"hits", "misses", "hit_rate"}}``.
+    """
+    with _counters_lock:
+        return {name: counters.snapshot() for name, counters in sorted(_counters.items())}
@@ -0,0 +1,196 @@
+# api_gateway/column_index.py
+import logging
+import threading
+from collections import defaultdict
+from difflib import get_close_matches
+
+import numpy as np
+
+from .cache import LRUCache
+from .schema_cache import get_schema_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Minimum scores for each fallback, strictest first
+CLOSE_MATCH_CUTOFF = 0.8
+TRIGRAM_THRESHOLD = 0.5
+SEMANTIC_THRESHOLD = 0.8
+
+# Snapshot fingerprint -> ColumnCorrectionIndex
+_indexes = LRUCache("columns.index", maxsize=4)
+_build_lock = threading.Lock()
+
+
+def trigrams(name):
+    padded = f"  {name.casefold()} "
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class TableColumns:
+    """
+    Lookup structures for the columns of one table.
+
+    Exact and case-folded lookups are dictionary hits; the trigram postings bound the
+    fuzzy candidates to columns sharing at least one trigram with the input. Column
+    embeddings are normalized and set in the background by
+    ``ColumnCorrectionIndex.precompute_embeddings()``; a semantic lookup that comes
+    first (or a table outside the snapshot) encodes just that table's columns.
+    """
+
+    __slots__ = ("columns", "exact", "folded", "postings", "_trigrams", "_embeddings", "_lock")
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.exact = frozenset(self.columns)
+        self.folded = {}
+        self.postings = defaultdict(list)
+        self._trigrams = []
+        for position, column in enumerate(self.columns):
+            self.folded.setdefault(column.casefold(), column)
+            grams = trigrams(column)
+            self._trigrams.append(grams)
+            for gram in grams:
+                self.postings[gram].append(position)
+        self._embeddings = None
+        self._lock = threading.Lock()
+
+    def embeddings(self, model):
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = np.asarray(
+                        model.encode(self.columns, normalize_embeddings=True), dtype=np.float32
+                    )
+        return self._embeddings
+
+    def _trigram_match(self, column):
+        grams = trigrams(column)
+        shared = defaultdict(int)
+        for gram in grams:
+            for position in self.postings.get(gram, ()):
+                shared[position] += 1
+        best, best_score = None, 0.0
+        for position, count in shared.items():
+            score = count / (len(grams) + len(self._trigrams[position]) - count)
+            if score > best_score:
+                best, best_score = position, score
+        return (self.columns[best], best_score) if best is not None else (None, 0.0)
+
+    def correct(self, column, model=None, vector=None):
+        """
+        Closest valid column for ``column``.
+
+        Tries, in order: exact, case-folded, ``difflib`` close match, trigram
+        Jaccard similarity, and (when ``vector``, the ``embed_column()`` of
+        ``column``, is given) embedding cosine similarity. ``model`` encodes this
+        table's columns if they have no embeddings yet.
+
+        Returns:
+            tuple: ``(column, method)``, or ``(None, None)`` if nothing is close enough.
+        """
+        if column in self.exact:
+            return column, "exact"
+        folded = self.folded.get(column.casefold())
+        if folded is not None:
+            return folded, "casefold"
+        if not self.columns:
+            return None, None
+
+        matches = get_close_matches(column, self.columns, n=1, cutoff=CLOSE_MATCH_CUTOFF)
+        if matches:
+            return matches[0], "edit_distance"
+        match, score = self._trigram_match(column)
+        if score >= TRIGRAM_THRESHOLD:
+            return match, "trigram"
+
+        if vector is not None:
+            similarities = self.embeddings(model) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= SEMANTIC_THRESHOLD:
+                return self.columns[best], "semantic"
+        return None, None
+
+
+class ColumnCorrectionIndex:
+    """
+    ``TableColumns`` for every table of a schema snapshot, keyed by the table's
+    column names so mapped schemas derived from the snapshot share the entries.
+
+    Args:
+        schema_info (dict): Snapshot schema (``{"schemas": {...}}``).
+    """
+
+    def __init__(self, schema_info=None):
+        self._tables = {}
+        self._lock = threading.Lock()
+        for schema in (schema_info or {}).get("schemas", {}).values():
+            for table_info in schema.get("tables", {}).values():
+                self.table(table_info)
+
+    def table(self, table_info):
+        """
+        ``TableColumns`` for a table dict (anything with a ``columns`` mapping).
+        """
+        key = tuple(table_info.get("columns", {}))
+        entry = self._tables.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self._tables.setdefault(key, TableColumns(key))
+        return entry
+
+    def precompute_embeddings(self, model):
+        """
+        Encode every distinct column name of the index in one batch and hand each
+        table its rows, so semantic lookups don't encode columns during a request.
+        """
+        names = sorted({column for entry in self._tables.values() for column in entry.columns})
+        if not names:
+            return
+        vectors = np.asarray(model.encode(names, normalize_embeddings=True), dtype=np.float32)
+        positions = {name: position for position, name in enumerate(names)}
+        for entry in list(self._tables.values()):
+            entry._embeddings = vectors[[positions[column] for column in entry.columns]]
+
+    def __len__(self):
+        return len(self._tables)
+
+
+def embed_column(model, column):
+    """
+    Normalized embedding of a column reference, for ``TableColumns.correct()``.
+    """
+    return np.asarray(model.encode([column], normalize_embeddings=True), dtype=np.float32)[0]
+
+
+def _precompute_embeddings(index):
+    from .embedding_service import get_embedding_model
+
+    try:
+        index.precompute_embeddings(get_embedding_model())
+        logger.info(f"Precomputed column embeddings for {len(index)} tables")
+    except Exception as e:
+        # Semantic lookups keep encoding per table
+        logger.warning(f"Could not precompute column embeddings: {e}")
+
+
+def get_column_index():
+    """
+    Column-correction index of the current schema snapshot, built once per snapshot.
+
+    Only the lexical structures are built here; the column embeddings are
+    computed by a background thread, so no request waits for the embedding model.
+    """
+    snapshot = get_schema_snapshot()
+    fingerprint = snapshot.fingerprint if snapshot else ""
+    index = _indexes.get(fingerprint)
+    if index is None:
+        with _build_lock:
+            index = _indexes.get(fingerprint)
+            if index is None:
+                index = ColumnCorrectionIndex(snapshot.schema_info if snapshot else None)
+                _indexes.set(fingerprint, index)
+                logger.info(f"Built column-correction index over {len(index)} tables")
+                threading.Thread(
+                    target=_precompute_embeddings, args=(index,), name="column-embeddings", daemon=True
+                ).start()
+    return index
@@ -0,0 +1,395 @@
+# api_gateway/constrained_decoding.py
+import logging
+import re
+import string
+from collections import OrderedDict, defaultdict
+
+from .cache import LRUCache
+from .sql_stopping import SQLCompletionTracker
+
+logger = logging.getLogger(__name__)
+
+IDENTIFIER_CHARS = frozenset(string.ascii_letters + string.digits + "_$")
+WHITESPACE = " \n\t"
+# A subquery or a quoted identifier may follow FROM/JOIN instead of a table name;
+# tokens starting with these leave the position unconstrained.
+ESCAPE_CHARS = "(\""
+# After a qualifier, "*" selects every column (SELECT e.*, COUNT(e.*))
+QUALIFIED_ESCAPE_CHARS = ESCAPE_CHARS + "*"
+
+# Table positions: right after FROM / JOIN / UPDATE / INTO, with the identifier typed so far.
+TABLE_POSITION = re.compile(r"\b(FROM|JOIN|UPDATE|INTO)(?:(\s+)([A-Za-z_][\w.$]*)?)?$", re.IGNORECASE)
+# The keyword is not a table position after these words: IS [NOT] DISTINCT FROM,
+# ON CONFLICT ... DO UPDATE SET, FOR [NO KEY] UPDATE
+NOT_TABLE_AFTER = {"FROM": {"DISTINCT"}, "UPDATE": {"DO", "FOR", "KEY"}}
+PRECEDING_WORD = re.compile(r"([A-Za-z_]+)\s*$")
+# Qualified references: "alias.", "table.col", "schema.tab", "schema.table.col".
+QUALIFIED_POSITION = re.compile(r"(?<![\w.$])([A-Za-z_][\w$]*(?:\.[A-Za-z_][\w$]*)?)\.([A-Za-z_][\w$]*)?$")
+ALIAS_DECLARATION = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.$]*)\s+(?:AS\s+)?([A-Za-z_][\w$]*)", re.IGNORECASE)
+SELECT_OR_DELETE = re.compile(r"\b(?:SELECT|DELETE)\b", re.IGNORECASE)
+
+_BYTE_TOKEN = re.compile(r"^<0x([0-9A-Fa-f]{2})>$")
+
+# Allowed-token tensors kept per constraint, one per distinct position
+ALLOWED_CACHE_SIZE = 512
+
+# Rendered-prefix cache key -> SchemaConstraint
+_constraints = LRUCache("llm.schema_constraints", maxsize=256)
+
+
+def token_text(token):
+    """
+    Text a vocabulary entry appends to the output.
+
+    Handles SentencePiece ("▁" for spaces, ``<0xNN>`` byte fallback) and byte-level
+    BPE ("Ġ"/"Ċ") spellings. Returns None for non-ASCII byte pieces, which can never
+    be part of an identifier.
+    """
+    match = _BYTE_TOKEN.match(token)
+    if match:
+        value = int(match.group(1), 16)
+        return chr(value) if value < 0x80 else None
+    return token.replace("▁", " ").replace("Ġ", " ").replace("Ċ", "\n")
+
+
+class _VocabNode:
+    __slots__ = ("children", "ids", "subtree_ids", "terminator_ids")
+
+    def __init__(self):
+        self.children = {}
+        self.ids = []
+        self.subtree_ids = None
+        self.terminator_ids = None
+
+
+class VocabTrie:
+    """
+    Character trie over the tokenizer vocabulary.
+
+    Walking it in lockstep with an identifier trie yields every token that keeps the
+    output inside (or exactly completes) an allowed identifier, without scanning the
+    vocabulary per step.
+    """
+
+    def __init__(self, tokenizer):
+        self.root = _VocabNode()
+        self.eos_token_id = tokenizer.eos_token_id
+        self._word_ids = None
+        special = set(tokenizer.all_special_ids)
+
+        for token, token_id in tokenizer.get_vocab().items():
+            if token_id in special:
+                continue
+            text = token_text(token)
+            if not text:
+                continue
+            node = self.root
+            for char in text:
+                child = node.children.get(char)
+                if child is None:
+                    child = node.children[char] = _VocabNode()
+                node = child
+            node.ids.append(token_id)
+
+    def subtree(self, node):
+        """All token ids at or below ``node``."""
+        if node.subtree_ids is None:
+            ids, stack = [], [node]
+            while stack:
+                current = stack.pop()
+                ids.extend(current.ids)
+                stack.extend(current.children.values())
+            node.subtree_ids = ids
+        return node.subtree_ids
+
+    def word_continuations(self):
+        """Token ids that start with an identifier character."""
+        if self._word_ids is None:
+            self._word_ids = [
+                token_id
+                for char, child in self.root.children.items()
+                if char in IDENTIFIER_CHARS
+                for token_id in self.subtree(child)
+            ]
+        return self._word_ids
+
+    def terminators(self, node):
+        """Token ids below ``node`` whose next character ends an identifier."""
+        if node.terminator_ids is None:
+            node.terminator_ids = [
+                token_id
+                for char, child in node.children.items()
+                if char not in IDENTIFIER_CHARS
+                for token_id in self.subtree(child)
+            ]
+        return node.terminator_ids
+
+
+class _IdentifierNode:
+    __slots__ = ("children", "terminal")
+
+    def __init__(self):
+        self.children = {}
+        self.terminal = False
+
+
+def _identifier_trie(names):
+    root = _IdentifierNode()
+    for name in names:
+        node = root
+        for char in name:
+            node = node.children.setdefault(char, _IdentifierNode())
+        node.terminal = True
+    return root
+
+
+def _collect(vocab_node, identifier_node, vocab, out):
+    if identifier_node.terminal:
+        out.extend(vocab.terminators(vocab_node))
+    for char, identifier_child in identifier_node.children.items():
+        vocab_child = vocab_node.children.get(char)
+        if vocab_child is not None:
+            out.extend(vocab_child.ids)
+            _collect(vocab_child, identifier_child, vocab, out)
+
+
+def _from_introduces_table(text, keyword_start):
+    # FROM also appears inside EXTRACT(... FROM ...), SUBSTRING(... FROM ...) etc.;
+    # it names a table only if its own parenthesis level holds a SELECT or DELETE.
+    depth = 0
+    segment_start = 0
+    for index in range(keyword_start - 1, -1, -1):
+        char = text[index]
+        if char == ")":
+            depth += 1
+        elif char == "(":
+            if depth == 0:
+                segment_start = index + 1
+                break
+            depth -= 1
+    return SELECT_OR_DELETE.search(text, segment_start, keyword_start) is not None
+
+
+class SchemaConstraint:
+    """
+    Identifiers a generated query may use, taken from the mapped schema.
+
+    Table positions (after FROM/JOIN/UPDATE/INTO) may only spell a mapped table, with
+    or without its schema. Qualified column references (``alias.col``) may only name
+    a column of the table the qualifier resolves to, or of any mapped table when the
+    alias is not declared yet (SELECT lists come before FROM). Unqualified names are
+    left alone, since they are indistinguishable from keywords, functions and output
+    aliases while decoding.
+
+    Args:
+        mapped_schema (dict): Schema passed to the prompt.
+    """
+
+    def __init__(self, mapped_schema):
+        table_names = set()
+        schema_tables = defaultdict(set)
+        table_columns = {}
+        all_columns = set()
+
+        for full_name, table_info in mapped_schema.get("tables", {}).items():
+            schema_name, _, short_name = full_name.rpartition(".")
+            columns = set(table_info.get("columns", {}))
+            table_names.update((full_name, short_name))
+            if schema_name:
+                schema_tables[schema_name].add(short_name)
+            table_columns[full_name] = columns
+            table_columns.setdefault(short_name, set()).update(columns)
+            all_columns.update(columns)
+
+        self.table_columns = table_columns
+        self.schemas = set(schema_tables)
+        self._tries = {("tables", None): _identifier_trie(table_names), ("columns", None): _identifier_trie(all_columns)}
+        self._tries.update({("columns", table): _identifier_trie(columns) for table, columns in table_columns.items()})
+        self._tries.update({("schema", schema): _identifier_trie(tables) for schema, tables in schema_tables.items()})
+        self._allowed = OrderedDict()
+
+    def _resolve_qualifier(self, qualifier, text):
+        if qualifier in self.table_columns:
+            return ("columns", qualifier)
+        if qualifier in self.schemas:
+            return ("schema", qualifier)
+        for table, alias in ALIAS_DECLARATION.findall(text):
+            if alias == qualifier and table in self.table_columns:
+                return ("columns", table)
+        # CTE or derived table: its columns are whatever the subquery produces
+        escaped = re.escape(qualifier)
+        if re.search(rf"\b{escaped}\s+AS\s*\(|\)\s*(?:AS\s+)?{escaped}\b", text, re.IGNORECASE):
+            return None
+        return ("columns", None)
+
+    def position(self, text):
+        """
+        Classify the end of the generated text.
+
+        Returns:
+            tuple: ``(trie_key, partial, needs_space)`` when the next token continues
+            a constrained identifier, else None.
+        """
+        match = TABLE_POSITION.search(text)
+        if match:
+            keyword = match.group(1).upper()
+            preceding = PRECEDING_WORD.search(text, 0, match.start())
+            if preceding and preceding.group(1).upper() in NOT_TABLE_AFTER.get(keyword, ()):
+                return None
+            if keyword == "FROM" and not _from_introduces_table(text, match.start()):
+                return None
+            if not match.group(2):
+                return ("tables", None), "", True
+            return ("tables", None), match.group(3) or "", False
+
+        match = QUALIFIED_POSITION.search(text)
+        if match:
+            trie_key = self._resolve_qualifier(match.group(1), text)
+            if trie_key is not None:
+                return trie_key, match.group(2) or "", False
+        return None
+
+    def allowed_token_ids(self, vocab, text):
+        """
+        Token ids allowed next, or None when the position is unconstrained.
+
+        Args:
+            vocab (VocabTrie): Trie of the generating tokenizer's vocabulary.
+            text (str): SQL generated so far.
+
+        Returns:
+            torch.Tensor: Allowed token ids, or None.
+        """
+        position = self.position(text)
+        if position is None:
+            return None
+        if position in self._allowed:
+            self._allowed.move_to_end(position)
+            return self._allowed[position]
+
+        import torch
+
+        ids = self._allowed_ids(vocab, position)
+        allowed = torch.tensor(ids, dtype=torch.long) if ids else None
+        self._allowed[position] = allowed
+        if len(self._allowed) > ALLOWED_CACHE_SIZE:
+            self._allowed.popitem(last=False)
+        return allowed
+
+    def _allowed_ids(self, vocab, position):
+        # Sorted token ids for a position from position(), or None if unconstrained
+        trie_key, partial, needs_space = position
+        node = self._tries.get(trie_key)
+        for char in partial:
+            node = node.children.get(char) if node is not None else None
+        # Off the trie already (e.g. a quoted or mis-cased identifier): leave it be
+        if node is None:
+            return None
+
+        ids = []
+        starts = [vocab.root]
+        if needs_space:
+            starts = [vocab.root.children[char] for char in WHITESPACE if char in vocab.root.children]
+            for start in starts:
+                ids.extend(start.ids)
+            # The "keyword" may still be the start of a longer name (from_date)
+            ids.extend(vocab.word_continuations())
+        if not partial:
+            escapes = QUALIFIED_ESCAPE_CHARS if trie_key[0] == "columns" else ESCAPE_CHARS
+            for start in starts:
+                for char in escapes:
+                    if char in start.children:
+                        ids.extend(vocab.subtree(start.children[char]))
+        if node.terminal and vocab.eos_token_id is not None:
+            ids.append(vocab.eos_token_id)
+        for start in starts:
+            _collect(start, node, vocab, ids)
+        return sorted(set(ids)) or None
+
+
+def get_schema_constraint(mapped_schema, cache_key):
+    """
+    Shared ``SchemaConstraint`` for a mapped schema.
+
+    Args:
+        mapped_schema (dict): Schema passed to the prompt.
+        cache_key: Identifies the rendered schema, e.g. ``prefix_cache_key()``.
+    """
+    constraint = _constraints.get(cache_key)
+    if constraint is None:
+        constraint = SchemaConstraint(mapped_schema)
+        _constraints.set(cache_key, constraint)
+    return constraint
+
+
+class _RowScanner:
+    # Decodes one row's output and tracks its string literals and comments,
+    # incrementally: each step decodes only the last couple of tokens.
+    __slots__ = ("text", "tracker", "prefix_offset", "read_offset")
+
+    def __init__(self):
+        self.text = ""
+        self.tracker = SQLCompletionTracker()
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def advance(self, tokenizer, ids):
+        """
+        Extend the text with the new tokens of ``ids`` (the row's generated ids).
+
+        The new text is the decoding of the tokens from ``prefix_offset`` minus that
+        of the already read ones, so word-boundary spaces come out as in a full
+        decode. An incomplete byte sequence waits for its next token.
+
+        Returns:
+            bool: Whether the end of the text is outside literals and comments.
+        """
+        window = ids[self.prefix_offset:]
+        read = tokenizer.decode(window[:self.read_offset - self.prefix_offset], skip_special_tokens=True)
+        decoded = tokenizer.decode(window, skip_special_tokens=True)
+        if len(decoded) > len(read) and not decoded.endswith("\ufffd"):
+            new_text = decoded[len(read):]
+            self.tracker.feed(new_text)
+            self.text += new_text
+            self.prefix_offset, self.read_offset = self.read_offset, len(ids)
+        return not (self.tracker.quote or self.tracker.comment)
+
+
+class SchemaConstrainedLogitsProcessor:
+    """
+    Masks the logits of tokens that would spell an identifier missing from the schema.
+
+    Follows the transformers ``LogitsProcessor`` call protocol. Rows of a batch may
+    belong to different requests, so each row carries its own constraint (None leaves
+    the row unconstrained).
+
+    Args:
+        tokenizer: Tokenizer of the generating model.
+        vocab (VocabTrie): Vocabulary trie for ``tokenizer``.
+        constraints (list): One ``SchemaConstraint`` or None per row.
+        prompt_length (int): Padded prompt length; generated tokens start here.
+    """
+
+    def __init__(self, tokenizer, vocab, constraints, prompt_length):
+        self.tokenizer = tokenizer
+        self.vocab = vocab
+        self.constraints = constraints
+        self.prompt_length = prompt_length
+        self._scanners = [_RowScanner() for _ in constraints]
+
+    def __call__(self, input_ids, scores):
+        import torch
+
+        for row, constraint in enumerate(self.constraints):
+            if constraint is None:
+                continue
+            scanner = self._scanners[row]
+            if not scanner.advance(self.tokenizer, input_ids[row, self.prompt_length:]):
+                continue
+            allowed = constraint.allowed_token_ids(self.vocab, scanner.text)
+            if allowed is None:
+                continue
+            mask = torch.full_like(scores[row], float("-inf"))
+            mask[allowed.to(scores.device)] = 0
+            scores[row] = scores[row] + mask
+        return scores
@@ -0,0 +1,250 @@
+# api_gateway/db_pool.py
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from django.conf import settings
+
+from .registry import register
+
+logger = logging.getLogger(__name__)
+
+# Session credential fields (see connect_to_db) -> psycopg2.connect() keywords
+CREDENTIAL_KEYWORDS = {
+    "db_host": "host",
+    "db_port": "port",
+    "db_name": "dbname",
+    "db_user": "user",
+    "db_password": "password",
+}
+
+
+class PoolExhausted(Exception):
+    """No connection became available within the acquire timeout."""
+
+
+def connect_kwargs(db_credentials):
+    """
+    Translate stored session credentials into ``psycopg2.connect()`` keywords.
+
+    Accepts both the ``db_*`` names saved by ``connect_to_db`` and plain psycopg2
+    names; empty values are dropped.
+    """
+    kwargs = {}
+    for key, value in db_credentials.items():
+        if value in (None, ""):
+            continue
+        kwargs[CREDENTIAL_KEYWORDS.get(key, key)] = value
+    return kwargs
+
+
+def credentials_key(kwargs):
+    """
+    Pool key for a set of connection keywords; a digest, so passwords are never
+    kept as dictionary keys or logged.
+    """
+    payload = json.dumps(kwargs, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+class _IdleConnection:
+    __slots__ = ("conn", "since")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.since = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    Connections to one database as one user. Only touched under the manager's lock.
+    """
+
+    def __init__(self, key, kwargs):
+        self.key = key
+        self.kwargs = kwargs
+        self.idle = deque()
+        self.in_use = 0
+
+    @property
+    def size(self):
+        return self.in_use + len(self.idle)
+
+
+class PoolManager:
+    """
+    Pools of warm psycopg2 connections to user databases, one per credential set.
+
+    Args:
+        max_size (int): Connections per pool (in use plus idle).
+        max_total (int): Connections across all pools; idle connections of other
+            pools are closed to make room before a caller has to wait.
+        idle_timeout (float): Seconds after which an idle connection is closed.
+        health_check_after (float): Idle seconds after which a connection is
+            pinged before being handed out.
+        acquire_timeout (float): Seconds to wait for a free connection.
+        connect_timeout (int): TCP connect timeout passed to libpq.
+    """
+
+    def __init__(self, max_size=5, max_total=50, idle_timeout=300, health_check_after=30,
+                 acquire_timeout=10, connect_timeout=5):
+        self.max_size = max_size
+        self.max_total = max_total
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+        self.connect_timeout = connect_timeout
+        self._pools = {}
+        self._total = 0
+        # Shared by every pool, since a freed slot also counts against max_total;
+        # waiters re-check their own pool, so releases wake them all
+        self._condition = threading.Condition()
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Error closing pooled connection: {e}")
+
+    def _evict_idle(self, now):
+        # Close connections idle past idle_timeout; drop pools left empty.
+        for key, pool in list(self._pools.items()):
+            while pool.idle and now - pool.idle[0].since > self.idle_timeout:
+                self._close(pool.idle.popleft().conn)
+                self._total -= 1
+            if pool.size == 0:
+                del self._pools[key]
+
+    def _close_oldest_idle(self):
+        oldest = None
+        for pool in self._pools.values():
+            if pool.idle and (oldest is None or pool.idle[0].since < oldest.idle[0].since):
+                oldest = pool
+        if oldest is None:
+            return False
+        self._close(oldest.idle.popleft().conn)
+        self._total -= 1
+        return True
+
+    def _healthy(self, idle):
+        conn = idle.conn
+        if conn.closed:
+            return False
+        if time.monotonic() - idle.since < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            logger.info(f"Discarding unhealthy pooled connection: {e}")
+            return False
+
+    def acquire(self, db_credentials):
+        """
+        Check out a connection for ``db_credentials``; pair with ``release()``.
+
+        Raises:
+            PoolExhausted: If no connection frees up within ``acquire_timeout``.
+            psycopg2.Error: If a new connection cannot be opened.
+        """
+        kwargs = connect_kwargs(db_credentials)
+        key = credentials_key(kwargs)
+        deadline = time.monotonic() + self.acquire_timeout
+
+        with self._condition:
+            while True:
+                self._evict_idle(time.monotonic())
+                pool = self._pools.setdefault(key, ConnectionPool(key, kwargs))
+                if pool.idle:
+                    idle = pool.idle.pop()
+                    pool.in_use += 1
+                    break
+                if pool.size < self.max_size and (self._total < self.max_total or self._close_oldest_idle()):
+                    # Reserve the slot, then connect outside the lock
+                    idle = None
+                    pool.in_use += 1
+                    self._total += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted(f"No database connection available within {self.acquire_timeout}s")
+                self._condition.wait(remaining)
+
+        if idle is not None:
+            # Health checks run outside the lock; a dead connection is replaced
+            if self._healthy(idle):
+                return pool, idle.conn
+            self._close(idle.conn)
+
+        try:
+            conn = psycopg2.connect(connect_timeout=self.connect_timeout, **kwargs)
+        except Exception:
+            with self._condition:
+                pool.in_use -= 1
+                self._total -= 1
+                self._condition.notify_all()
+            raise
+        return pool, conn
+
+    def release(self, pool, conn, discard=False):
+        """
+        Return a checked-out connection. Open transactions are rolled back; broken
+        or discarded connections are closed instead of pooled.
+        """
+        if not discard and not conn.closed:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._condition:
+            pool.in_use -= 1
+            if discard or conn.closed:
+                self._close(conn)
+                self._total -= 1
+            else:
+                pool.idle.append(_IdleConnection(conn))
+            self._condition.notify_all()
+
+    @contextmanager
+    def connection(self, db_credentials):
+        """
+        Context manager yielding a pooled connection for ``db_credentials``.
+        """
+        pool, conn = self.acquire(db_credentials)
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.InterfaceError, psycopg2.OperationalError):
+            discard = True
+            raise
+        finally:
+            self.release(pool, conn, discard=discard)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "total": self._total,
+                "pools": {key[:8]: {"in_use": pool.in_use, "idle": len(pool.idle)} for key, pool in self._pools.items()},
+            }
+
+
+_manager = register("db_pool", lambda: PoolManager(
+    max_size=getattr(settings, "DB_POOL_MAX_SIZE", 5),
+    max_total=getattr(settings, "DB_POOL_MAX_TOTAL", 50),
+    idle_timeout=getattr(settings, "DB_POOL_IDLE_TIMEOUT", 300),
+    health_check_after=getattr(settings, "DB_POOL_HEALTH_CHECK_AFTER", 30),
+    acquire_timeout=getattr(settings, "DB_POOL_ACQUIRE_TIMEOUT", 10),
+    connect_timeout=getattr(settings, "DB_CONNECT_TIMEOUT", 5),
+))
+
+
+def get_pool_manager():
+    return _manager.get()
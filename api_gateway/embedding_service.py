@@ -1,84 +1,243 @@
 # api_gateway/embedding_service.py
-from sentence_transformers import SentenceTransformer
-from .utils import initialize_pinecone
-from .schema_extractor import get_schema, flatten_schema_info
+from django.conf import settings
+from .cache import CacheCounters, LRUCache
+from .lexical_index import fuse_rankings, get_lexical_index
+from .registry import register
+from .utils import get_binary_redis, get_redis, get_vector_store
+from .schema_extractor import get_schema, iter_schema_elements
+from .schema_indexer import index_schema_elements
+import hashlib
+import json
 import logging
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
-# Initialize the Sentence Transformer model
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-# Initialize Pinecone index
-pinecone_index = initialize_pinecone()
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 
-def store_schema_embeddings():
+
+def _load_embedding_model():
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+
+# The Sentence Transformer model is loaded on first use (or by registry.warmup());
+# the vector store (Pinecone or the local index, see VECTOR_STORE_BACKEND) likewise.
+_embedding_model = register("embedding_model", _load_embedding_model)
+
+
+def get_embedding_model():
+    return _embedding_model.get()
+
+# Bumped by store_schema_embeddings() whenever the indexed content changes, so
+# cached retrieval results from an older index are never served.
+INDEX_VERSION_KEY = "schema_index:version"
+QUERY_EMBEDDING_KEY = "qp:query_embedding:{digest}"
+RETRIEVAL_KEY = "qp:retrieval:{version}:{top_k}:{digest}"
+
+query_embedding_cache = LRUCache(
+    "query_embedding",
+    maxsize=getattr(settings, "QUERY_CACHE_SIZE", 10000),
+    ttl=getattr(settings, "QUERY_CACHE_TTL", 3600),
+)
+retrieval_cache = LRUCache(
+    "retrieval",
+    maxsize=getattr(settings, "QUERY_CACHE_SIZE", 10000),
+    ttl=getattr(settings, "RETRIEVAL_CACHE_TTL", 600),
+)
+# The index version is re-read from Redis at most every few seconds.
+index_version_cache = LRUCache("index_version", maxsize=1, ttl=5)
+shared_query_embedding_counters = CacheCounters("query_embedding.redis")
+shared_retrieval_counters = CacheCounters("retrieval.redis")
+# Hits are questions answered by exact identifiers without a vector search
+lexical_fast_path_counters = CacheCounters("retrieval.lexical_fast_path")
+
+def store_schema_embeddings(full_rebuild=False):
     """
-    Generate and store schema embeddings in Pinecone. 
-    Break the process and raise an error on any failure.
+    Incrementally sync schema embeddings in the vector store with the current database schema.
+
+    Only elements added or changed since the last run are embedded and upserted,
+    and vectors of dropped elements are deleted. Raises on any failure.
+
+    Args:
+        full_rebuild (bool): Re-upsert every element regardless of the manifest.
+
+    Returns:
+        dict: Indexing statistics.
     """
     schema_info = get_schema()  # Retrieve the schema information from the database
-    schema_elements = flatten_schema_info(schema_info)
-    
-    for element in schema_elements:
-        print("\n Schema element:", element)
-        
-        # Generate embedding for the schema element description
-        description = element.get("description", "")
-        if not description:
-            raise ValueError(f"Missing description for schema element: {element}")
-        
-        embedding = model.encode(description).tolist()
-
-        # Prepare metadata for Pinecone
-        metadata = {
-            "type": element.get("type", "unknown"),
-            "schema": element.get("schema", "unknown"),
-            "table": element.get("table", "unknown"),
-            "name": element.get("name"),
-            "description": description
-        }
-        
-        if element["type"] == "foreign_key":
-            metadata.update({
-                "related_table": element.get("related_table", "unknown"),
-                "related_column": element.get("related_column", "unknown"),
-                "constraint_name": element.get("constraint_name", "unknown")
-            })
-        
-        # Special handling for primary_key type
-        if element["type"] == "primary_key":
-            metadata["name"] = element.get("column", "unknown")
-        
-        # Validate metadata to ensure no invalid values
-        for key, value in metadata.items():
-            if value is None:
-                raise ValueError(f"Invalid metadata for element: {element}. Missing value for '{key}'.")
+    if schema_info is None:
+        raise RuntimeError("Could not retrieve schema information for indexing.")
+
+    stats = index_schema_elements(
+        iter_schema_elements(schema_info),
+        get_embedding_model(),
+        get_vector_store(),
+        EMBEDDING_MODEL_NAME,
+        full_rebuild=full_rebuild,
+    )
+    if stats["upserted"] or stats["removed"]:
+        get_redis().set(INDEX_VERSION_KEY, stats["version"])
+        index_version_cache.clear()
+    return stats
+
+
+
+def normalize_query(query):
+    """
+    Canonical form of a query for cache keys. The embedding model is uncased, so
+    case and whitespace differences do not change the embedding.
+    """
+    return " ".join(query.lower().split())
+
 
-        # Attempt to store embedding in Pinecone
+def _digest(data):
+    return hashlib.sha256(data if isinstance(data, bytes) else data.encode()).hexdigest()
+
+
+def _shared_caching_enabled():
+    return getattr(settings, "QUERY_CACHE_REDIS", True)
+
+
+def get_index_version():
+    """
+    Version token of the schema index, "0" if it has never been published.
+    """
+    version = index_version_cache.get("version")
+    if version is None:
         try:
-            pinecone_index.upsert([(description, embedding, metadata)])
+            version = get_redis().get(INDEX_VERSION_KEY) or "0"
         except Exception as e:
-            raise RuntimeError(f"Error storing embedding for element: {description}. Error: {e}")
+            logger.warning(f"Could not read schema index version: {e}")
+            version = "0"
+        index_version_cache.set("version", version)
+    return version
 
 
+def embed_query(query):
+    """
+    Embed a natural language query, reusing embeddings of previously seen queries.
+
+    Looks in the process-local LRU first, then in Redis (shared by all workers),
+    and only runs the encoder on a miss in both.
+
+    Args:
+        query (str): User's query in natural language.
+
+    Returns:
+        np.ndarray: float32 query embedding.
+    """
+    normalized = normalize_query(query)
+    embedding = query_embedding_cache.get(normalized)
+    if embedding is not None:
+        return embedding
+
+    redis_key = QUERY_EMBEDDING_KEY.format(digest=_digest(f"{EMBEDDING_MODEL_NAME}\0{normalized}"))
+    if _shared_caching_enabled():
+        try:
+            payload = get_binary_redis().get(redis_key)
+        except Exception as e:
+            logger.warning(f"Could not read shared query embedding: {e}")
+            payload = None
+        if payload:
+            shared_query_embedding_counters.hit()
+            embedding = np.frombuffer(payload, dtype=np.float32)
+            query_embedding_cache.set(normalized, embedding)
+            return embedding
+        shared_query_embedding_counters.miss()
+
+    embedding = np.asarray(get_embedding_model().encode([normalized])[0], dtype=np.float32)
+    query_embedding_cache.set(normalized, embedding)
+    if _shared_caching_enabled():
+        try:
+            get_binary_redis().set(redis_key, embedding.tobytes(), ex=getattr(settings, "QUERY_CACHE_TTL", 3600))
+        except Exception as e:
+            logger.warning(f"Could not store shared query embedding: {e}")
+    return embedding
+
+
+def retrieve_relevant_schema(query, top_k=5):
+    """
+    Schema elements relevant to a natural language query, best first.
+
+    A question that names its tables and columns verbatim is answered from the
+    lexical index alone, without embedding it. Otherwise the BM25 and vector
+    rankings are fused (reciprocal rank fusion).
+
+    Args:
+        query (str): User's query in natural language.
+        top_k (int): Number of elements to return.
+
+    Returns:
+        list: Elements with id, name, type, schema, table, description and score.
+    """
+    if not getattr(settings, "RETRIEVAL_LEXICAL_ENABLED", True):
+        return search_vectors(query, top_k)
 
-def retrieve_relevant_schema(query):
-    # Step 1: Generate embedding for the query
-    query_embedding = model.encode([query])[0]
-    
-    # Step 2: Retrieve top relevant schema elements from Pinecone
     try:
-        result = pinecone_index.query(
+        index = get_lexical_index()
+        exact = index.exact_matches(query, getattr(settings, "RETRIEVAL_LEXICAL_COVERAGE", 0.5))
+    except Exception as e:
+        logger.warning(f"Lexical schema retrieval failed: {e}")
+        return search_vectors(query, top_k)
+
+    if exact:
+        lexical_fast_path_counters.hit()
+        return [index.result(position, 1.0) for position in exact]
+    lexical_fast_path_counters.miss()
+
+    depth = max(top_k, getattr(settings, "RETRIEVAL_CANDIDATES", 20))
+    lexical = [index.result(position, score) for position, score in index.search(query, depth)]
+    vector = search_vectors(query, depth)
+    if not lexical:
+        return vector[:top_k]
+    return fuse_rankings([vector, lexical] if vector else [lexical], top_k)
+
+
+def search_vectors(query, top_k=5):
+    """
+    Nearest schema elements to the query embedding in the vector store.
+    """
+    # Step 1: Generate (or reuse) the embedding for the query
+    query_embedding = embed_query(query)
+
+    # Step 2: Reuse the result of an identical search against the same index version
+    version = get_index_version()
+    cache_key = (version, top_k, _digest(query_embedding.tobytes()))
+    cached = retrieval_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    redis_key = RETRIEVAL_KEY.format(version=version, top_k=top_k, digest=cache_key[2])
+    if _shared_caching_enabled():
+        try:
+            payload = get_redis().get(redis_key)
+        except Exception as e:
+            logger.warning(f"Could not read shared retrieval result: {e}")
+            payload = None
+        if payload:
+            shared_retrieval_counters.hit()
+            relevant = json.loads(payload)
+            retrieval_cache.set(cache_key, relevant)
+            return relevant
+        shared_retrieval_counters.miss()
+
+    # Step 3: Retrieve top relevant schema elements from the vector store
+    try:
+        result = get_vector_store().query(
             vector=query_embedding.tolist(),
-            top_k=5,  # Retrieve top 5 relevant schema elements
+            top_k=top_k,  # Retrieve top relevant schema elements
             include_metadata=True
         )
         
-        return [
+        relevant = [
             {
+                "id": match["id"],
                 "name": match["metadata"].get("name"),
                 "type": match["metadata"].get("type"),
                 "schema": match["metadata"].get("schema"),
+                "table": match["metadata"].get("table"),
                 "description": match["metadata"]["description"],
                 "score": match["score"]
             }
@@ -88,6 +247,14 @@ def retrieve_relevant_schema(query):
     except Exception as e:
         logger.error(f"Error retrieving relevant schema: {e}")
         return []
+
+    retrieval_cache.set(cache_key, relevant)
+    if _shared_caching_enabled():
+        try:
+            get_redis().set(redis_key, json.dumps(relevant), ex=getattr(settings, "RETRIEVAL_CACHE_TTL", 600))
+        except Exception as e:
+            logger.warning(f"Could not store shared retrieval result: {e}")
+    return relevant
     
 
 #store_schema_embeddings()
\ No newline at end of file
@@ -0,0 +1,152 @@
+# api_gateway/generation_scheduler.py
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationRequest:
+    """
+    One prompt waiting for generation, and the future its caller blocks on.
+    """
+
+    __slots__ = ("prompt", "prefix", "cache_key", "constraint", "streamer", "future", "enqueued_at")
+
+    def __init__(self, prompt, prefix=None, cache_key=None, constraint=None, streamer=None):
+        self.prompt = prompt
+        self.prefix = prefix
+        self.cache_key = cache_key
+        self.constraint = constraint
+        self.streamer = streamer
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class GenerationScheduler:
+    """
+    Dynamic micro-batching in front of a generation backend.
+
+    Callers submit single prompts from any thread. A single worker thread takes
+    the first pending request, keeps collecting more for up to ``max_wait_ms`` (or
+    until ``max_batch_size`` is reached), runs them as one padded ``generate()``
+    call and resolves each request's future with its own decoded output. Under
+    light load a request waits at most ``max_wait_ms``; under heavy load batches
+    fill up and throughput grows with the number of concurrent users.
+
+    A request that ends up alone in its batch and carries a schema prefix goes
+    through the backend's prefix KV cache instead, which is where prefill time
+    matters most. Streaming requests always run on their own.
+
+    Args:
+        backend (GenerationBackend): Backend that runs the batched generation.
+        max_batch_size (int): Largest number of prompts per ``generate()`` call.
+        max_wait_ms (float): How long to hold the first request for company.
+        max_new_tokens (int): Generation length limit passed to the backend.
+    """
+
+    def __init__(self, backend, max_batch_size=8, max_wait_ms=10, max_new_tokens=400):
+        self.backend = backend
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.max_new_tokens = max_new_tokens
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def submit(self, prompt, prefix=None, cache_key=None, constraint=None):
+        """
+        Queue a prompt for generation.
+
+        Args:
+            prompt (str): Full prompt.
+            prefix (str): Optional leading part of ``prompt`` shared across requests.
+            cache_key: Prefix cache key for ``prefix``.
+            constraint (SchemaConstraint): Optional identifier constraint for decoding.
+
+        Returns:
+            Future: Resolves to the decoded output for ``prompt``.
+        """
+        self._ensure_worker()
+        request = GenerationRequest(prompt, prefix, cache_key, constraint)
+        self._queue.put(request)
+        return request.future
+
+    def stream(self, prompt, prefix=None, cache_key=None, constraint=None):
+        """
+        Queue a prompt whose output should be streamed as it decodes.
+
+        Returns:
+            tuple: ``(streamer, future)``. Iterating the streamer yields text chunks
+            until generation ends; the future then holds the full decoded output.
+        """
+        self._ensure_worker()
+        request = GenerationRequest(prompt, prefix, cache_key, constraint, streamer=self.backend.create_streamer())
+        self._queue.put(request)
+        return request.streamer, request.future
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="generation-scheduler", daemon=True)
+                    self._worker.start()
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Requests that queued up during the previous generate() are taken
+                # without waiting; otherwise wait out the remaining window.
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _execute(self, batch):
+        first = batch[0]
+        if len(batch) == 1 and first.cache_key is not None:
+            return self.backend.generate_with_prefix(
+                first.prompt, first.prefix, first.cache_key,
+                max_new_tokens=self.max_new_tokens, streamer=first.streamer, constraint=first.constraint,
+            )
+        return self.backend.generate(
+            [request.prompt for request in batch],
+            max_new_tokens=self.max_new_tokens,
+            streamer=first.streamer,
+            constraints=[request.constraint for request in batch],
+        )
+
+    def _run(self):
+        while True:
+            collected = self._collect_batch()
+            started = time.monotonic()
+            # A streamer follows a single sequence, so streaming requests run alone.
+            batches = [[request] for request in collected if request.streamer is not None]
+            batched = [request for request in collected if request.streamer is None]
+            if batched:
+                batches.append(batched)
+
+            for batch in batches:
+                try:
+                    outputs = self._execute(batch)
+                    for request, output in zip(batch, outputs):
+                        request.future.set_result(output)
+                except Exception as e:
+                    logger.error(f"Batched generation of {len(batch)} prompt(s) failed: {e}")
+                    for request in batch:
+                        request.future.set_exception(e)
+                        if request.streamer is not None:
+                            # Unblock the consumer; it reads the error from the future.
+                            request.streamer.end()
+                finally:
+                    try:
+                        self.backend.release()
+                    except Exception as e:
+                        logger.warning(f"Could not release generation memory: {e}")
+            waited = max(started - request.enqueued_at for request in collected)
+            logger.info(f"Generated batch of {len(collected)} (longest queue wait {waited * 1000:.1f} ms)")
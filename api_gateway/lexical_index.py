@@ -0,0 +1,208 @@
+# api_gateway/lexical_index.py
+import logging
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from .cache import LRUCache
+from .schema_cache import get_schema_snapshot
+from .schema_extractor import iter_schema_elements
+from .schema_indexer import element_id, element_metadata
+
+logger = logging.getLogger(__name__)
+
+# BM25 parameters and the reciprocal rank fusion constant
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+WORD = re.compile(r"[A-Za-z0-9_]+")
+SUBWORD = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+# Question words that never name a schema element
+STOPWORDS = frozenset((
+    "a", "all", "an", "and", "are", "as", "at", "be", "by", "each", "for", "from", "get",
+    "give", "how", "in", "is", "it", "list", "many", "me", "much", "of", "on", "or", "per",
+    "show", "the", "to", "what", "which", "who", "with",
+))
+
+# Snapshot fingerprint -> LexicalIndex
+_indexes = LRUCache("lexical.index", maxsize=4)
+_build_lock = threading.Lock()
+
+
+def tokenize(text):
+    """
+    Lower-cased words of ``text``, each followed by its snake/camel-case parts
+    (``HireDate`` -> ``hiredate``, ``hire``, ``date``).
+    """
+    tokens = []
+    for word in WORD.findall(text):
+        folded = word.lower()
+        tokens.append(folded)
+        parts = [part.lower() for piece in word.split("_") for part in SUBWORD.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def _question_terms(question):
+    # Whole words of the question, without stopwords and bare numbers
+    return [
+        word for word in (match.lower() for match in WORD.findall(question))
+        if word not in STOPWORDS and not word.isdigit()
+    ]
+
+
+class LexicalIndex:
+    """
+    BM25 index over schema elements plus exact lookups of table and column names.
+
+    Documents are the same column / primary-key elements that are embedded into the
+    vector store, under the same ids, so lexical and vector rankings can be fused.
+    A document's text is its table name, its column name and its description.
+
+    Args:
+        schema_info (dict): Snapshot schema (``{"schemas": {...}}``).
+    """
+
+    def __init__(self, schema_info=None):
+        self.elements = []
+        self.postings = defaultdict(list)
+        self.lengths = []
+        # Exact identifiers: table name -> (schema, table) pairs, and
+        # (schema, table) -> {column name: element position}
+        self.tables = defaultdict(list)
+        self.columns = defaultdict(dict)
+        self.vocabulary = set()
+
+        for element in iter_schema_elements(schema_info or {"schemas": {}}):
+            metadata = element_metadata(element)
+            position = len(self.elements)
+            self.elements.append({
+                "id": element_id(element),
+                "name": metadata["name"],
+                "type": metadata["type"],
+                "schema": metadata["schema"],
+                "table": metadata["table"],
+                "description": metadata["description"],
+            })
+            identifiers = tokenize(metadata["table"]) + tokenize(metadata["name"])
+            self.vocabulary.update(identifiers)
+            counts = Counter(identifiers + tokenize(metadata["description"]))
+            for term, frequency in counts.items():
+                self.postings[term].append((position, frequency))
+            self.lengths.append(sum(counts.values()))
+
+            key = (metadata["schema"], metadata["table"])
+            if key not in self.columns:
+                self.tables[metadata["table"].lower()].append(key)
+            # Columns win over the primary-key element of the same column
+            self.columns[key].setdefault(metadata["name"].lower(), position)
+
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        self.idf = {
+            term: math.log(1 + (len(self.elements) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, question, top_k=10):
+        """
+        BM25 ranking of the elements for ``question``.
+
+        Returns:
+            list: ``(position, score)`` pairs, best first.
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(question)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, frequency in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[position] / self.average_length)
+                scores[position] += idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def exact_matches(self, question, min_coverage=0.5):
+        """
+        Elements named verbatim by a question that spells out its tables and columns.
+
+        The question is covered when it names at least one table, at least
+        ``min_coverage`` of its terms are table or column names of the named tables,
+        and none of the other terms is part of any schema identifier (those are left
+        to the ranked search). A named table without a named column is represented by
+        its first element.
+
+        Returns:
+            list: Element positions, or None if the question is not covered.
+        """
+        terms = _question_terms(question)
+        named_tables = [key for term in terms for key in self.tables.get(term, ())]
+        if not named_tables:
+            return None
+
+        positions, matched = [], 0
+        for term in terms:
+            hits = [self.columns[key][term] for key in named_tables if term in self.columns[key]]
+            if hits:
+                positions.extend(hits)
+            elif term not in self.tables:
+                if term in self.vocabulary:
+                    return None
+                continue
+            matched += 1
+        if matched < min_coverage * len(terms):
+            return None
+
+        covered = {(self.elements[position]["schema"], self.elements[position]["table"]) for position in positions}
+        for key in named_tables:
+            if key not in covered and self.columns[key]:
+                positions.append(next(iter(self.columns[key].values())))
+        return list(dict.fromkeys(positions))
+
+    def result(self, position, score):
+        return {**self.elements[position], "score": score}
+
+    def __len__(self):
+        return len(self.elements)
+
+
+def get_lexical_index():
+    """
+    Lexical index of the current schema snapshot, built once per snapshot.
+    """
+    snapshot = get_schema_snapshot()
+    fingerprint = snapshot.fingerprint if snapshot else ""
+    index = _indexes.get(fingerprint)
+    if index is None:
+        with _build_lock:
+            index = _indexes.get(fingerprint)
+            if index is None:
+                index = LexicalIndex(snapshot.schema_info if snapshot else None)
+                _indexes.set(fingerprint, index)
+                logger.info(f"Built lexical schema index over {len(index)} elements")
+    return index
+
+
+def fuse_rankings(rankings, top_k):
+    """
+    Reciprocal rank fusion of several result lists of schema elements.
+
+    Scores are scaled so that an item ranked first in every list scores 1.0.
+
+    Returns:
+        list: Up to ``top_k`` items, best first, each with its fused ``score``.
+    """
+    k = getattr(settings, "RETRIEVAL_RRF_K", RRF_K)
+    fused, items = defaultdict(float), {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            # Results cached before ids were returned are told apart by description
+            key = item.get("id") or item["description"]
+            fused[key] += 1.0 / (k + rank)
+            items.setdefault(key, item)
+    best = len(rankings) / (k + 1)
+    ordered = sorted(fused.items(), key=lambda entry: entry[1], reverse=True)[:top_k]
+    return [{**items[key], "score": round(score / best, 6)} for key, score in ordered]
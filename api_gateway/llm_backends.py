@@ -0,0 +1,333 @@
+# api_gateway/llm_backends.py
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from .constrained_decoding import SchemaConstrainedLogitsProcessor, VocabTrie
+from .prefix_cache import PrefixKVCache
+from .registry import LazyResource
+from .sql_stopping import SQLCompleteCriteria
+
+logger = logging.getLogger(__name__)
+
+
+class ThroughputStats:
+    """
+    Running totals of generated tokens and generation time for one backend.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.tokens = 0
+        self.seconds = 0.0
+        self.last_tokens_per_sec = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, requests, tokens, seconds):
+        with self._lock:
+            self.requests += requests
+            self.tokens += tokens
+            self.seconds += seconds
+            self.last_tokens_per_sec = tokens / seconds if seconds > 0 else 0.0
+
+    def snapshot(self):
+        return {
+            "requests": self.requests,
+            "tokens": self.tokens,
+            "seconds": round(self.seconds, 3),
+            "tokens_per_sec": round(self.tokens / self.seconds, 2) if self.seconds else 0.0,
+            "last_tokens_per_sec": round(self.last_tokens_per_sec, 2),
+        }
+
+
+class GenerationBackend(ABC):
+    """
+    Loads a causal LM for one kind of device and runs greedy generation on it.
+
+    The tokenizer and the model are loaded separately on first use, so callers
+    that only need token counts never pay for the weights.
+    """
+
+    name = "base"
+    device = "cpu"
+
+    def __init__(self, model_name, prefix_cache=None):
+        self.model_name = model_name
+        self.prefix_cache = prefix_cache
+        self.stats = ThroughputStats()
+        self._tokenizer = LazyResource(f"{self.name} tokenizer ({model_name})", self._load_tokenizer)
+        self._model = LazyResource(f"{self.name} model ({model_name})", self._load_model)
+        self._vocab_trie = LazyResource(f"{self.name} vocabulary trie ({model_name})", lambda: VocabTrie(self.tokenizer))
+
+    @property
+    def tokenizer(self):
+        return self._tokenizer.get()
+
+    @property
+    def model(self):
+        return self._model.get()
+
+    @property
+    def vocab_trie(self):
+        return self._vocab_trie.get()
+
+    def _load_tokenizer(self):
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        # Decoder-only models are padded on the left so every row ends at the prompt.
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        return tokenizer
+
+    @abstractmethod
+    def _load_model(self):
+        """Load the model weights onto this backend's device."""
+
+    def create_streamer(self):
+        """
+        Streamer that yields the generated text (prompt excluded) as it decodes.
+
+        Pass it as ``streamer`` to a single-prompt generation running on another
+        thread and iterate over it here.
+        """
+        from transformers import TextIteratorStreamer
+
+        return TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+    def _generate(self, prompt_count, input_ids, constraints=None, **generate_kwargs):
+        import torch
+        from transformers import LogitsProcessorList, StoppingCriteriaList
+
+        tokenizer, model = self.tokenizer, self.model
+        if constraints and any(constraint is not None for constraint in constraints):
+            generate_kwargs["logits_processor"] = LogitsProcessorList([
+                SchemaConstrainedLogitsProcessor(tokenizer, self.vocab_trie, constraints, input_ids.shape[1])
+            ])
+
+        started = time.perf_counter()
+        with torch.inference_mode():
+            generated_ids = model.generate(
+                input_ids=input_ids,
+                num_return_sequences=1,
+                eos_token_id=tokenizer.eos_token_id,
+                pad_token_id=tokenizer.pad_token_id,
+                do_sample=False,
+                num_beams=1,
+                # Stop each row at the end of its statement instead of running on
+                # to max_new_tokens.
+                stopping_criteria=StoppingCriteriaList([SQLCompleteCriteria(tokenizer, input_ids.shape[0])]),
+                **generate_kwargs,
+            )
+        elapsed = time.perf_counter() - started
+
+        new_tokens = generated_ids[:, input_ids.shape[1]:]
+        token_count = int((new_tokens != tokenizer.pad_token_id).sum())
+        self.stats.record(prompt_count, token_count, elapsed)
+        logger.info(
+            f"{self.name} backend generated {token_count} tokens for {prompt_count} prompt(s) "
+            f"in {elapsed:.2f}s ({token_count / elapsed if elapsed else 0:.1f} tokens/sec)"
+        )
+
+        return tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+
+    def generate(self, prompts, max_new_tokens=400, streamer=None, constraints=None):
+        """
+        Greedily complete a batch of prompts.
+
+        Args:
+            prompts (list): Prompt strings.
+            max_new_tokens (int): Upper bound on generated tokens per prompt.
+            streamer: Optional streamer from ``create_streamer()``; single prompt only.
+            constraints (list): Optional ``SchemaConstraint`` (or None) per prompt.
+
+        Returns:
+            list: Decoded outputs (prompt included), one per prompt.
+        """
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
+        return self._generate(
+            len(prompts),
+            inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            max_new_tokens=max_new_tokens,
+            streamer=streamer,
+            constraints=constraints,
+        )
+
+    def generate_with_prefix(self, prompt, prefix, cache_key, max_new_tokens=400, streamer=None, constraint=None):
+        """
+        Complete one prompt, reusing the cached attention state of its schema prefix.
+
+        On a miss the prefix is prefilled once and its ``past_key_values`` stored in
+        ``prefix_cache``; on a hit only the question suffix is prefilled. Falls back
+        to plain generation if tokenizing the full prompt does not reproduce the
+        prefix tokens exactly, so outputs are identical to the uncached path.
+
+        Args:
+            prompt (str): Full prompt.
+            prefix (str): Leading part of ``prompt`` shared across requests.
+            cache_key: Key of the prefix in ``prefix_cache``.
+            max_new_tokens (int): Upper bound on generated tokens.
+            streamer: Optional streamer from ``create_streamer()``.
+            constraint (SchemaConstraint): Optional identifier constraint.
+
+        Returns:
+            list: Decoded output (prompt included) as a one-element list.
+        """
+        import copy
+
+        import torch
+
+        if self.prefix_cache is None:
+            return self.generate([prompt], max_new_tokens, streamer=streamer, constraints=[constraint])
+
+        tokenizer, model = self.tokenizer, self.model
+        prompt_ids = tokenizer(prompt, return_tensors="pt")["input_ids"].to(self.device)
+
+        entry = self.prefix_cache.get(cache_key)
+        if entry is None:
+            prefix_ids = tokenizer(prefix, return_tensors="pt")["input_ids"].to(self.device)
+            with torch.inference_mode():
+                past_key_values = model(input_ids=prefix_ids, use_cache=True).past_key_values
+            entry = self.prefix_cache.put(cache_key, prefix_ids, past_key_values)
+
+        prefix_length = entry.input_ids.shape[1]
+        if prefix_length >= prompt_ids.shape[1] or not torch.equal(prompt_ids[:, :prefix_length], entry.input_ids):
+            return self.generate([prompt], max_new_tokens, streamer=streamer, constraints=[constraint])
+
+        # generate() extends the cache in place, so each request works on a copy.
+        return self._generate(
+            1,
+            prompt_ids,
+            attention_mask=torch.ones_like(prompt_ids),
+            past_key_values=copy.deepcopy(entry.past_key_values),
+            max_new_tokens=max_new_tokens,
+            streamer=streamer,
+            constraints=[constraint],
+        )
+
+    def release(self):
+        """Free per-request device memory."""
+
+
+class CudaBackend(GenerationBackend):
+    """
+    fp16 on GPUs with at least 15GB of memory, 8-bit weights below that.
+    """
+
+    name = "cuda"
+    device = "cuda"
+
+    def _load_model(self):
+        import torch
+        from transformers import AutoModelForCausalLM
+
+        available_memory = torch.cuda.get_device_properties(0).total_memory
+
+        # safetensors checkpoints are memory-mapped rather than read into RAM first,
+        # and low_cpu_mem_usage skips the throwaway random initialization.
+        if available_memory > 15e9:
+            # if you have atleast 15GB of GPU memory, run load the model in float16
+            return AutoModelForCausalLM.from_pretrained(
+                self.model_name,
+                trust_remote_code=True,
+                torch_dtype=torch.float16,
+                device_map="auto",
+                use_cache=True,
+                use_safetensors=True,
+                low_cpu_mem_usage=True,
+            )
+        # else, load in 8 bits – this is a bit slower
+        return AutoModelForCausalLM.from_pretrained(
+            self.model_name,
+            trust_remote_code=True,
+            load_in_8bit=True,
+            device_map="auto",
+            use_cache=True,
+            use_safetensors=True,
+            low_cpu_mem_usage=True,
+        )
+
+    def release(self):
+        import torch
+
+        torch.cuda.empty_cache()
+        torch.cuda.synchronize()
+
+
+class CpuBackend(GenerationBackend):
+    """
+    fp32 weights with optional dynamic int8 quantization of the Linear layers,
+    which carry almost all of a transformer's matmul work.
+
+    Args:
+        model_name (str): Checkpoint to load; a smaller SQLCoder-compatible
+            checkpoint keeps latency usable on commodity cores.
+        threads (int): Intra-op threads for torch; defaults to all cores.
+        quantize (bool): Apply dynamic int8 quantization after loading.
+    """
+
+    name = "cpu"
+    device = "cpu"
+
+    def __init__(self, model_name, threads=None, quantize=True, prefix_cache=None):
+        self.threads = threads or os.cpu_count()
+        self.quantize = quantize
+        super().__init__(model_name, prefix_cache=prefix_cache)
+
+    def _load_model(self):
+        import torch
+        from transformers import AutoModelForCausalLM
+
+        torch.set_num_threads(self.threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Only settable before the first parallel op in the process.
+            pass
+
+        model = AutoModelForCausalLM.from_pretrained(
+            self.model_name,
+            trust_remote_code=True,
+            torch_dtype=torch.float32,
+            use_cache=True,
+            use_safetensors=True,
+            low_cpu_mem_usage=True,
+        )
+        if self.quantize:
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model.eval()
+
+
+def create_backend(settings):
+    """
+    Build the generation backend selected by ``LLM_BACKEND``.
+
+    "auto" picks CUDA when a GPU is visible and the CPU backend otherwise. A
+    positive ``LLM_PREFIX_CACHE_BYTES`` enables schema-prefix KV-cache reuse.
+    """
+    prefix_cache_bytes = getattr(settings, "LLM_PREFIX_CACHE_BYTES", 0)
+    prefix_cache = PrefixKVCache(prefix_cache_bytes) if prefix_cache_bytes > 0 else None
+
+    backend = getattr(settings, "LLM_BACKEND", "auto")
+    if backend == "auto":
+        try:
+            import torch
+
+            backend = "cuda" if torch.cuda.is_available() else "cpu"
+        except ImportError:
+            backend = "cpu"
+
+    if backend == "cuda":
+        return CudaBackend(getattr(settings, "LLM_MODEL_NAME", "defog/sqlcoder-7b-2"), prefix_cache=prefix_cache)
+    if backend == "cpu":
+        return CpuBackend(
+            getattr(settings, "LLM_CPU_MODEL_NAME", None) or getattr(settings, "LLM_MODEL_NAME", "defog/sqlcoder-7b-2"),
+            threads=getattr(settings, "LLM_CPU_THREADS", None),
+            quantize=getattr(settings, "LLM_CPU_QUANTIZE", True),
+            prefix_cache=prefix_cache,
+        )
+    raise ValueError(f"Unknown LLM_BACKEND: {backend}")
@@ -1,8 +1,14 @@
 # api_gateway/llm_service.py
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
-from .prompt_service import generate_prompt
+from django.conf import settings
+from .constrained_decoding import get_schema_constraint
+from .generation_scheduler import GenerationScheduler
+from .llm_backends import create_backend
+from .prefix_cache import prefix_cache_key
+from .prompt_service import compile_fragments, generate_question_suffix, generate_schema_prefix
+from .registry import register
+from .schema_cache import on_snapshot_loaded
 from .sql_service import extract_sql_query
-import torch
+import asyncio
 import logging
 import sqlparse
 
@@ -10,37 +16,97 @@ import sqlparse
 
 logger = logging.getLogger(__name__)
 
-MODEL_NAME = "defog/sqlcoder-7b-2"
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
 
-available_memory = torch.cuda.get_device_properties(0).total_memory
+# The backend (CUDA or CPU, see LLM_BACKEND) is created on first use; its tokenizer
+# and weights load separately, so importing this module is cheap.
+_backend = register("llm_backend", lambda: create_backend(settings))
+_tokenizer = register("llm_tokenizer", lambda: get_backend().tokenizer)
+_model = register("llm_model", lambda: get_backend().model)
+# Concurrent requests are micro-batched into shared generate() calls.
+_scheduler = register("llm_scheduler", lambda: GenerationScheduler(
+    get_backend(),
+    max_batch_size=getattr(settings, "LLM_MAX_BATCH_SIZE", 8),
+    max_wait_ms=getattr(settings, "LLM_MAX_BATCH_WAIT_MS", 10),
+    max_new_tokens=400,
+))
 
 
-if available_memory > 15e9:
-    # if you have atleast 15GB of GPU memory, run load the model in float16
-    model = AutoModelForCausalLM.from_pretrained(
-        MODEL_NAME,
-        trust_remote_code=True,
-        torch_dtype=torch.float16,
-        device_map="auto",
-        use_cache=True,
-    )
-else:
-    # else, load in 8 bits – this is a bit slower
-    model = AutoModelForCausalLM.from_pretrained(
-        MODEL_NAME,
-        trust_remote_code=True,
-        # torch_dtype=torch.float16,
-        load_in_8bit=True,
-        device_map="auto",
-        use_cache=True,
-    )
+def get_backend():
+    return _backend.get()
 
 
+def get_tokenizer():
+    return _tokenizer.get()
+
+
+def get_model():
+    return _model.get()
+
+
+def get_scheduler():
+    return _scheduler.get()
+
+
+def get_generation_stats():
+    """
+    Token throughput of the generation backend, if it has been created.
+    """
+    if not _backend.loaded:
+        return {}
+    backend = get_backend()
+    return {"backend": backend.name, "model": backend.model_name, **backend.stats.snapshot()}
+
+
+
+def count_tokens(texts):
+    """
+    Token counts of ``texts`` under the generation tokenizer (no special tokens).
+    """
+    return [len(ids) for ids in get_tokenizer()(list(texts), add_special_tokens=False)["input_ids"]]
+
+
+def schema_token_budget():
+    """
+    Tokens for the schema part of the prompt: ``PROMPT_TOKEN_BUDGET`` less a fixed
+    reservation for the question, so the packed prefix never depends on the question.
+    """
+    token_budget = getattr(settings, "PROMPT_TOKEN_BUDGET", 0)
+    if not token_budget:
+        return 0
+    return max(1, token_budget - getattr(settings, "PROMPT_QUESTION_TOKENS", 256))
+
+
+def _compile_fragments(snapshot):
+    # Token counts are only needed when the prompt is packed under a budget
+    compile_fragments(snapshot.catalog, count_tokens if schema_token_budget() else None)
+
+
+on_snapshot_loaded(_compile_fragments)
+
+
+def _generation_inputs(nl_query, schema_info):
+    suffix = generate_question_suffix(nl_query)
+    prefix = generate_schema_prefix(schema_info, count_tokens=count_tokens, token_budget=schema_token_budget())
+    prompt = (prefix + suffix).strip()
+    cache_key = prefix_cache_key(schema_info, prefix)
+    # Optionally mask identifiers that do not exist in the mapped schema
+    constraint = None
+    if getattr(settings, "LLM_CONSTRAINED_DECODING", False):
+        constraint = get_schema_constraint(schema_info, cache_key)
+    return {"prompt": prompt, "prefix": prefix, "cache_key": cache_key, "constraint": constraint}
+
+
+def _format_generated_sql(output):
+    # Extract the SQL query from the output
+    full_output = output.strip()
+    sql_query = extract_sql_query(full_output)  # Function to cleanly extract SQL
+    return sql_query, sqlparse.format(sql_query, reindent=True)
+
 
 def generate_sql_from_nl(nl_query, schema_info):
     """
-    Generate SQL query from natural language query using defog/sqlcoder-7b-2.
+    Generate SQL query from natural language query using the configured backend
+    (defog/sqlcoder-7b-2 by default).
     
     Args:
         nl_query (str): User's query in natural language.
@@ -50,24 +116,10 @@ def generate_sql_from_nl(nl_query, schema_info):
         str: Generated SQL query.
     """
     try:
-        prompt = generate_prompt(nl_query, schema_info)
-        inputs = tokenizer(prompt, return_tensors="pt").to("cuda")
-
-        generated_ids = model.generate(
-            **inputs,
-            num_return_sequences=1,
-            eos_token_id=tokenizer.eos_token_id,
-            pad_token_id=tokenizer.eos_token_id,
-            max_new_tokens=400,
-            do_sample=False,
-            num_beams=1,
-        )
-
-        outputs = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+        # Waits for the batch this prompt was scheduled into
+        output = get_scheduler().submit(**_generation_inputs(nl_query, schema_info)).result()
         
-        # Extract the SQL query from the output
-        full_output = outputs[0].strip()
-        sql_query = extract_sql_query(full_output)  # Function to cleanly extract SQL
+        sql_query, formatted_query = _format_generated_sql(output)
         
         print(f" \n Generated SQL Query: {sql_query}")
 
@@ -80,16 +132,56 @@ def generate_sql_from_nl(nl_query, schema_info):
         #print(f" \n Validated SQL Query: {sql_query}")
 
 
-        torch.cuda.empty_cache()
-        torch.cuda.synchronize()
-
 
 
-
-        return sqlparse.format(sql_query, reindent=True)
+        return formatted_query
     
 
     except Exception as e:
         print(f"Error generating SQL: {e}")
         return None
 
+
+def stream_sql_from_nl(nl_query, schema_info):
+    """
+    Generate SQL like ``generate_sql_from_nl``, yielding text as it decodes.
+
+    Args:
+        nl_query (str): User's query in natural language.
+        schema_info (dict): Filtered schema information.
+
+    Yields:
+        tuple: ``("token", text)`` for each decoded chunk, then ``("sql", query)``
+        with the extracted and formatted statement.
+
+    Raises:
+        Exception: Generation or extraction errors, so the caller can report them.
+    """
+    streamer, future = get_scheduler().stream(**_generation_inputs(nl_query, schema_info))
+    for text in streamer:
+        if text:
+            yield "token", text
+
+    _, formatted_query = _format_generated_sql(future.result())
+    yield "sql", formatted_query
+
+
+async def agenerate_sql_from_nl(nl_query, schema_info, executor=None):
+    """
+    Async ``generate_sql_from_nl``: prompt building runs on ``executor`` and the
+    caller awaits the scheduler's future without holding a thread while the
+    batch generates.
+
+    Returns:
+        str: Generated SQL query, or None on failure.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        inputs = await loop.run_in_executor(executor, lambda: _generation_inputs(nl_query, schema_info))
+        output = await asyncio.wrap_future(get_scheduler().submit(**inputs))
+        _, formatted_query = _format_generated_sql(output)
+        return formatted_query
+    except Exception as e:
+        logger.error(f"Error generating SQL: {e}")
+        return None
+
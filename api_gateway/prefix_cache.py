@@ -0,0 +1,87 @@
+# api_gateway/prefix_cache.py
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from .cache import CacheCounters
+
+logger = logging.getLogger(__name__)
+
+
+def prefix_cache_key(mapped_schema, prefix):
+    """
+    Cache key for a rendered schema prefix: the table set plus a digest of the text,
+    so two renderings of the same tables with different columns never collide.
+    """
+    tables = tuple(sorted(mapped_schema.get("tables", {})))
+    return tables, hashlib.sha1(prefix.encode()).hexdigest()
+
+
+def _tensor_bytes(obj):
+    if hasattr(obj, "to_legacy_cache"):
+        obj = obj.to_legacy_cache()
+    if isinstance(obj, (tuple, list)):
+        return sum(_tensor_bytes(item) for item in obj)
+    if hasattr(obj, "element_size") and hasattr(obj, "numel"):
+        return obj.element_size() * obj.numel()
+    return 0
+
+
+class PrefixEntry:
+    __slots__ = ("input_ids", "past_key_values", "nbytes")
+
+    def __init__(self, input_ids, past_key_values):
+        self.input_ids = input_ids
+        self.past_key_values = past_key_values
+        self.nbytes = _tensor_bytes(past_key_values) + _tensor_bytes(input_ids)
+
+
+class PrefixKVCache:
+    """
+    LRU cache of ``past_key_values`` for rendered schema prefixes, bounded by bytes.
+
+    Entries hold device tensors (GPU memory on the CUDA backend), so the budget is
+    enforced on the actual size of the key/value tensors rather than on a count.
+
+    Args:
+        max_bytes (int): Memory budget; least recently used prefixes are evicted
+            until the cache fits.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.counters = CacheCounters("llm_prefix_kv")
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            self.counters.miss()
+        else:
+            self.counters.hit()
+        return entry
+
+    def put(self, key, input_ids, past_key_values):
+        entry = PrefixEntry(input_ids, past_key_values)
+        if entry.nbytes > self.max_bytes:
+            logger.info(f"Prefix of {entry.nbytes} bytes exceeds the prefix cache budget; not cached")
+            return entry
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._entries[key] = entry
+            self.nbytes += entry.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return entry
+
+    def __len__(self):
+        return len(self._entries)
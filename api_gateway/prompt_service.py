@@ -1,10 +1,239 @@
 # api_gateway/prompt_service.py
+import hashlib
+import json
 import logging
+from .cache import LRUCache
+from .schema_extractor import prompt_table_info
 from .utils import get_session_data
 logger = logging.getLogger(__name__)
 
 
 
+SCHEMA_HEADER = "Use the following database schema to generate a SQL query:\n"
+RULES = (
+    "Rules:\n"
+    "1. Use only the column names listed above.\n"
+    "2. Do not fabricate column names.\n"
+    "3. Ensure valid SQL syntax.\n"
+)
+
+# (table name, digest of its mapped schema, counted) -> TableFragment. Every table
+# of the current schema snapshot is compiled when the snapshot loads; the LRU holds
+# fragments of table definitions from anywhere else.
+_compiled = {}
+_fragments = LRUCache("prompt.fragments", maxsize=4096)
+
+
+class TableFragment:
+    """
+    Pre-rendered prompt lines for one table, with their token counts.
+
+    Built once per table definition and reused by every prompt that includes the
+    table; assembling a prompt only picks lines and joins them.
+    """
+
+    __slots__ = ("name", "header", "footer", "overhead_tokens", "columns", "relations", "key_columns")
+
+    def __init__(self, name, table_info, count_tokens=None):
+        self.name = name
+        self.header = f"Table: {name}\nColumns (use only these):\n"
+        self.footer = "\n"
+        relations_header = "Relations:\n"
+
+        # (column, line) in schema order, then (column, line) per relation
+        column_lines = [
+            (column_name, f"  - {column_name} ({column_info['data_type']})\n")
+            for column_name, column_info in table_info["columns"].items()
+        ]
+        relation_lines = [
+            (relation, f"  - {relation} -> {details['related_table']}({details['related_column']})\n")
+            for relation, details in table_info["relations"].items()
+        ]
+
+        counts = [None] * (2 + len(column_lines) + len(relation_lines))
+        if count_tokens is not None:
+            counts = count_tokens(
+                [self.header + relations_header + self.footer]
+                + [line for _, line in column_lines]
+                + [line for _, line in relation_lines]
+            )
+        self.overhead_tokens = counts[0]
+        self.columns = [
+            (column_name, line, tokens) for (column_name, line), tokens in zip(column_lines, counts[1:])
+        ]
+        self.relations = [
+            (relation, line, tokens)
+            for (relation, line), tokens in zip(relation_lines, counts[1 + len(column_lines):])
+        ]
+        self.key_columns = set(table_info.get("primary_key", [])) | set(table_info["relations"])
+
+    def render(self, columns=None, relations=None):
+        """
+        Render the table with the given columns and relations (all when None), in
+        schema order.
+        """
+        parts = [self.header]
+        parts.extend(line for name, line, _ in self.columns if columns is None or name in columns)
+        parts.append("Relations:\n")
+        parts.extend(line for name, line, _ in self.relations if relations is None or name in relations)
+        parts.append(self.footer)
+        return "".join(parts)
+
+
+def _fragment_key(table_name, table_info, counted):
+    payload = json.dumps(
+        [table_info["columns"], table_info["relations"], table_info.get("primary_key", [])],
+        sort_keys=True,
+        default=str,
+    )
+    return table_name, hashlib.sha1(payload.encode()).hexdigest(), counted
+
+
+def compile_fragments(catalog, count_tokens=None):
+    """
+    Render (and, with ``count_tokens``, token-count) the fragment of every table in
+    a schema snapshot's catalog, replacing those of the previous snapshot.
+    """
+    compiled = {}
+    for record in catalog.tables.values():
+        table_info = prompt_table_info(record.info)
+        key = _fragment_key(record.qualified, table_info, count_tokens is not None)
+        compiled[key] = TableFragment(record.qualified, table_info, count_tokens)
+    global _compiled
+    _compiled = compiled
+    logger.info(f"Compiled prompt fragments for {len(compiled)} tables")
+
+
+def get_table_fragment(table_name, table_info, count_tokens=None):
+    """
+    ``TableFragment`` for a mapped table, keyed by its content so a schema change
+    produces a new fragment. Tables of the current snapshot come precompiled.
+    """
+    key = _fragment_key(table_name, table_info, count_tokens is not None)
+    fragment = _compiled.get(key) or _fragments.get(key)
+    if fragment is None:
+        fragment = TableFragment(table_name, table_info, count_tokens)
+        _fragments.set(key, fragment)
+    return fragment
+
+
+def _rank_columns(fragment, table_info):
+    # Retrieved columns by score, then key columns, then the rest in schema order
+    scores = table_info.get("column_scores", {})
+    order = {name: index for index, (name, _, _) in enumerate(fragment.columns)}
+    ranked = sorted(
+        fragment.columns,
+        key=lambda column: (
+            -scores.get(column[0], float("-inf")),
+            column[0] not in fragment.key_columns,
+            order[column[0]],
+        ),
+    )
+    essential = [column for column in ranked if column[0] in scores or column[0] in fragment.key_columns]
+    optional = [column for column in ranked if column[0] not in scores and column[0] not in fragment.key_columns]
+    if not essential:
+        essential, optional = optional[:1], optional[1:]
+    return essential, optional
+
+
+def pack_schema(mapped_schema, count_tokens, token_budget):
+    """
+    Choose the tables, columns and relations that fit in ``token_budget`` tokens.
+
+    Tables are taken best retrieval score first. Each table first gets its header
+    and its retrieved and key columns; leftover budget then goes to the relations
+    of the included key columns, and finally to the remaining columns.
+
+    Args:
+        mapped_schema (dict): Output of ``map_relevant_schemas_to_tables()``.
+        count_tokens (callable): Maps a list of strings to their token counts.
+        token_budget (int): Tokens available for the schema part of the prompt.
+
+    Returns:
+        list: ``(fragment, columns, relations)`` per included table, in mapped order.
+    """
+    tables = mapped_schema["tables"]
+    fragments = {name: get_table_fragment(name, info, count_tokens) for name, info in tables.items()}
+    ranked_tables = sorted(
+        tables, key=lambda name: (tables[name].get("score") is None, -(tables[name].get("score") or 0.0))
+    )
+
+    remaining = token_budget - sum(count_tokens([SCHEMA_HEADER, RULES]))
+    chosen = {}
+    optional_columns = {}
+
+    for name in ranked_tables:
+        fragment = fragments[name]
+        essential, optional_columns[name] = _rank_columns(fragment, tables[name])
+        if fragment.overhead_tokens > remaining:
+            continue
+        columns, spent = set(), fragment.overhead_tokens
+        for column_name, _, tokens in essential:
+            if spent + tokens <= remaining:
+                columns.add(column_name)
+                spent += tokens
+        if columns:
+            chosen[name] = (columns, set())
+            remaining -= spent
+
+    for name in ranked_tables:
+        if name not in chosen:
+            continue
+        columns, relations = chosen[name]
+        for relation, _, tokens in fragments[name].relations:
+            if relation in columns and tokens <= remaining:
+                relations.add(relation)
+                remaining -= tokens
+
+    for name in ranked_tables:
+        if name not in chosen:
+            continue
+        columns = chosen[name][0]
+        for column_name, _, tokens in optional_columns[name]:
+            if tokens <= remaining:
+                columns.add(column_name)
+                remaining -= tokens
+
+    dropped = [name for name in tables if name not in chosen]
+    if dropped:
+        logger.info(f"Prompt token budget left out tables: {dropped}")
+    return [(fragments[name], *chosen[name]) for name in tables if name in chosen]
+
+
+def generate_schema_prefix(mapped_schema, count_tokens=None, token_budget=0):
+    """
+    Render the question-independent head of the prompt: schema block and rules.
+
+    Requests that map to the same tables share this prefix verbatim, which is what
+    lets the LLM reuse its attention cache for it.
+
+    Args:
+        mapped_schema (dict): Schema information with fully qualified table names.
+        count_tokens (callable): Maps a list of strings to their token counts;
+            required for ``token_budget``.
+        token_budget (int): Maximum prefix size in tokens; 0 includes every column.
+
+    Returns:
+        str: Prompt prefix.
+    """
+    parts = [SCHEMA_HEADER]
+    if token_budget and count_tokens is not None:
+        for fragment, columns, relations in pack_schema(mapped_schema, count_tokens, token_budget):
+            parts.append(fragment.render(columns, relations))
+    else:
+        for table_name, table_info in mapped_schema["tables"].items():
+            parts.append(get_table_fragment(table_name, table_info).render())
+    parts.append(RULES)
+    return "".join(parts)
+
+
+def generate_question_suffix(nl_query):
+    """
+    Render the per-request tail of the prompt.
+    """
+    return f"User Query: {nl_query}\nSQL Query:"
+
+
 def generate_prompt(nl_query, mapped_schema):
     """
     Generate a stricter prompt for the model to ensure valid SQL generation.
@@ -16,22 +245,7 @@ def generate_prompt(nl_query, mapped_schema):
     Returns:
         str: Prompt for the model.
     """
-    prompt = "Use the following database schema to generate a SQL query:\n"
-    for table_name, table_info in mapped_schema["tables"].items():
-        prompt += f"Table: {table_name}\n"
-        prompt += "Columns (use only these):\n"
-        for column_name, column_info in table_info["columns"].items():
-            prompt += f"  - {column_name} ({column_info['data_type']})\n"
-        prompt += "Relations:\n"
-        for relation, details in table_info["relations"].items():
-            prompt += f"  - {relation} -> {details['related_table']}({details['related_column']})\n"
-        prompt += "\n"
-    prompt += "Rules:\n"
-    prompt += "1. Use only the column names listed above.\n"
-    prompt += "2. Do not fabricate column names.\n"
-    prompt += "3. Ensure valid SQL syntax.\n"
-    prompt += f"User Query: {nl_query}\n"
-    prompt += "SQL Query:"
+    prompt = generate_schema_prefix(mapped_schema) + generate_question_suffix(nl_query)
     return prompt.strip()
 
 
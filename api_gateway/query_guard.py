@@ -0,0 +1,200 @@
+# api_gateway/query_guard.py
+import json
+import logging
+
+import sqlparse
+from django.conf import settings
+from sqlparse import tokens as T
+from sqlparse.sql import Parenthesis, Where
+
+from .sql_service import query_cursor
+
+logger = logging.getLogger(__name__)
+
+# Top-level keywords after which an appended LIMIT would be wrong or redundant
+_BOUNDING_KEYWORDS = frozenset(("LIMIT", "FETCH", "FOR"))
+
+
+class QueryRejected(Exception):
+    """
+    The guard refused to run a query.
+
+    Attributes:
+        estimate (dict): Planner estimate that tripped the guard, if any.
+        requires_confirmation (bool): True when the query may still run once the
+            caller confirms it; False when it is refused outright.
+    """
+
+    def __init__(self, message, estimate=None, requires_confirmation=False):
+        super().__init__(message)
+        self.estimate = estimate
+        self.requires_confirmation = requires_confirmation
+
+    @property
+    def status_code(self):
+        return 409 if self.requires_confirmation else 422
+
+    def payload(self):
+        return {
+            "error": str(self),
+            "estimate": self.estimate,
+            "requires_confirmation": self.requires_confirmation,
+        }
+
+
+class GuardedQuery:
+    """
+    A query cleared for execution.
+
+    Attributes:
+        sql (str): SQL to execute, with the LIMIT injected if any.
+        limited (bool): Whether a LIMIT was injected.
+        estimate (dict): ``{"cost", "rows"}`` from EXPLAIN, or None if unavailable.
+    """
+
+    __slots__ = ("sql", "limited", "estimate")
+
+    def __init__(self, sql, limited, estimate):
+        self.sql = sql
+        self.limited = limited
+        self.estimate = estimate
+
+
+def _is_filler(token):
+    # Whitespace, comments and statement terminators
+    return token.is_whitespace or token.ttype in T.Comment or token.match(T.Punctuation, ";")
+
+
+def _strip_trailing(statement):
+    tokens = list(statement.flatten())
+    end = len(tokens)
+    while end and _is_filler(tokens[end - 1]):
+        end -= 1
+    return "".join(token.value for token in tokens[:end]).strip()
+
+
+def _single_statement(sql_query):
+    statements = [
+        statement for statement in sqlparse.parse(sql_query)
+        if not all(_is_filler(token) for token in statement.flatten())
+    ]
+    if len(statements) != 1:
+        raise QueryRejected("Exactly one SQL statement can be executed per query.")
+    return statements[0]
+
+
+def _is_select(statement):
+    if statement.get_type() == "SELECT":
+        return True
+    # "(SELECT ...) UNION (SELECT ...)": sqlparse only types statements by their first keyword
+    first = statement.token_first(skip_cm=True)
+    while isinstance(first, Parenthesis):
+        first = first.token_next(0, skip_cm=True)[1]
+    return first is not None and first.ttype in T.DML and first.normalized == "SELECT"
+
+
+def apply_row_limit(sql_query, limit):
+    """
+    Append ``LIMIT limit`` to a SELECT that has no top-level LIMIT/FETCH of its own.
+
+    LIMITs inside subqueries don't bound the outer result and are ignored, and a
+    top-level ``LIMIT ALL`` is replaced by ``LIMIT limit``. Other statements are
+    returned unchanged, as is everything when ``limit`` is falsy.
+
+    Returns:
+        tuple: ``(sql, limited)``.
+    """
+    statement = _single_statement(sql_query)
+    # Trailing comments go too: "SELECT 1; -- done" must not end up before the LIMIT
+    sql = _strip_trailing(statement)
+    if not limit or not _is_select(statement):
+        return sql, False
+
+    # A trailing clause can end up grouped into the WHERE clause
+    clauses = [
+        inner for token in statement.tokens
+        for inner in (token.tokens if isinstance(token, Where) else (token,))
+        if not (inner.is_whitespace or inner.ttype in T.Comment)
+    ]
+    for index, token in enumerate(clauses):
+        if token.ttype in T.Keyword and token.normalized in _BOUNDING_KEYWORDS:
+            following = clauses[index + 1] if index + 1 < len(clauses) else None
+            if token.normalized == "LIMIT" and following is not None and following.match(T.Keyword, "ALL"):
+                following.value = str(int(limit))
+                return _strip_trailing(statement), True
+            return sql, False
+    # On its own line, so a trailing "-- comment" can't swallow it
+    return f"{sql}\nLIMIT {int(limit)}", True
+
+
+def explain_estimate(sql_query, db_credentials=None):
+    """
+    Planner estimate for ``sql_query`` from ``EXPLAIN (FORMAT JSON)``; nothing is executed.
+
+    Returns:
+        dict: ``{"cost": float, "rows": float}``, or None if the statement can't be
+        explained (e.g. DDL).
+    """
+    try:
+        with query_cursor(db_credentials) as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql_query}")
+            plan = cursor.fetchone()[0]
+    except Exception as e:
+        logger.warning(f"EXPLAIN failed, skipping cost guard: {e}")
+        return None
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
+    return {"cost": float(root["Total Cost"]), "rows": float(root["Plan Rows"])}
+
+
+def _over(value, threshold):
+    return bool(threshold) and value > threshold
+
+
+def guard_query(sql_query, confirmed=False, db_credentials=None, row_limit=None):
+    """
+    Pre-execution guard for generated SQL.
+
+    Rejects multi-statement input, injects a LIMIT into unbounded SELECTs and checks
+    the planner's cost and row estimates. Above ``QUERY_GUARD_CONFIRM_COST`` /
+    ``QUERY_GUARD_CONFIRM_ROWS`` the query only runs once the caller confirms it;
+    above ``QUERY_GUARD_MAX_COST`` / ``QUERY_GUARD_MAX_ROWS`` it never runs. A zero
+    threshold disables that check.
+
+    Args:
+        sql_query (str): SQL to check.
+        confirmed (bool): The caller has confirmed an expensive query.
+        db_credentials (dict): Plan against the session's database instead of the
+            default one.
+        row_limit (int): LIMIT to inject; defaults to ``QUERY_AUTO_LIMIT``.
+
+    Returns:
+        GuardedQuery: The query to execute.
+
+    Raises:
+        QueryRejected: If the query must not run (yet).
+    """
+    if row_limit is None:
+        row_limit = getattr(settings, "QUERY_AUTO_LIMIT", 1000)
+    sql, limited = apply_row_limit(sql_query, row_limit)
+
+    estimate = explain_estimate(sql, db_credentials)
+    if estimate is not None:
+        cost, rows = estimate["cost"], estimate["rows"]
+        if _over(cost, getattr(settings, "QUERY_GUARD_MAX_COST", 1e8)) or _over(rows, getattr(settings, "QUERY_GUARD_MAX_ROWS", 1e8)):
+            logger.warning(f"Rejected query over the cost guard (cost={cost}, rows={rows})")
+            raise QueryRejected("Query is too expensive to run.", estimate)
+        if not confirmed and (
+            _over(cost, getattr(settings, "QUERY_GUARD_CONFIRM_COST", 1e6))
+            or _over(rows, getattr(settings, "QUERY_GUARD_CONFIRM_ROWS", 1e6))
+        ):
+            logger.info(f"Query needs confirmation (cost={cost}, rows={rows})")
+            raise QueryRejected(
+                "Query is estimated to be expensive; resend with \"confirm\": true to run it.",
+                estimate,
+                requires_confirmation=True,
+            )
+
+    return GuardedQuery(sql, limited, estimate)
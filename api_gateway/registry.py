@@ -0,0 +1,83 @@
+# api_gateway/registry.py
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_UNSET = object()
+
+# name -> LazyResource
+_resources = {}
+
+# Modules that register resources; imported by warmup() so every resource is known.
+RESOURCE_MODULES = (
+    "api_gateway.utils",
+    "api_gateway.db_pool",
+    "api_gateway.embedding_service",
+    "api_gateway.llm_service",
+)
+
+
+class LazyResource:
+    """
+    A model or client created on first use.
+
+    Creation is thread-safe: concurrent first callers block on one lock and the
+    factory runs exactly once. Later calls return the cached object without locking.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._value = _UNSET
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._value is not _UNSET
+
+    def get(self):
+        value = self._value
+        if value is _UNSET:
+            with self._lock:
+                if self._value is _UNSET:
+                    started = time.perf_counter()
+                    self._value = self._factory()
+                    logger.info(f"Initialized {self.name} in {time.perf_counter() - started:.2f}s")
+                value = self._value
+        return value
+
+
+def register(name, factory):
+    """
+    Register a lazily created resource and return its handle.
+    """
+    resource = LazyResource(name, factory)
+    _resources[name] = resource
+    return resource
+
+
+def get_resource(name):
+    return _resources[name].get()
+
+
+def warmup(names=None):
+    """
+    Eagerly initialize resources, e.g. from the WSGI/ASGI entry point before
+    serving traffic.
+
+    Args:
+        names (list): Resource names to load; all registered resources if omitted.
+    """
+    for module in RESOURCE_MODULES:
+        importlib.import_module(module)
+    for name in names or list(_resources):
+        if name not in _resources:
+            raise KeyError(f"Unknown resource: {name}")
+        _resources[name].get()
+
+
+def loaded_resources():
+    return {name: resource.loaded for name, resource in _resources.items()}
@@ -0,0 +1,148 @@
+# api_gateway/renderers.py
+import datetime
+import decimal
+import importlib.util
+import json
+import logging
+import uuid
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .sql_service import ResultSet
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# pyarrow is only imported when an Arrow response is actually requested
+ARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+
+def _default(value):
+    # Types neither orjson nor json encode natively, for the opt-in formats
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (datetime.timedelta, uuid.UUID)):
+        return str(value)
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, ResultSet):
+        return value.records()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(data, default=_default):
+    """
+    Encode ``data`` as JSON bytes with orjson when installed, else the stdlib encoder.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=default, separators=(",", ":")).encode()
+
+
+_drf_encoder = JSONEncoder()
+
+
+def _json_default(value):
+    # DRF's coercions (Decimal as float, UTC datetimes ending in "Z", ...)
+    if isinstance(value, ResultSet):
+        return value.records()
+    return _drf_encoder.default(value)
+
+
+def dumps_json(data):
+    """
+    Encode ``data`` exactly as DRF's ``JSONRenderer`` does, faster when orjson is
+    installed. Dates and times go through the DRF encoder rather than orjson's own
+    ISO format.
+    """
+    if orjson is not None:
+        encoded = orjson.dumps(
+            data, default=_json_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+    else:
+        encoded = json.dumps(data, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode()
+    # Like JSONRenderer, escape the separators that are not valid in JavaScript strings
+    return encoded.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    ``application/json`` rendered with orjson, in the same format as DRF's
+    ``JSONRenderer``. Result sets become a list of row dicts, the same shape the
+    API has always returned.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return dumps_json(data)
+
+
+def _columnar(value):
+    if isinstance(value, ResultSet):
+        return {
+            "columns": [{"name": name, "type": type_name} for name, type_name in zip(value.columns, value.types)],
+            "data": value.column_values(),
+            "row_count": len(value),
+        }
+    return _default(value)
+
+
+class ColumnarJSONRenderer(BaseRenderer):
+    """
+    Column-oriented JSON: each column's name and type once, then one array of
+    values per column. Requested with ``Accept: application/vnd.querypilot.columnar+json``.
+    """
+
+    media_type = "application/vnd.querypilot.columnar+json"
+    format = "columnar"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return dumps(data, default=_columnar)
+
+
+class ArrowStreamRenderer(BaseRenderer):
+    """
+    Result set as an Arrow IPC stream; the other response fields travel as JSON in
+    the schema metadata under ``querypilot``. Responses without a result set (e.g.
+    errors) are rendered as plain JSON. Requested with
+    ``Accept: application/vnd.apache.arrow.stream``; needs pyarrow.
+    """
+
+    media_type = "application/vnd.apache.arrow.stream"
+    format = "arrow"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        result = data.get("results") if isinstance(data, dict) else None
+        if not isinstance(result, ResultSet):
+            response = (renderer_context or {}).get("response")
+            if response is not None:
+                response["Content-Type"] = "application/json"
+            return dumps(data)
+
+        import pyarrow as pa
+
+        arrays = [pa.array(values) for values in result.column_values()]
+        table = pa.Table.from_arrays(arrays, names=result.columns)
+        head = {key: value for key, value in data.items() if key != "results"}
+        table = table.replace_schema_metadata({"querypilot": dumps(head)})
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+# Renderers for views that return query results, negotiated from the Accept header
+RESULT_RENDERERS = [FastJSONRenderer, ColumnarJSONRenderer] + ([ArrowStreamRenderer] if ARROW_AVAILABLE else [])
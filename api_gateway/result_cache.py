@@ -0,0 +1,269 @@
+# api_gateway/result_cache.py
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+import math
+import re
+import uuid
+import zlib
+
+import sqlparse
+from django.conf import settings
+from sql_metadata import Parser
+
+from .cache import CacheCounters, LRUCache
+from .db_pool import connect_kwargs, credentials_key
+from .renderers import dumps
+from .sql_service import ResultSet, execute_sql_result, query_cursor
+from .utils import get_binary_redis
+
+logger = logging.getLogger(__name__)
+
+# zlib-compressed result per (database, SQL fingerprint); the data version is
+# stored inside, so a changed table turns the entry into a miss.
+RESULT_KEY = "qp:result:{database}:{fingerprint}"
+
+# Change counters of the tables a query reads. relfilenode moves on TRUNCATE and
+# table rewrites, which the tuple counters don't see. Only plain and partitioned
+# tables qualify: a view's dependencies are not known here.
+TABLE_VERSION_SQL = """
+    SELECT c.oid::regclass::text, c.relkind, c.relfilenode,
+           s.n_tup_ins, s.n_tup_upd, s.n_tup_del
+    FROM pg_catalog.pg_class AS c
+    LEFT JOIN pg_catalog.pg_stat_user_tables AS s ON s.relid = c.oid
+    WHERE c.oid IN (SELECT to_regclass(name) FROM unnest(%s::text[]) AS name)
+    ORDER BY c.oid
+"""
+
+# Results that depend on more than table contents are never cached
+VOLATILE = re.compile(
+    r"\b(?:now|random|clock_timestamp|statement_timestamp|timeofday|nextval|setval|gen_random_uuid|"
+    r"uuid_generate_v\d\w*|current_date|current_time|current_timestamp|localtime|localtimestamp|"
+    r"current_user|session_user|pg_\w+)\b",
+    re.IGNORECASE,
+)
+
+
+def _iso(value):
+    return value.isoformat()
+
+
+def _finite_or_str(value):
+    # JSON has no NaN or Infinity; float() parses the strings back
+    return value if math.isfinite(value) else str(value)
+
+
+# Column type -> (encode, decode) for values JSON can't carry as they are, so a
+# cached result has the same Python types as a freshly fetched one
+TYPE_CODECS = {
+    "numeric": (str, decimal.Decimal),
+    "float4": (_finite_or_str, float),
+    "float8": (_finite_or_str, float),
+    "date": (_iso, datetime.date.fromisoformat),
+    "time": (_iso, datetime.time.fromisoformat),
+    "timestamp": (_iso, datetime.datetime.fromisoformat),
+    "timestamptz": (_iso, datetime.datetime.fromisoformat),
+    "interval": (lambda value: [value.days, value.seconds, value.microseconds], lambda value: datetime.timedelta(*value)),
+    "uuid": (str, uuid.UUID),
+    "bytea": (lambda value: bytes(value).hex(), lambda value: memoryview(bytes.fromhex(value))),
+}
+
+
+def _json_native(value):
+    if value is None or isinstance(value, (str, int, bool)):
+        return True
+    if isinstance(value, float):
+        return math.isfinite(value)
+    if isinstance(value, list):
+        return all(_json_native(item) for item in value)
+    if isinstance(value, dict):
+        return all(isinstance(key, str) and _json_native(item) for key, item in value.items())
+    return False
+
+
+local_results = LRUCache("result.local", maxsize=256)
+result_counters = CacheCounters("result.redis")
+
+
+def _enabled():
+    return getattr(settings, "QUERY_RESULT_CACHE_ENABLED", True)
+
+
+def sql_fingerprint(sql_query):
+    """
+    Digest of a query with comments, letter case of keywords, whitespace and the
+    trailing semicolon normalized away. Literals and identifiers are kept as written.
+    """
+    normalized = sqlparse.format(sql_query, strip_comments=True, keyword_case="upper")
+    normalized = " ".join(normalized.split()).rstrip(";").rstrip()
+    return hashlib.sha256(normalized.encode()).hexdigest()[:32]
+
+
+def database_identity(db_credentials=None):
+    """
+    Identity of the target database (host, port, name and user), as a digest.
+
+    Args:
+        db_credentials (dict): Session credentials; None means Django's default database.
+    """
+    if db_credentials:
+        kwargs = connect_kwargs(db_credentials)
+    else:
+        database = settings.DATABASES["default"]
+        kwargs = {"host": database.get("HOST"), "port": database.get("PORT"),
+                  "dbname": database.get("NAME"), "user": database.get("USER")}
+    kwargs.pop("password", None)
+    return credentials_key(kwargs)
+
+
+def cacheable_tables(sql_query):
+    """
+    Tables a read-only query touches, or None if its result must not be cached
+    (not a SELECT, volatile functions, or no tables at all).
+    """
+    statements = [statement for statement in sqlparse.parse(sql_query) if str(statement).strip(" \n\t;")]
+    if len(statements) != 1 or statements[0].get_type() != "SELECT" or VOLATILE.search(sql_query):
+        return None
+    try:
+        tables = Parser(sql_query).tables
+    except Exception as e:
+        logger.info(f"Could not extract tables, not caching: {e}")
+        return None
+    return sorted(set(tables)) or None
+
+
+def data_version(tables, db_credentials=None):
+    """
+    Version of the data in ``tables`` from their Postgres change counters.
+
+    Counters are published by backends when they commit (at the latest about a
+    second later on Postgres 15+), so a write can take that long to invalidate.
+
+    Returns:
+        str: Digest of the counters, or None if any table can't be versioned (a
+        view, or a name that doesn't resolve).
+    """
+    with query_cursor(db_credentials) as cursor:
+        cursor.execute(TABLE_VERSION_SQL, [tables])
+        rows = cursor.fetchall()
+    if len(rows) != len(tables) or any(row[1] not in ("r", "p") for row in rows):
+        return None
+    return hashlib.sha256(repr(rows).encode()).hexdigest()[:24]
+
+
+def _encode(version, result):
+    """
+    Compressed JSON of a result, with typed values encoded per ``TYPE_CODECS``.
+
+    Returns:
+        bytes: The entry, or None if a column of another type holds values JSON
+        would not give back unchanged (e.g. arrays of numerics).
+    """
+    encoders = [TYPE_CODECS.get(type_name, (None,))[0] for type_name in result.types]
+    rows = result.rows
+    if any(encoders):
+        rows = [
+            [value if value is None or encode is None else encode(value) for encode, value in zip(encoders, row)]
+            for row in rows
+        ]
+    for position, encode in enumerate(encoders):
+        if encode is None and not all(_json_native(row[position]) for row in result.rows):
+            return None
+    payload = {"version": version, "columns": result.columns, "types": result.types, "rows": rows}
+    return zlib.compress(dumps(payload))
+
+
+def _decode(blob):
+    payload = json.loads(zlib.decompress(blob))
+    decoders = [TYPE_CODECS.get(type_name, (None, None))[1] for type_name in payload["types"]]
+    if any(decoders):
+        rows = [
+            tuple(value if value is None or decode is None else decode(value) for decode, value in zip(decoders, row))
+            for row in payload["rows"]
+        ]
+    else:
+        rows = [tuple(row) for row in payload["rows"]]
+    return payload["version"], ResultSet(payload["columns"], payload["types"], rows)
+
+
+def lookup_result(sql_query, db_credentials=None):
+    """
+    Look up a cached result for ``sql_query``.
+
+    Returns:
+        tuple: ``(result, token)``. ``result`` is a ResultSet on a hit, else None;
+        pass ``token`` to ``store_result()`` after executing (None: don't cache).
+    """
+    if not _enabled():
+        return None, None
+    try:
+        tables = cacheable_tables(sql_query)
+        if tables is None:
+            return None, None
+        # Taken before execution: a write racing the query leaves the entry stale-keyed
+        version = data_version(tables, db_credentials)
+        if version is None:
+            return None, None
+        key = RESULT_KEY.format(database=database_identity(db_credentials), fingerprint=sql_fingerprint(sql_query))
+    except Exception as e:
+        logger.warning(f"Result cache lookup failed: {e}")
+        return None, None
+
+    entry = local_results.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1], None
+
+    try:
+        blob = get_binary_redis().get(key)
+    except Exception as e:
+        logger.warning(f"Result cache lookup failed: {e}")
+        return None, (key, version)
+    if blob:
+        try:
+            cached_version, result = _decode(blob)
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cached result: {e}")
+            cached_version = None
+        if cached_version == version:
+            result_counters.hit()
+            local_results.set(key, (version, result))
+            return result, None
+    result_counters.miss()
+    return None, (key, version)
+
+
+def store_result(token, result):
+    """
+    Cache an executed result under the token from ``lookup_result()``. Errors,
+    results whose values can't be stored with their types and results above
+    ``QUERY_RESULT_CACHE_MAX_BYTES`` compressed are skipped.
+    """
+    if token is None or not isinstance(result, ResultSet):
+        return
+    key, version = token
+    try:
+        blob = _encode(version, result)
+        if blob is None or len(blob) > getattr(settings, "QUERY_RESULT_CACHE_MAX_BYTES", 8 * 1024 * 1024):
+            return
+        get_binary_redis().set(key, blob, ex=getattr(settings, "QUERY_RESULT_CACHE_TTL", 300))
+        local_results.set(key, (version, result))
+    except Exception as e:
+        logger.warning(f"Could not cache query result: {e}")
+
+
+def execute_cached(sql_query, db_credentials=None):
+    """
+    ``execute_sql_result()`` behind the result cache.
+
+    Returns:
+        ResultSet: Fetched or cached rows, or ``{"error": str}`` if execution failed.
+    """
+    result, token = lookup_result(sql_query, db_credentials)
+    if result is not None:
+        logger.info("Served SQL query from the result cache")
+        return result
+    result = execute_sql_result(sql_query, db_credentials)
+    store_result(token, result)
+    return result
@@ -0,0 +1,221 @@
+# api_gateway/schema_cache.py
+import json
+import logging
+import threading
+import time
+import zlib
+
+from django.conf import settings
+
+from .schema_catalog import SchemaCatalog
+from .schema_extractor import SYSTEM_SCHEMAS, connect_schema_db, introspect_catalog
+from .utils import get_binary_redis
+
+logger = logging.getLogger(__name__)
+
+# Hash over the xmin of every catalog row that shapes the schema dict. Any DDL that
+# adds, drops or alters a schema, table, column or constraint rewrites at least one
+# of these rows, so the fingerprint changes exactly when get_schema() output can.
+# Temporary relations are skipped so session-local temp tables do not churn it.
+CATALOG_FINGERPRINT_SQL = """
+    SELECT md5(
+        (SELECT coalesce(string_agg(n.oid::text || ':' || n.xmin::text, ',' ORDER BY n.oid), '')
+         FROM pg_catalog.pg_namespace AS n
+         WHERE n.nspname NOT IN %(system_schemas)s)
+        || '|' ||
+        (SELECT coalesce(string_agg(c.oid::text || ':' || c.xmin::text, ',' ORDER BY c.oid), '')
+         FROM pg_catalog.pg_class AS c
+         WHERE c.relkind IN ('r', 'v', 'm', 'f', 'p') AND c.relpersistence <> 't')
+        || '|' ||
+        (SELECT coalesce(string_agg(a.attrelid::text || '.' || a.attnum::text || ':' || a.xmin::text,
+                                    ',' ORDER BY a.attrelid, a.attnum), '')
+         FROM pg_catalog.pg_attribute AS a
+         JOIN pg_catalog.pg_class AS c ON c.oid = a.attrelid
+         WHERE c.relkind IN ('r', 'v', 'm', 'f', 'p') AND c.relpersistence <> 't' AND a.attnum > 0)
+        || '|' ||
+        (SELECT coalesce(string_agg(con.oid::text || ':' || con.xmin::text, ',' ORDER BY con.oid), '')
+         FROM pg_catalog.pg_constraint AS con
+         WHERE con.contype IN ('p', 'f', 'u', 'c'))
+    );
+"""
+
+REDIS_SNAPSHOT_KEY = "schema_snapshot:{fingerprint}"
+
+
+class SchemaSnapshot:
+    """
+    An introspected schema together with the catalog fingerprint it was built from,
+    and the ``SchemaCatalog`` indexing it.
+    """
+
+    __slots__ = ("fingerprint", "schema_info", "catalog", "loaded_at")
+
+    def __init__(self, fingerprint, schema_info):
+        self.fingerprint = fingerprint
+        self.schema_info = schema_info
+        self.catalog = SchemaCatalog(schema_info)
+        self.loaded_at = time.time()
+
+
+_snapshot = None
+_checked_at = 0.0
+_load_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+# Called with each newly installed snapshot, on a background thread
+_snapshot_listeners = []
+
+
+def catalog_fingerprint(conn):
+    """
+    Compute the catalog fingerprint for the database behind ``conn``.
+
+    Args:
+        conn: Open psycopg2 connection.
+
+    Returns:
+        str: md5 hex digest that changes whenever the introspected schema would.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(CATALOG_FINGERPRINT_SQL, {"system_schemas": SYSTEM_SCHEMAS})
+        return cursor.fetchone()[0]
+
+
+def _load_shared_snapshot(fingerprint):
+    try:
+        payload = get_binary_redis().get(REDIS_SNAPSHOT_KEY.format(fingerprint=fingerprint))
+    except Exception as e:
+        logger.warning(f"Could not read shared schema snapshot: {e}")
+        return None
+    return json.loads(zlib.decompress(payload)) if payload else None
+
+
+def _publish_shared_snapshot(fingerprint, schema_info):
+    try:
+        get_binary_redis().set(
+            REDIS_SNAPSHOT_KEY.format(fingerprint=fingerprint),
+            zlib.compress(json.dumps(schema_info, separators=(",", ":")).encode()),
+            ex=getattr(settings, "SCHEMA_CACHE_REDIS_TTL", 86400),
+        )
+    except Exception as e:
+        logger.warning(f"Could not publish shared schema snapshot: {e}")
+
+
+def _refresh_snapshot():
+    """
+    Check the catalog fingerprint and install a new snapshot if it changed.
+
+    Snapshots are taken from Redis when another worker already built one for the
+    same fingerprint; only the first worker to see a change introspects the catalog.
+    """
+    global _snapshot, _checked_at
+
+    conn = connect_schema_db()
+    try:
+        fingerprint = catalog_fingerprint(conn)
+        if _snapshot is not None and _snapshot.fingerprint == fingerprint:
+            _checked_at = time.monotonic()
+            return
+
+        schema_info = _load_shared_snapshot(fingerprint)
+        if schema_info is None:
+            schema_info = introspect_catalog(conn)
+            _publish_shared_snapshot(fingerprint, schema_info)
+            logger.info(f"Introspected schema snapshot {fingerprint}")
+        else:
+            logger.info(f"Loaded shared schema snapshot {fingerprint}")
+
+        _snapshot = SchemaSnapshot(fingerprint, schema_info)
+        _checked_at = time.monotonic()
+        _notify_listeners(_snapshot)
+    finally:
+        conn.close()
+
+
+def _run_listeners(snapshot, listeners):
+    for listener in listeners:
+        try:
+            listener(snapshot)
+        except Exception as e:
+            logger.warning(f"Schema snapshot listener {listener.__qualname__} failed: {e}")
+
+
+def _notify_listeners(snapshot, listeners=None):
+    listeners = list(_snapshot_listeners if listeners is None else listeners)
+    if listeners:
+        threading.Thread(
+            target=_run_listeners, args=(snapshot, listeners), name="schema-snapshot-listeners", daemon=True
+        ).start()
+
+
+def on_snapshot_loaded(listener):
+    """
+    Register ``listener(snapshot)`` to prepare per-snapshot structures whenever a
+    new schema snapshot is installed (and now, if one already is). Listeners run
+    on a background thread, so requests keep using the snapshot meanwhile.
+    """
+    _snapshot_listeners.append(listener)
+    if _snapshot is not None:
+        _notify_listeners(_snapshot, [listener])
+
+
+def _background_refresh():
+    global _checked_at
+    try:
+        _refresh_snapshot()
+    except Exception as e:
+        # Keep serving the current snapshot and retry after the next interval.
+        _checked_at = time.monotonic()
+        logger.error(f"Background schema refresh failed: {e}")
+    finally:
+        _refresh_lock.release()
+
+
+def _schedule_refresh():
+    # At most one refresh runs per process; callers keep serving the current snapshot.
+    if _refresh_lock.acquire(blocking=False):
+        threading.Thread(target=_background_refresh, name="schema-refresh", daemon=True).start()
+
+
+def get_schema_snapshot():
+    """
+    Return the current schema snapshot, loading it on first use.
+
+    Once a snapshot is loaded this never blocks on the database: when the check
+    interval has elapsed a background thread compares fingerprints and swaps in a
+    new snapshot if the catalog changed.
+
+    Returns:
+        SchemaSnapshot: Current snapshot, or None if the schema could not be loaded.
+    """
+    snapshot = _snapshot
+    if snapshot is not None:
+        if time.monotonic() - _checked_at >= getattr(settings, "SCHEMA_CACHE_CHECK_INTERVAL", 30):
+            _schedule_refresh()
+        return snapshot
+
+    with _load_lock:
+        if _snapshot is None:
+            try:
+                _refresh_snapshot()
+            except Exception as e:
+                logger.error(f"Error loading schema snapshot: {e}")
+        return _snapshot
+
+
+def get_cached_schema():
+    """
+    Cached drop-in for ``get_schema()``.
+
+    Returns:
+        dict: Schema information, or None if the schema could not be loaded.
+    """
+    snapshot = get_schema_snapshot()
+    return snapshot.schema_info if snapshot is not None else None
+
+
+def invalidate_schema_cache():
+    """
+    Force the next lookup to re-check the catalog fingerprint.
+    """
+    global _checked_at
+    _checked_at = 0.0
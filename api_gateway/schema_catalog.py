@@ -0,0 +1,145 @@
+# api_gateway/schema_catalog.py
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+# Element types whose vector ids (see schema_indexer.element_id) name a column
+COLUMN_ELEMENT_TYPES = ("column", "primary_key")
+
+
+class TableRecord:
+    """
+    One table of the catalog. ``info`` is the table's dict from the schema
+    snapshot, shared rather than copied.
+    """
+
+    __slots__ = ("schema", "name", "qualified", "columns", "info")
+
+    def __init__(self, schema, name, info):
+        self.schema = sys.intern(schema)
+        self.name = sys.intern(name)
+        self.qualified = sys.intern(f"{schema}.{name}")
+        self.columns = tuple(sys.intern(column) for column in info.get("columns", {}))
+        self.info = info
+
+    def __repr__(self):
+        return f"TableRecord({self.qualified!r})"
+
+
+class ForeignKey:
+    __slots__ = ("table", "column", "related_table", "related_column")
+
+    def __init__(self, table, column, related_table, related_column):
+        self.table = table
+        self.column = column
+        self.related_table = related_table
+        self.related_column = related_column
+
+
+class SchemaCatalog:
+    """
+    Hash indexes over a schema, so pipeline lookups don't walk the nested dicts.
+
+    Indexes:
+        tables: qualified name -> TableRecord
+        by_short_name: table name -> TableRecords in any schema
+        by_column: column name -> TableRecords having it
+        references / referenced_by: qualified name -> outgoing / incoming ForeignKeys
+
+    Schema-element vector ids (``column:schema.table.col``) resolve through
+    ``tables`` too, see ``element()``.
+
+    Names are interned, and so are the repeated ``data_type`` / ``is_nullable``
+    values of the snapshot dicts (in place), so every table and column shares one
+    string per distinct value.
+
+    Args:
+        schema_info (dict): Output of ``get_schema()`` (``{"schemas": {...}}``).
+    """
+
+    def __init__(self, schema_info=None):
+        self.tables = {}
+        self.by_short_name = {}
+        self.by_column = {}
+        self.references = {}
+        self.referenced_by = {}
+        for schema_name, schema in (schema_info or {}).get("schemas", {}).items():
+            for table_name, info in schema.get("tables", {}).items():
+                self._add(TableRecord(schema_name, table_name, info))
+        self._link_foreign_keys()
+
+    @classmethod
+    def from_tables(cls, tables):
+        """
+        Catalog of a mapped schema's ``{"schema.table": info}`` dict.
+        """
+        catalog = cls()
+        for qualified, info in tables.items():
+            schema_name, _, table_name = qualified.rpartition(".")
+            catalog._add(TableRecord(schema_name, table_name, info))
+        catalog._link_foreign_keys()
+        return catalog
+
+    def _add(self, record):
+        self.tables[record.qualified] = record
+        self.by_short_name.setdefault(record.name, []).append(record)
+        for column, column_info in record.info.get("columns", {}).items():
+            self.by_column.setdefault(sys.intern(column), []).append(record)
+            if isinstance(column_info, dict):
+                for key in ("data_type", "is_nullable"):
+                    if isinstance(column_info.get(key), str):
+                        column_info[key] = sys.intern(column_info[key])
+
+    def _link_foreign_keys(self):
+        # Foreign keys name the related table without its schema: prefer the
+        # referencing table's schema, else a table name that is unique
+        for record in self.tables.values():
+            for foreign_key in record.info.get("constraints", {}).get("foreign_keys", []):
+                related = self.resolve(foreign_key["related_table"], prefer_schema=record.schema)
+                if related is None:
+                    continue
+                edge = ForeignKey(record, foreign_key["column"], related, foreign_key["related_column"])
+                self.references.setdefault(record.qualified, []).append(edge)
+                self.referenced_by.setdefault(related.qualified, []).append(edge)
+
+    def table(self, schema, name):
+        return self.tables.get(f"{schema}.{name}")
+
+    def resolve(self, name, prefer_schema=None):
+        """
+        TableRecord for a qualified or bare table name, or None.
+
+        A bare name resolves to the table in ``prefer_schema`` if there is one,
+        else to the first table of that name.
+        """
+        record = self.tables.get(name)
+        if record is not None:
+            return record
+        candidates = self.by_short_name.get(name)
+        if not candidates:
+            return None
+        if prefer_schema is not None:
+            for candidate in candidates:
+                if candidate.schema == prefer_schema:
+                    return candidate
+        return candidates[0]
+
+    def element(self, element_id):
+        """
+        ``(TableRecord, column)`` for a schema-element vector id, or None.
+        """
+        element_type, _, path = element_id.partition(":")
+        if element_type not in COLUMN_ELEMENT_TYPES:
+            return None
+        qualified, _, column = path.rpartition(".")
+        record = self.tables.get(qualified)
+        if record is None or column not in record.info.get("columns", {}):
+            return None
+        return record, column
+
+    def tables_with_column(self, column):
+        return self.by_column.get(column, ())
+
+    def __len__(self):
+        return len(self.tables)
@@ -3,6 +3,9 @@ import psycopg2
 import os
 import logging
 
+from .schema_catalog import SchemaCatalog
+from .sql_rewriter import get_rewriter
+
 logger = logging.getLogger(__name__)
 
 
@@ -10,6 +13,9 @@ def standardize_table_names(sql_query, mapped_schema):
     """
     Replace plain table names in the SQL query with fully qualified names from the schema.
 
+    Only names in table positions are qualified; literals, comments and identifiers
+    that merely contain a table name are left alone (see ``SQLRewriter``).
+
     Args:
         sql_query (str): Generated SQL query.
         mapped_schema (dict): Schema information with fully qualified table names.
@@ -17,12 +23,7 @@ def standardize_table_names(sql_query, mapped_schema):
     Returns:
         str: SQL query with standardized table names.
     """
-    for table_name, table_info in mapped_schema["tables"].items():
-        short_table_name = table_name.split(".")[-1]  # Get the base table name (e.g., "employee")
-        sql_query = sql_query.replace(f"{short_table_name} ", f"{table_name} ")
-        sql_query = sql_query.replace(f"{short_table_name}(", f"{table_name}(")  # For subqueries or joins
-
-    return sql_query
+    return get_rewriter(mapped_schema).rewrite(sql_query)
 
 def print_dict_keys(d, prefix=""):
     """
@@ -44,77 +45,135 @@ def print_dict_keys(d, prefix=""):
 
 
 
-def map_relevant_schemas_to_tables(relevant_schemas, schema_info):
+def map_relevant_schemas_to_tables(relevant_schemas, schema_info, catalog=None):
     """
     Match relevant schemas and tables with the schema dictionary and retrieve their details.
 
     Args:
         relevant_schemas (list): List of relevant schema details as dictionaries.
         schema_info (dict): Complete schema information from the database.
+        catalog (SchemaCatalog): Index of ``schema_info``; built here if not given.
 
     Returns:
-        dict: Filtered schema details containing tables and their relationships.
+        dict: Filtered schema details containing tables and their relationships,
+        primary keys, and the best retrieval score per table and per column.
     """
     filtered_schema = {"tables": {}}
+    if catalog is None:
+        catalog = SchemaCatalog(schema_info)
 
     for schema_item in relevant_schemas:
-        # Extract schema and table name from the relevant schema item
-        schema_name = schema_item.get("schema")
+        record = _schema_item_table(schema_item, catalog)
+        if record is None:
+            continue  # Skip elements whose table is not in the schema
+
+        table_data = record.info
+        full_name = record.qualified
+        mapped = filtered_schema["tables"].get(full_name)
+        if mapped is None:
+            # Add the table and its relationships to the filtered schema
+            mapped = filtered_schema["tables"][full_name] = {
+                **prompt_table_info(table_data),
+                "column_scores": {},
+                "score": None,
+            }
+
+        # Retrieval scores let the prompt builder rank tables and columns
+        score = schema_item.get("score")
+        if score is not None:
+            mapped["score"] = score if mapped["score"] is None else max(mapped["score"], score)
+            column_name = schema_item.get("name")
+            if schema_item.get("type") == "column" and column_name in mapped["columns"]:
+                mapped["column_scores"][column_name] = max(
+                    mapped["column_scores"].get(column_name, score), score
+                )
+
+    return filtered_schema
+
+
+def prompt_table_info(table_data):
+    """
+    The parts of a snapshot table that the prompt shows: columns, relations (by
+    foreign key column) and primary key.
+    """
+    constraints = table_data.get("constraints", {})
+    return {
+        "columns": table_data.get("columns", {}),
+        "relations": table_data.get("relations") or {
+            foreign_key["column"]: {
+                "related_table": foreign_key["related_table"],
+                "related_column": foreign_key["related_column"],
+            }
+            for foreign_key in constraints.get("foreign_keys", [])
+        },
+        "primary_key": constraints.get("primary_key", []),
+    }
+
+
+def _schema_item_table(schema_item, catalog):
+    # Vector id first, then the schema/table metadata; retrieval results cached
+    # before those were included only name the table inside the description
+    # (e.g. "Column subtotal in table purchaseorderheader").
+    element_id = schema_item.get("id")
+    if element_id:
+        element = catalog.element(element_id)
+        if element is not None:
+            return element[0]
+
+    schema_name = schema_item.get("schema")
+    table_name = schema_item.get("table")
+    if not table_name:
         description = schema_item.get("description", "")
-        
-        # Extract the table name from the description (e.g., "Column subtotal in table purchaseorderheader")
-        table_name = None
         if "in table" in description:
             table_name = description.split("in table")[-1].strip()
+    if not schema_name or not table_name:
+        return None
+    return catalog.table(schema_name, table_name)
+
 
-        if not schema_name or not table_name:
-            continue  # Skip if schema or table name is missing
 
-        # Check if the schema exists in schema_info
-        if schema_name in schema_info.get("schemas", {}):
-            schema_data = schema_info["schemas"][schema_name]
+def iter_schema_elements(schema_info):
+    """
+    Yield one flat element per column and primary key column in the schema.
+
+    Args:
+        schema_info (dict): Output of ``get_schema()``.
 
-            # Check if the table exists in the schema
-            if table_name in schema_data.get("tables", {}):
-                # Add the table and its relationships to the filtered schema
-                filtered_schema["tables"][f"{schema_name}.{table_name}"] = {
-                    "columns": schema_data["tables"][table_name].get("columns", {}),
-                    "relations": schema_data["tables"][table_name].get("relations", {}),
+    Yields:
+        dict: Schema element with type, schema, table, name/column and description.
+    """
+    for schema_name, schema_data in schema_info["schemas"].items():
+        for table_name, table_data in schema_data["tables"].items():
+            # Process columns
+            for column_name, column_data in table_data.get("columns", {}).items():
+                yield {
+                    "type": "column",
+                    "schema": schema_name,
+                    "table": table_name,
+                    "name": column_name,
+                    "description": f"Column {column_name} of type {column_data.get('data_type', 'unknown')} in table {table_name}",
+                    "data_type": column_data.get("data_type", "unknown"),
+                    "is_nullable": column_data.get("is_nullable", "unknown")
                 }
 
-    return filtered_schema
+            # Process primary keys
+            for primary_key in table_data.get("constraints", {}).get("primary_key", []):
+                yield {
+                    "type": "primary_key",
+                    "schema": schema_name,
+                    "table": table_name,
+                    "column": primary_key,
+                    "description": f"Primary key on column {primary_key} in table {table_name}"
+                }
 
+            # Process other constraints similarly...
 
 
 def flatten_schema_info(schema_info):
     schema_elements = []
 
     try:
-        for schema_name, schema_data in schema_info["schemas"].items():
-            for table_name, table_data in schema_data["tables"].items():
-                # Process columns
-                for column_name, column_data in table_data.get("columns", {}).items():
-                    schema_elements.append({
-                        "type": "column",
-                        "schema": schema_name,
-                        "table": table_name,
-                        "name": column_name,
-                        "description": f"Column {column_name} of type {column_data.get('data_type', 'unknown')} in table {table_name}",
-                        "data_type": column_data.get("data_type", "unknown"),
-                        "is_nullable": column_data.get("is_nullable", "unknown")
-                    })
-
-                # Process primary keys
-                for primary_key in table_data.get("constraints", {}).get("primary_key", []):
-                    schema_elements.append({
-                        "type": "primary_key",
-                        "schema": schema_name,
-                        "table": table_name,
-                        "column": primary_key,
-                        "description": f"Primary key on column {primary_key} in table {table_name}"
-                    })
-
-                # Process other constraints similarly...
+        schema_elements.extend(iter_schema_elements(schema_info))
     except Exception as e:
         print(f"Error while flattening schema info: {e}")
 
@@ -122,10 +181,185 @@ def flatten_schema_info(schema_info):
 
 
 
-def get_schema():
-    schema_info = {"schemas": {}}
+# Schemas excluded from introspection; temp and toast namespaces are matched by prefix.
+SYSTEM_SCHEMAS = ("pg_catalog", "information_schema", "pg_toast")
+
+# The four catalog queries below cover the whole database, so introspection cost
+# no longer grows with the number of schemas. Each one is ordered so the rows can
+# be folded into the schema dict in a single pass.
+CATALOG_SCHEMAS_SQL = """
+    SELECT n.nspname
+    FROM pg_catalog.pg_namespace AS n
+    WHERE n.nspname NOT IN %(system_schemas)s
+      AND n.nspname NOT LIKE 'pg\\_toast%%'
+      AND n.nspname NOT LIKE 'pg\\_temp\\_%%'
+    ORDER BY n.nspname;
+"""
+
+CATALOG_COLUMNS_SQL = """
+    SELECT
+        n.nspname,
+        c.relname,
+        a.attname,
+        format_type(CASE WHEN t.typtype = 'd' THEN t.typbasetype ELSE a.atttypid END, NULL),
+        CASE WHEN a.attnotnull THEN 'NO' ELSE 'YES' END
+    FROM pg_catalog.pg_attribute AS a
+    JOIN pg_catalog.pg_class AS c ON c.oid = a.attrelid
+    JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+    JOIN pg_catalog.pg_type AS t ON t.oid = a.atttypid
+    WHERE c.relkind IN ('r', 'v', 'm', 'f', 'p')
+      AND a.attnum > 0
+      AND NOT a.attisdropped
+      AND n.nspname NOT IN %(system_schemas)s
+      AND has_table_privilege(c.oid, 'SELECT')
+    ORDER BY n.nspname, c.relname, a.attnum;
+"""
+
+# conkey/confkey are unnested pairwise, so a multi-column key yields exactly one row
+# per column instead of the cross product the information_schema join produced.
+CATALOG_KEY_CONSTRAINTS_SQL = """
+    SELECT
+        n.nspname,
+        c.relname,
+        con.contype,
+        con.conname,
+        a.attname,
+        rc.relname,
+        ra.attname
+    FROM pg_catalog.pg_constraint AS con
+    JOIN pg_catalog.pg_class AS c ON c.oid = con.conrelid
+    JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+    CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(attnum, fattnum, ord)
+    JOIN pg_catalog.pg_attribute AS a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+    LEFT JOIN pg_catalog.pg_class AS rc ON rc.oid = con.confrelid
+    LEFT JOIN pg_catalog.pg_attribute AS ra ON ra.attrelid = con.confrelid AND ra.attnum = k.fattnum
+    WHERE con.contype IN ('p', 'f', 'u')
+      AND n.nspname NOT IN %(system_schemas)s
+    ORDER BY n.nspname, c.relname, con.conname, k.ord;
+"""
+
+CATALOG_CHECK_CONSTRAINTS_SQL = """
+    SELECT
+        n.nspname,
+        c.relname,
+        con.conname,
+        substring(pg_get_constraintdef(con.oid) FROM 7)
+    FROM pg_catalog.pg_constraint AS con
+    JOIN pg_catalog.pg_class AS c ON c.oid = con.conrelid
+    JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+    WHERE con.contype = 'c'
+      AND n.nspname NOT IN %(system_schemas)s
+    ORDER BY n.nspname, c.relname, con.conname;
+"""
+
+# Rows fetched per round trip from the server-side cursors used for streaming.
+CATALOG_FETCH_SIZE = 5000
+
+
+def _stream_rows(conn, name, query):
+    """
+    Run a catalog query on a named (server-side) cursor and yield its rows in batches.
+
+    Args:
+        conn: Open psycopg2 connection.
+        name (str): Cursor name, unique within the transaction.
+        query (str): Catalog query taking the ``system_schemas`` parameter.
+
+    Yields:
+        tuple: One result row at a time.
+    """
+    with conn.cursor(name=name) as cursor:
+        cursor.itersize = CATALOG_FETCH_SIZE
+        cursor.execute(query, {"system_schemas": SYSTEM_SCHEMAS})
+        for row in cursor:
+            yield row
+
+
+def introspect_catalog(conn):
+    """
+    Build the schema dictionary for the whole database from pg_catalog.
+
+    Runs a fixed number of set-based queries regardless of how many schemas and
+    tables exist, and folds each result set into the dictionary in one pass.
 
-    conn = psycopg2.connect(
+    Args:
+        conn: Open psycopg2 connection.
+
+    Returns:
+        dict: Schema information in the same shape ``get_schema()`` has always returned.
+    """
+    schemas = {}
+    for (schema_name,) in _stream_rows(conn, "qp_catalog_schemas", CATALOG_SCHEMAS_SQL):
+        schemas[schema_name] = {"tables": {}}
+
+    # Rows arrive grouped by table, so the current table dict is reused until the
+    # (schema, table) pair changes instead of being looked up for every column.
+    current_key, columns = None, None
+    for schema_name, table_name, column_name, data_type, is_nullable in _stream_rows(
+        conn, "qp_catalog_columns", CATALOG_COLUMNS_SQL
+    ):
+        if (schema_name, table_name) != current_key:
+            current_key = (schema_name, table_name)
+            table = schemas.setdefault(schema_name, {"tables": {}})["tables"].setdefault(table_name, {
+                "columns": {},
+                "constraints": {
+                    "primary_key": [],
+                    "foreign_keys": [],
+                    "unique": [],
+                    "check": [],
+                }
+            })
+            columns = table["columns"]
+        columns[column_name] = {
+            "data_type": data_type,
+            "is_nullable": is_nullable
+        }
+
+    for (
+        schema_name,
+        table_name,
+        constraint_type,
+        constraint_name,
+        column_name,
+        related_table,
+        related_column,
+    ) in _stream_rows(conn, "qp_catalog_keys", CATALOG_KEY_CONSTRAINTS_SQL):
+        table = schemas.get(schema_name, {"tables": {}})["tables"].get(table_name)
+        if table is None:
+            continue
+        if constraint_type == "p":
+            table["constraints"]["primary_key"].append(column_name)
+        elif constraint_type == "f":
+            table["constraints"]["foreign_keys"].append({
+                "column": column_name,
+                "related_table": related_table,
+                "related_column": related_column,
+                "constraint_name": constraint_name
+            })
+        elif constraint_type == "u":
+            table["constraints"]["unique"].append({
+                "column": column_name,
+                "constraint_name": constraint_name
+            })
+
+    for schema_name, table_name, constraint_name, check_clause in _stream_rows(
+        conn, "qp_catalog_checks", CATALOG_CHECK_CONSTRAINTS_SQL
+    ):
+        table = schemas.get(schema_name, {"tables": {}})["tables"].get(table_name)
+        if table is not None:
+            table["constraints"]["check"].append({
+                "constraint_name": constraint_name,
+                "check_clause": check_clause
+            })
+
+    return {"schemas": schemas}
+
+
+def connect_schema_db():
+    """
+    Open a connection to the database configured through the DB_* environment variables.
+    """
+    return psycopg2.connect(
         dbname=os.getenv("DB_NAME"),
         user=os.getenv("DB_USER"),
         password=os.getenv("DB_PASSWORD"),
@@ -133,107 +367,20 @@ def get_schema():
         port=os.getenv("DB_PORT")
     )
 
-    try:
-        cursor = conn.cursor()
-
-        # Step 1: Retrieve all schemas except system schemas
-        cursor.execute("""
-            SELECT schema_name 
-            FROM information_schema.schemata 
-            WHERE schema_name NOT IN ('pg_catalog', 'information_schema', 'pg_toast');
-        """)
-        schemas = [row[0] for row in cursor.fetchall()]
-        print("List of Schemas : ",schemas)
-
-        for schema in schemas:
-            schema_info["schemas"][schema] = {"tables": {}}
-
-            # Step 2: Retrieve table and column details for each schema
-            cursor.execute("""
-                SELECT table_name, column_name, data_type, is_nullable
-                FROM information_schema.columns
-                WHERE table_schema = %s;
-            """, [schema])
-            columns = cursor.fetchall()
-
-            for table_name, column_name, data_type, is_nullable in columns:
-                if table_name not in schema_info["schemas"][schema]["tables"]:
-                    schema_info["schemas"][schema]["tables"][table_name] = {
-                        "columns": {},
-                        "constraints": {
-                            "primary_key": [],
-                            "foreign_keys": [],
-                            "unique": [],
-                            "check": [],
-                        }
-                    }
-                schema_info["schemas"][schema]["tables"][table_name]["columns"][column_name] = {
-                    "data_type": data_type,
-                    "is_nullable": is_nullable
-                }
 
-            # Step 3: Retrieve constraints (primary key, foreign key, unique, and check)
-            cursor.execute("""
-                SELECT
-                    tc.constraint_type,
-                    kcu.table_name AS table_name,
-                    kcu.column_name AS column_name,
-                    ccu.table_name AS related_table,
-                    ccu.column_name AS related_column,
-                    tc.constraint_name AS constraint_name
-                FROM information_schema.table_constraints AS tc
-                LEFT JOIN information_schema.key_column_usage AS kcu
-                    ON tc.constraint_name = kcu.constraint_name
-                LEFT JOIN information_schema.constraint_column_usage AS ccu
-                    ON ccu.constraint_name = tc.constraint_name
-                WHERE tc.table_schema = %s;
-            """, [schema])
-            constraints = cursor.fetchall()
-
-            for (
-                constraint_type,
-                table_name,
-                column_name,
-                related_table,
-                related_column,
-                constraint_name,
-            ) in constraints:
-                if table_name in schema_info["schemas"][schema]["tables"]:
-                    if constraint_type == "PRIMARY KEY":
-                        schema_info["schemas"][schema]["tables"][table_name]["constraints"]["primary_key"].append(column_name)
-                    elif constraint_type == "FOREIGN KEY":
-                        schema_info["schemas"][schema]["tables"][table_name]["constraints"]["foreign_keys"].append({
-                            "column": column_name,
-                            "related_table": related_table,
-                            "related_column": related_column,
-                            "constraint_name": constraint_name
-                        })
-                    elif constraint_type == "UNIQUE":
-                        schema_info["schemas"][schema]["tables"][table_name]["constraints"]["unique"].append({
-                            "column": column_name,
-                            "constraint_name": constraint_name
-                        })
-
-            # Step 4: Retrieve check constraints
-            cursor.execute("""
-                SELECT 
-                    tc.table_name,
-                    tc.constraint_name,
-                    cc.check_clause
-                FROM information_schema.table_constraints AS tc
-                JOIN information_schema.check_constraints AS cc
-                    ON tc.constraint_name = cc.constraint_name
-                WHERE tc.table_schema = %s AND tc.constraint_type = 'CHECK';
-            """, [schema])
-            check_constraints = cursor.fetchall()
-
-            for table_name, constraint_name, check_clause in check_constraints:
-                if table_name in schema_info["schemas"][schema]["tables"]:
-                    schema_info["schemas"][schema]["tables"][table_name]["constraints"]["check"].append({
-                        "constraint_name": constraint_name,
-                        "check_clause": check_clause
-                    })
+def get_schema():
+    """
+    Retrieve schema, table, column and constraint details for the configured database.
 
+    Returns:
+        dict: ``{"schemas": {schema: {"tables": {table: {"columns", "constraints"}}}}}``,
+        or None if introspection fails.
+    """
+    conn = connect_schema_db()
+
+    try:
+        schema_info = introspect_catalog(conn)
+        logger.info(f"Introspected {len(schema_info['schemas'])} schemas from pg_catalog")
         return schema_info
 
     except Exception as e:
@@ -241,5 +388,3 @@ def get_schema():
         return None
     finally:
         conn.close()
-
-
@@ -0,0 +1,341 @@
+# api_gateway/schema_indexer.py
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+EMBEDDING_CACHE_FILENAME = "embeddings.sqlite3"
+
+# Ids per delete request (Pinecone's limit).
+DELETE_BATCH_SIZE = 1000
+
+
+def index_dir():
+    """
+    Directory holding the index manifest and the embedding cache.
+    """
+    path = getattr(settings, "SCHEMA_INDEX_DIR", os.path.join(os.getcwd(), ".querypilot"))
+    os.makedirs(path, exist_ok=True)
+    return str(path)
+
+
+def element_id(element):
+    """
+    Stable vector id for a schema element, e.g. ``column:humanresources.employee.jobtitle``.
+    """
+    name = element.get("name") or element.get("column")
+    return f"{element['type']}:{element['schema']}.{element['table']}.{name}"
+
+
+def element_metadata(element):
+    """
+    Build the vector metadata stored alongside a schema element's embedding.
+
+    Raises:
+        ValueError: If the element has no description or a metadata value is missing.
+    """
+    description = element.get("description", "")
+    if not description:
+        raise ValueError(f"Missing description for schema element: {element}")
+
+    metadata = {
+        "type": element.get("type", "unknown"),
+        "schema": element.get("schema", "unknown"),
+        "table": element.get("table", "unknown"),
+        "name": element.get("name"),
+        "description": description
+    }
+
+    if element["type"] == "foreign_key":
+        metadata.update({
+            "related_table": element.get("related_table", "unknown"),
+            "related_column": element.get("related_column", "unknown"),
+            "constraint_name": element.get("constraint_name", "unknown")
+        })
+
+    # Special handling for primary_key type
+    if element["type"] == "primary_key":
+        metadata["name"] = element.get("column", "unknown")
+
+    # Validate metadata to ensure no invalid values
+    for key, value in metadata.items():
+        if value is None:
+            raise ValueError(f"Invalid metadata for element: {element}. Missing value for '{key}'.")
+
+    return metadata
+
+
+def content_hash(text, model_name):
+    """
+    Key of an embedding in the cache: the embedded text plus the model that embedded it.
+    """
+    return hashlib.sha256(f"{model_name}\0{text}".encode()).hexdigest()
+
+
+def load_manifest(path=None):
+    """
+    Load the manifest of the last successful indexing run.
+
+    Returns:
+        dict: ``{"model": str, "elements": {vector_id: metadata_hash}}``.
+    """
+    path = path or os.path.join(index_dir(), MANIFEST_FILENAME)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"model": None, "elements": {}}
+
+
+def save_manifest(manifest, path=None):
+    path = path or os.path.join(index_dir(), MANIFEST_FILENAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+class EmbeddingCache:
+    """
+    Local content-hash -> embedding store backed by SQLite.
+
+    Embeddings are kept as raw float32 bytes, so a schema element whose description
+    has been embedded once is never sent through the model again.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(index_dir(), EMBEDDING_CACHE_FILENAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit.
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items],
+            )
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+def diff_schema_elements(schema_elements, manifest, force=False):
+    """
+    Compare the current schema elements with the last indexed manifest.
+
+    Args:
+        schema_elements (iterable): Elements from ``iter_schema_elements()``.
+        manifest (dict): Manifest from ``load_manifest()``.
+        force (bool): Treat every current element as changed.
+
+    Returns:
+        tuple: ``(pending, current, removed)`` where ``pending`` maps vector id ->
+        metadata for added or changed elements, ``current`` maps every vector id to
+        its metadata hash, and ``removed`` lists ids that no longer exist.
+    """
+    indexed = manifest.get("elements", {})
+    pending = {}
+    current = {}
+
+    for element in schema_elements:
+        vector_id = element_id(element)
+        metadata = element_metadata(element)
+        digest = hashlib.sha256(json.dumps(metadata, sort_keys=True).encode()).hexdigest()
+        current[vector_id] = digest
+        if force or indexed.get(vector_id) != digest:
+            pending[vector_id] = metadata
+
+    removed = [vector_id for vector_id in indexed if vector_id not in current]
+    return pending, current, removed
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class EmbeddingEncoder:
+    """
+    Encodes large batches of texts, optionally spread over a multi-process pool.
+
+    With ``processes`` > 1 SentenceTransformer's multi-process pool runs one worker
+    per process on CPU; otherwise batches are encoded in-process.
+    """
+
+    def __init__(self, model, batch_size, processes=0):
+        self.model = model
+        self.batch_size = batch_size
+        self.pool = None
+        if processes and processes > 1:
+            self.pool = model.start_multi_process_pool(target_devices=["cpu"] * processes)
+
+    def encode(self, texts):
+        if self.pool is not None:
+            return self.model.encode_multi_process(texts, self.pool, batch_size=self.batch_size)
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+
+class BulkUpserter:
+    """
+    Sends chunked upserts from a thread pool with a bound on requests in flight.
+    """
+
+    def __init__(self, vector_index, chunk_size, max_in_flight):
+        self.vector_index = vector_index
+        self.chunk_size = chunk_size
+        self.max_in_flight = max(1, max_in_flight)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="upsert")
+        self.in_flight = set()
+
+    def _upsert(self, vectors):
+        try:
+            self.vector_index.upsert(vectors)
+        except Exception as e:
+            raise RuntimeError(f"Error storing embeddings starting at {vectors[0][0]}. Error: {e}")
+        return len(vectors)
+
+    def _drain(self, limit):
+        # Block until at most ``limit`` requests are pending, surfacing the first failure.
+        while len(self.in_flight) > limit:
+            done, self.in_flight = wait(self.in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+
+    def submit(self, vectors):
+        for chunk in _batched(vectors, self.chunk_size):
+            self._drain(self.max_in_flight - 1)
+            self.in_flight.add(self.executor.submit(self._upsert, chunk))
+
+    def close(self):
+        try:
+            self._drain(0)
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def index_schema_elements(schema_elements, model, vector_index, model_name, full_rebuild=False):
+    """
+    Bring the vector index in line with the current schema, touching only what changed.
+
+    Added and changed elements flow through a batched pipeline: cached embeddings
+    are reused, the rest are encoded in large batches, and vectors are upserted in
+    chunks with a bounded number of concurrent requests. Vectors of dropped elements
+    are deleted. The manifest is only written once the index has been updated.
+
+    Batch sizes, encoder processes and upsert concurrency come from the
+    SCHEMA_INDEX_* settings.
+
+    Args:
+        schema_elements (iterable): Elements from ``iter_schema_elements()``.
+        model: SentenceTransformer used for embedding.
+        vector_index (VectorStore): Vector store to update.
+        model_name (str): Name of the embedding model, part of the cache key.
+        full_rebuild (bool): Ignore the manifest and re-upsert every element.
+
+    Returns:
+        dict: Counts of upserted, removed, unchanged, encoded and cache-hit elements,
+        the version of the resulting index content, elapsed seconds and throughput
+        in elements/sec.
+    """
+    started = time.perf_counter()
+    manifest = load_manifest()
+    # Vectors from another model are not comparable, so a model change re-embeds everything.
+    force = full_rebuild or manifest.get("model") != model_name
+    pending, current, removed = diff_schema_elements(schema_elements, manifest, force=force)
+
+    stats = {
+        "upserted": 0,
+        "removed": len(removed),
+        "unchanged": len(current) - len(pending),
+        "encoded": 0,
+        "cache_hits": 0,
+    }
+
+    cache = EmbeddingCache()
+    encoder = EmbeddingEncoder(
+        model,
+        batch_size=getattr(settings, "SCHEMA_INDEX_ENCODE_BATCH_SIZE", 256),
+        processes=getattr(settings, "SCHEMA_INDEX_ENCODE_PROCESSES", 0),
+    )
+    upserter = BulkUpserter(
+        vector_index,
+        chunk_size=getattr(settings, "SCHEMA_INDEX_UPSERT_BATCH_SIZE", 100),
+        max_in_flight=getattr(settings, "SCHEMA_INDEX_UPSERT_CONCURRENCY", 4),
+    )
+    try:
+        # Each pipeline batch spans several encoder batches so the pool stays busy.
+        pipeline_batch = 8 * encoder.batch_size
+        for batch in _batched(pending.items(), pipeline_batch):
+            keys = [content_hash(metadata["description"], model_name) for _, metadata in batch]
+            embeddings = cache.get_many(set(keys))
+            stats["cache_hits"] += len(embeddings)
+
+            texts_by_key = {key: metadata["description"] for key, (_, metadata) in zip(keys, batch)}
+            missing = [key for key in texts_by_key if key not in embeddings]
+            if missing:
+                encoded = list(zip(missing, encoder.encode([texts_by_key[key] for key in missing])))
+                cache.put_many(encoded)
+                embeddings.update(encoded)
+                stats["encoded"] += len(missing)
+
+            upserter.submit([
+                (vector_id, np.asarray(embeddings[key]).tolist(), metadata)
+                for key, (vector_id, metadata) in zip(keys, batch)
+            ])
+            stats["upserted"] += len(batch)
+    finally:
+        try:
+            upserter.close()
+        finally:
+            encoder.close()
+            cache.close()
+
+    for start in range(0, len(removed), DELETE_BATCH_SIZE):
+        vector_index.delete(ids=removed[start:start + DELETE_BATCH_SIZE])
+    vector_index.flush()
+
+    save_manifest({"model": model_name, "elements": current})
+    stats["version"] = hashlib.sha256(json.dumps(current, sort_keys=True).encode()).hexdigest()[:16]
+
+    elapsed = time.perf_counter() - started
+    stats["seconds"] = round(elapsed, 3)
+    stats["elements_per_sec"] = round(len(pending) / elapsed, 1) if elapsed > 0 else 0.0
+    logger.info(f"Schema index updated: {stats}")
+    return stats
@@ -0,0 +1,187 @@
+# api_gateway/sql_rewriter.py
+import logging
+import re
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+_NAME = r'(?:[A-Za-z_][\w$]*|"(?:[^"]|"")*")'
+
+# The tokens the rewriter acts on. Comments, literals and numbers are matched
+# whole so that no identifier match can start inside one; whitespace and
+# operators between matches are copied through without being looked at.
+TOKEN = re.compile(
+    rf"""
+    (?P<name>{_NAME}(?:\.(?:{_NAME}|\*))*)
+  | (?P<punct>[(),;])
+  | (?P<string>'(?:[^']|'')*(?:'|$))
+  | (?P<comment>--[^\n]*|/\*[\s\S]*?(?:\*/|$))
+  | (?P<dollar>\$(?P<tag>[A-Za-z_]\w*)?\$[\s\S]*?(?:\$(?P=tag)?\$|$))
+  | (?P<number>\d[\w.]*)
+    """,
+    re.VERBOSE,
+)
+# Lookaheads from the end of a name
+FOLLOWED_BY_PAREN = re.compile(r"\s*\(")
+# "name AS (" or "name (col, ...) AS (" after WITH or a comma
+CTE_DEFINITION = re.compile(r"\s*(?:\([^()]*\)\s*)?AS\s+(?:NOT\s+)?(?:MATERIALIZED\s+)?\(", re.IGNORECASE)
+
+# Keywords after which the next name is a table
+TABLE_KEYWORDS = frozenset(("FROM", "JOIN", "UPDATE", "INTO"))
+# Keywords that may sit between one of those and the table
+TABLE_MODIFIERS = frozenset(("ONLY", "LATERAL"))
+# Keywords that end a FROM list at the current parenthesis level
+CLAUSE_KEYWORDS = frozenset((
+    "WHERE", "GROUP", "ORDER", "HAVING", "LIMIT", "OFFSET", "UNION", "INTERSECT", "EXCEPT",
+    "ON", "USING", "SET", "VALUES", "WINDOW", "RETURNING", "FETCH", "FOR", "SELECT",
+))
+
+# Table-name set -> SQLRewriter
+_rewriters = LRUCache("sql.rewriters", maxsize=256)
+
+
+class _Level:
+    # Parser state for one parenthesis level
+    __slots__ = ("in_from", "table_keyword", "has_select")
+
+    def __init__(self):
+        self.in_from = False
+        self.table_keyword = None
+        self.has_select = False
+
+
+class SQLRewriter:
+    """
+    Rewrites identifiers in generated SQL in one left-to-right pass.
+
+    Bare table names in table positions (after FROM/JOIN/UPDATE/INTO and in FROM
+    lists) are replaced with their schema-qualified names. String literals, comments,
+    quoted identifiers, CTE names and longer identifiers that merely contain a table
+    name are left as they are.
+
+    Args:
+        table_names (iterable): Fully qualified table names of the mapped schema.
+    """
+
+    def __init__(self, table_names=()):
+        self.tables = {}
+        ambiguous = set()
+        for full_name in table_names:
+            short_name = full_name.rpartition(".")[2].casefold()
+            if self.tables.get(short_name, full_name) != full_name:
+                ambiguous.add(short_name)
+            self.tables[short_name] = full_name
+        # A name that exists in several schemas can't be qualified safely
+        for short_name in ambiguous:
+            del self.tables[short_name]
+
+    def rewrite(self, sql_query, aliases=None, columns=None):
+        """
+        Rewrite ``sql_query``.
+
+        Args:
+            sql_query (str): SQL to rewrite.
+            aliases (dict): Qualifier -> replacement, applied to the first part of
+                dotted references (``e.name`` -> ``hr.employee.name``).
+            columns (dict): Column reference -> corrected reference, matched against
+                whole identifier chains (``e.nmae`` -> ``e.name``) before ``aliases``
+                applies.
+
+        Returns:
+            str: The rewritten SQL.
+        """
+        aliases = aliases or {}
+        columns = columns or {}
+        tables = self.tables
+        ctes = set()
+
+        out = []
+        position = 0
+        levels = [_Level()]
+        level = levels[0]
+        previous = None
+        for match in TOKEN.finditer(sql_query):
+            kind = match.lastgroup
+            if kind == "name":
+                text = match.group()
+                bare = "." not in text and '"' not in text
+                keyword = text.upper() if bare else None
+                # IS [NOT] DISTINCT FROM compares values; no table follows
+                after_distinct, previous = previous == "DISTINCT", keyword
+
+                if keyword in TABLE_KEYWORDS and not (keyword == "FROM" and after_distinct):
+                    # FROM inside EXTRACT(... FROM ...) and the like names no table
+                    if keyword != "FROM" or level.has_select or len(levels) == 1:
+                        level.table_keyword = keyword
+                        level.in_from = keyword in ("FROM", "JOIN")
+                    continue
+                if level.table_keyword:
+                    if keyword in TABLE_MODIFIERS:
+                        continue
+                    table_keyword, level.table_keyword = level.table_keyword, None
+                    folded = text.casefold() if bare else None
+                    if (
+                        folded in tables
+                        and folded not in ctes
+                        # FROM generate_series(...) is a function; INTO t(...) a column list
+                        and (table_keyword == "INTO" or not FOLLOWED_BY_PAREN.match(sql_query, match.end()))
+                    ):
+                        replacement = tables[folded]
+                    else:
+                        continue
+                else:
+                    if keyword in CLAUSE_KEYWORDS:
+                        level.in_from = False
+                    if keyword in ("SELECT", "DELETE"):
+                        level.has_select = True
+                    elif bare and tables and CTE_DEFINITION.match(sql_query, match.end()):
+                        ctes.add(text.casefold())
+                    replacement = columns.get(text, text)
+                    if aliases and "." in replacement:
+                        qualifier, _, rest = replacement.partition(".")
+                        if qualifier in aliases:
+                            replacement = f"{aliases[qualifier]}.{rest}"
+                    if replacement == text:
+                        continue
+
+                out.append(sql_query[position:match.start()])
+                out.append(replacement)
+                position = match.end()
+
+            elif kind == "punct":
+                previous = None
+                char = match.group()
+                if char == "(":
+                    # A subquery in table position; its alias follows the ")"
+                    level.table_keyword = None
+                    level = _Level()
+                    levels.append(level)
+                elif char == ")":
+                    if len(levels) > 1:
+                        levels.pop()
+                        level = levels[-1]
+                elif char == ",":
+                    if level.in_from:
+                        level.table_keyword = "FROM"
+                else:
+                    levels = [_Level()]
+                    level = levels[0]
+
+            elif kind != "comment":
+                previous = None
+
+        out.append(sql_query[position:])
+        return "".join(out)
+
+
+def get_rewriter(mapped_schema):
+    """
+    Shared ``SQLRewriter`` for the tables of a mapped schema.
+    """
+    table_names = tuple(sorted(mapped_schema.get("tables", {})))
+    rewriter = _rewriters.get(table_names)
+    if rewriter is None:
+        rewriter = SQLRewriter(table_names)
+        _rewriters.set(table_names, rewriter)
+    return rewriter
@@ -1,7 +1,15 @@
 # api_gateway/sql_service.py
 from sql_metadata import Parser
+import json
 import logging
-from django.db import connection
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from contextlib import contextmanager
+from django.db import connection, transaction
+from .db_pool import get_pool_manager
+from .column_index import embed_column, get_column_index
+from .schema_catalog import SchemaCatalog
+from .sql_rewriter import SQLRewriter
 
 logger = logging.getLogger(__name__)
 
@@ -9,51 +17,85 @@ logger = logging.getLogger(__name__)
 
 
 import re
-from difflib import get_close_matches
 
 import sqlparse
-from sentence_transformers import SentenceTransformer
 
-def validate_columns(parsed_query, table_map):
+# Plain column references in a SELECT list entry: "col", "t.col", "t.col AS x", "t.col x"
+COLUMN_REFERENCE = re.compile(r"^([A-Za-z_][\w$]*)(?:\.([A-Za-z_][\w$]*))?(?:\s+(?:AS\s+)?[A-Za-z_][\w$]*)?$", re.IGNORECASE)
+
+
+def validate_columns(parsed_query, table_map, column_index=None, catalog=None):
     """
     Validate and correct column names in the SQL query against the schema.
+
+    Lookups go through the schema snapshot's ``ColumnCorrectionIndex``: exact and
+    case-folded hits first, then edit-distance and trigram matches, and only then
+    the column embeddings, against the column encoded once for all candidate
+    tables. Expressions (``*``, function calls, ...) are
+    not column references and pass through unchecked.
+
     Args:
         parsed_query (dict): Parsed query components.
         table_map (dict): Mapping of table -> schema details.
+        column_index (ColumnCorrectionIndex): Defaults to the current snapshot's index.
+        catalog (SchemaCatalog): Catalog of the tables in ``table_map``; unqualified
+            columns are looked up in its column index before any table is scanned.
     Returns:
         dict: Validated and corrected columns.
     Raises:
         ValueError: If a column cannot be corrected.
     """
-    model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+    from .embedding_service import get_embedding_model
+
+    column_index = column_index or get_column_index()
+    model = None
     corrected_columns = {}
+    # Alias or table name -> table_map key, and table dict -> table_map key
+    qualifiers = {}
+    for key in table_map:
+        qualifiers.setdefault(key, key)
+        qualifiers.setdefault(key.rpartition(".")[2], key)
+    owners = {id(info): key for key, info in table_map.items()}
 
     for column in parsed_query["columns"]:
-        alias, col_name = (column.split(".") + [None])[:2]
+        match = COLUMN_REFERENCE.match(column)
+        if not match:
+            continue
+        alias, col_name = match.groups() if match.group(2) else (None, match.group(1))
+        reference = f"{alias}.{col_name}" if alias else col_name
+
         if alias:
-            # Identify the table from the alias
-            table_name = next((table for table in table_map if alias == table), None)
+            # Identify the table from the alias (or from the table's own name)
+            table_name = qualifiers.get(alias)
             if not table_name:
                 raise ValueError(f"Alias '{alias}' does not map to any table.")
+            candidates = [table_name]
         else:
-            # Match the column without alias
-            table_name = next((table for table in table_map if col_name in table_map[table]["columns"]), None)
-            if not table_name:
-                raise ValueError(f"Column '{col_name}' not found in schema.")
-
-        # Validate the column against the table's schema
-        valid_columns = table_map[table_name]["columns"].keys()
-        if col_name not in valid_columns:
-            # Use semantic similarity to suggest corrections
-            valid_column_embeddings = model.encode(list(valid_columns))
-            column_embedding = model.encode([col_name])
-            similarities = valid_column_embeddings @ column_embedding.T
-            closest_match = max(zip(valid_columns, similarities), key=lambda x: x[1])
-            if closest_match[1] < 0.8:  # Threshold for similarity
-                raise ValueError(f"Column '{col_name}' cannot be validated or corrected.")
-            corrected_columns[column] = f"{alias}.{closest_match[0]}" if alias else closest_match[0]
-        else:
-            corrected_columns[column] = column
+            # Tables that have the column as written come first
+            exact = [
+                owners[id(record.info)]
+                for record in (catalog.tables_with_column(col_name) if catalog else ())
+                if id(record.info) in owners
+            ]
+            candidates = exact or list(table_map)
+
+        corrected, vector = None, None
+        for needs_model in (False, True):
+            if needs_model:
+                model = model or get_embedding_model()
+                vector = embed_column(model, col_name)
+            for table_name in candidates:
+                corrected, method = column_index.table(table_map[table_name]).correct(col_name, model, vector)
+                if corrected is not None:
+                    break
+            if corrected is not None:
+                break
+        if corrected is None:
+            raise ValueError(f"Column '{col_name}' cannot be validated or corrected.")
+
+        if method != "exact":
+            logger.info(f"Corrected column '{reference}' -> '{corrected}' ({method})")
+        corrected_columns[reference] = f"{alias}.{corrected}" if alias else corrected
 
     return corrected_columns
 
@@ -107,13 +149,15 @@ def parse_sql_query(sql_query):
 
 
 
-def validate_tables(parsed_query, schema_info):
+def validate_tables(parsed_query, schema_info, catalog=None):
     """
     Validate table names in the SQL query against the schema.
 
     Args:
         parsed_query (dict): Parsed query components.
         schema_info (dict): Schema information.
+        catalog (SchemaCatalog): Catalog of ``schema_info["tables"]``; built here if
+            not given.
 
     Returns:
         dict: Mapping of fully qualified table names -> schema details.
@@ -122,21 +166,18 @@ def validate_tables(parsed_query, schema_info):
         ValueError: If a table is not found in the schema.
     """
     table_map = {}
-    schema_tables = schema_info["tables"]
+    catalog = catalog or SchemaCatalog.from_tables(schema_info["tables"])
 
     for table in parsed_query["tables"]:
         table_name = table["name"]
         alias = table["alias"]
 
         # Match table name to fully qualified schema tables
-        qualified_table_name = next(
-            (schema_table for schema_table in schema_tables if schema_table.endswith(f".{table_name}")), None
-        )
-
-        if not qualified_table_name:
+        record = catalog.resolve(table_name)
+        if record is None:
             raise ValueError(f"Table '{table_name}' not found in schema.")
 
-        table_map[alias or qualified_table_name] = schema_tables[qualified_table_name]
+        table_map[alias or record.qualified] = record.info
 
     return table_map
 
@@ -179,17 +220,17 @@ def correct_sql_query(sql_query, table_map, corrected_columns):
     Returns:
         str: Corrected SQL query.
     """
-    # Correct table aliases with fully qualified table names
-    for alias, full_table_name in table_map.items():
-        # Replace the alias with its fully qualified table name
-        if alias and isinstance(full_table_name, str):
-            sql_query = sql_query.replace(f"{alias}.", f"{full_table_name}.")
-
-    # Correct column names
-    for original, corrected in corrected_columns.items():
-        sql_query = sql_query.replace(original, corrected)
-
-    return sql_query
+    # Aliases with a fully qualified table name, and columns that actually changed,
+    # are rewritten in a single pass over the query's tokens
+    aliases = {
+        alias: full_table_name
+        for alias, full_table_name in table_map.items()
+        if alias and isinstance(full_table_name, str)
+    }
+    columns = {original: corrected for original, corrected in corrected_columns.items() if original != corrected}
+    if not aliases and not columns:
+        return sql_query
+    return SQLRewriter().rewrite(sql_query, aliases=aliases, columns=columns)
 
 
 
@@ -208,15 +249,16 @@ def process_query_pipeline(sql_query, schema_info):
     try:
         # Step 1: Parse SQL query
         parsed_query = parse_sql_query(sql_query)
-        print("Parsed Query:", parsed_query)
+        logger.debug(f"Parsed Query: {parsed_query}")
 
         # Step 2: Validate tables
-        table_map = validate_tables(parsed_query, schema_info)
-        print("Validated Tables:", table_map)
+        catalog = SchemaCatalog.from_tables(schema_info["tables"])
+        table_map = validate_tables(parsed_query, schema_info, catalog)
+        logger.debug(f"Validated Tables: {list(table_map)}")
 
         # Step 3: Validate and correct columns
-        corrected_columns = validate_columns(parsed_query, table_map)
-        print("Corrected Columns:", corrected_columns)
+        corrected_columns = validate_columns(parsed_query, table_map, catalog=catalog)
+        logger.debug(f"Corrected Columns: {corrected_columns}")
 
         # Step 4: Correct the SQL query
         corrected_query = correct_sql_query(sql_query, table_map, corrected_columns)
@@ -226,20 +268,256 @@ def process_query_pipeline(sql_query, schema_info):
         return f"Error: {str(e)}"
 
 
-def execute_sql_query(sql_query):
+# PostgreSQL type OIDs (cursor.description type_code) -> result column type names
+PG_TYPE_NAMES = {
+    16: "bool",
+    20: "int8",
+    21: "int2",
+    23: "int4",
+    700: "float4",
+    701: "float8",
+    1700: "numeric",
+    18: "text",
+    19: "text",
+    25: "text",
+    1042: "text",
+    1043: "text",
+    1082: "date",
+    1083: "time",
+    1114: "timestamp",
+    1184: "timestamptz",
+    1186: "interval",
+    2950: "uuid",
+    114: "json",
+    3802: "json",
+    17: "bytea",
+}
+
+
+class ResultSet:
     """
-    Validate, correct, and execute the SQL query.
+    Rows of an executed query as fetched (tuples), with column names and types.
+
+    Renderers decide the wire shape: records (one dict per row), columns, or Arrow.
     """
-    try:
-        
 
-        with connection.cursor() as cursor:
+    __slots__ = ("columns", "types", "rows")
+
+    def __init__(self, columns, types, rows):
+        self.columns = columns
+        self.types = types
+        self.rows = rows
+
+    def records(self):
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.rows]
+
+    def column_values(self):
+        return [list(values) for values in zip(*self.rows)] if self.rows else [[] for _ in self.columns]
+
+    def __len__(self):
+        return len(self.rows)
+
+
+STATEMENT_TIMEOUT_SQL = "SELECT set_config('statement_timeout', %s, true)"
+
+
+def statement_timeout_ms(statement_timeout=None):
+    if statement_timeout is None:
+        return getattr(settings, "QUERY_STATEMENT_TIMEOUT_MS", 30000)
+    return statement_timeout
+
+
+@contextmanager
+def query_cursor(db_credentials=None, name=None, statement_timeout=None):
+    """
+    Cursor on the session's database, or on Django's default connection when no
+    credentials are given.
+
+    The cursor always runs in a transaction with a transaction-local
+    ``statement_timeout``, so Postgres cancels anything that runs longer. Session
+    databases are reached through the pooled connections of ``db_pool``; the work
+    is committed when the block exits cleanly and rolled back otherwise.
+
+    Args:
+        db_credentials (dict): Credentials saved by ``connect_to_db``.
+        name (str): Open a named server-side cursor.
+        statement_timeout (int): Milliseconds; defaults to ``QUERY_STATEMENT_TIMEOUT_MS``,
+            0 disables it.
+    """
+    timeout = statement_timeout_ms(statement_timeout)
+    if db_credentials:
+        with get_pool_manager().connection(db_credentials) as conn:
+            if timeout:
+                with conn.cursor() as cursor:
+                    cursor.execute(STATEMENT_TIMEOUT_SQL, [str(timeout)])
+            with conn.cursor(name=name) as cursor:
+                yield cursor
+            conn.commit()
+        return
+
+    with transaction.atomic():
+        if timeout:
+            with connection.cursor() as cursor:
+                cursor.execute(STATEMENT_TIMEOUT_SQL, [str(timeout)])
+        with (connection.chunked_cursor() if name else connection.cursor()) as cursor:
+            yield cursor
+
+
+def execute_sql_result(sql_query, db_credentials=None):
+    """
+    Execute the SQL query and return its rows without reshaping them.
+
+    Args:
+        sql_query (str): SQL query to execute.
+        db_credentials (dict): Run against the session's database instead of the
+            default one.
+
+    Returns:
+        ResultSet: Fetched rows, or ``{"error": str}`` if execution failed.
+    """
+    try:
+        with query_cursor(db_credentials) as cursor:
             cursor.execute(sql_query)
-            columns = [col[0] for col in cursor.description]  # Get column names
-            results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            description = cursor.description or []
+            rows = cursor.fetchall() if description else []
         logger.info("SQL query executed successfully")
-        return results
+        return ResultSet(
+            [col[0] for col in description],
+            [PG_TYPE_NAMES.get(col[1], "unknown") for col in description],
+            rows,
+        )
 
     except Exception as e:
         logger.error(f"Error executing SQL query: {e}")
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+
+
+def execute_sql_query(sql_query, db_credentials=None):
+    """
+    Validate, correct, and execute the SQL query.
+    """
+    result = execute_sql_result(sql_query, db_credentials)
+    return result.records() if isinstance(result, ResultSet) else result
+
+
+def iter_sql_query(sql_query, batch_size=None, db_credentials=None):
+    """
+    Execute a query on a server-side (named) cursor and yield its rows in batches.
+
+    Only ``batch_size`` rows are held in memory at a time; the rest stay on the
+    server until fetched. The cursor lives in its own transaction, which ends when
+    the generator is exhausted or closed.
+
+    A result that fits in the first batch is fetched whole and its cursor closed
+    before the batch is yielded. A larger result keeps its transaction (and its
+    pooled or Django connection) open until the consumer has taken every batch,
+    i.e. for as long as a streaming client takes to read the response. Those
+    connections are therefore bounded by the number of slow readers, and the
+    generator must be consumed in the thread that started it, so it can't back
+    a response of the async view.
+
+    Args:
+        sql_query (str): SQL query to execute.
+        batch_size (int): Rows per ``fetchmany``; defaults to ``QUERY_FETCH_SIZE``.
+        db_credentials (dict): Run against the session's database instead of the
+            default one.
+
+    Yields:
+        tuple: ``(columns, rows)``. The first batch is always yielded, possibly empty.
+    """
+    batch_size = batch_size or getattr(settings, "QUERY_FETCH_SIZE", 1000)
+    with query_cursor(db_credentials, name="qp_result_stream") as cursor:
+        cursor.execute(sql_query)
+        rows = cursor.fetchmany(batch_size)
+        # Named cursors only describe their columns once something was fetched
+        columns = [col[0] for col in cursor.description or []]
+        complete = len(rows) < batch_size
+        if not complete:
+            yield columns, rows
+            while len(rows) == batch_size:
+                rows = cursor.fetchmany(batch_size)
+                if rows:
+                    yield columns, rows
+    if complete:
+        # Sent after the cursor and its connection were released
+        yield columns, rows
+
+
+def open_sql_query(sql_query, batch_size=None, db_credentials=None):
+    """
+    Start ``iter_sql_query()`` right away, so execution errors are raised here
+    rather than halfway through a streamed response.
+
+    Returns:
+        iterator: The ``(columns, rows)`` batches, first batch included.
+    """
+    batches = iter_sql_query(sql_query, batch_size, db_credentials)
+    first = next(batches)
+
+    def resume():
+        try:
+            yield first
+            yield from batches
+        finally:
+            batches.close()
+
+    return resume()
+
+
+def stream_query_json(batches, head=None, max_rows=None, max_bytes=None):
+    """
+    Encode ``iter_sql_query()`` batches as a single JSON document, chunk by chunk.
+
+    The document is ``{**head, "columns": [...], "results": [{...}, ...],
+    "row_count": n, "truncated": bool}``. Output stops once ``max_rows`` rows or
+    ``max_bytes`` bytes of rows were emitted; the cursor is then closed and
+    ``truncated`` is true.
+
+    Args:
+        batches (iterator): ``(columns, rows)`` batches.
+        head (dict): Fields emitted before the results, e.g. the SQL query.
+        max_rows (int): Row cap; defaults to ``QUERY_MAX_ROWS``.
+        max_bytes (int): Cap on encoded row bytes; defaults to ``QUERY_MAX_BYTES``.
+
+    Yields:
+        bytes: JSON fragments.
+    """
+    max_rows = max_rows or getattr(settings, "QUERY_MAX_ROWS", 100000)
+    max_bytes = max_bytes or getattr(settings, "QUERY_MAX_BYTES", 64 * 1024 * 1024)
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    batches = iter(batches)
+
+    row_count, byte_count, truncated = 0, 0, False
+    columns = None
+    try:
+        for columns_, rows in batches:
+            if columns is None:
+                columns = columns_
+                opening = dict(head or {}, columns=columns)
+                yield (encoder.encode(opening)[:-1] + ',"results":[').encode()
+
+            parts = []
+            for row in rows:
+                encoded = encoder.encode(dict(zip(columns, row)))
+                if row_count >= max_rows or byte_count + len(encoded) > max_bytes:
+                    truncated = True
+                    break
+                parts.append(encoded)
+                row_count += 1
+                byte_count += len(encoded) + 1
+            if parts:
+                yield ((b"," if row_count > len(parts) else b"") + ",".join(parts).encode())
+            if truncated:
+                logger.info(f"Streamed result truncated at {row_count} rows / {byte_count} bytes")
+                break
+    finally:
+        # Releases the server-side cursor when the client goes away or a cap is hit
+        close = getattr(batches, "close", None)
+        if close is not None:
+            close()
+
+    if columns is None:
+        yield (encoder.encode(dict(head or {}, columns=[]))[:-1] + ',"results":[').encode()
+    yield f'],"row_count":{row_count},"truncated":{json.dumps(truncated)}}}'.encode()
+
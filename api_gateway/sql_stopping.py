@@ -0,0 +1,103 @@
+# api_gateway/sql_stopping.py
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SQLCompletionTracker:
+    """
+    Incremental scanner that notices when generated text holds a complete SQL statement.
+
+    Text is fed in arbitrary pieces (one decoded token at a time during generation).
+    The statement is complete at the first ``;`` that is outside string literals,
+    quoted identifiers and comments, with all parentheses closed.
+    """
+
+    __slots__ = ("depth", "quote", "comment", "complete", "_previous")
+
+    def __init__(self):
+        self.depth = 0
+        self.quote = None
+        self.comment = None
+        self.complete = False
+        self._previous = ""
+
+    def feed(self, text):
+        """
+        Scan the next piece of generated text.
+
+        Returns:
+            bool: True once a complete statement has been seen.
+        """
+        if self.complete:
+            return True
+
+        for char in text:
+            previous, self._previous = self._previous, char
+
+            if self.comment == "line":
+                if char == "\n":
+                    self.comment = None
+                continue
+            if self.comment == "block":
+                if previous == "*" and char == "/":
+                    self.comment = None
+                    self._previous = ""
+                continue
+            if self.quote:
+                # A doubled quote ('') closes and reopens, which nets out the same.
+                if char == self.quote:
+                    self.quote = None
+                continue
+
+            if char in "'\"":
+                self.quote = char
+            elif previous == "-" and char == "-":
+                self.comment = "line"
+            elif previous == "/" and char == "*":
+                self.comment = "block"
+                self._previous = ""
+            elif char == "(":
+                self.depth += 1
+            elif char == ")":
+                self.depth = max(0, self.depth - 1)
+            elif char == ";" and self.depth == 0:
+                self.complete = True
+                return True
+
+        return False
+
+
+def sql_statement_complete(text):
+    """
+    Whether ``text`` contains a complete, terminated SQL statement.
+    """
+    return SQLCompletionTracker().feed(text)
+
+
+class SQLCompleteCriteria:
+    """
+    Generation stopping criterion that ends each row once its SQL statement is complete.
+
+    Follows the transformers ``StoppingCriteria`` call protocol (per-row bool tensor),
+    so it can go into a ``StoppingCriteriaList`` without importing transformers here.
+    Rows that end with EOS are already stopped by ``generate()`` itself.
+
+    Args:
+        tokenizer: Tokenizer used to decode each newly generated token.
+        batch_size (int): Number of rows being generated.
+    """
+
+    def __init__(self, tokenizer, batch_size):
+        self.tokenizer = tokenizer
+        self.trackers = [SQLCompletionTracker() for _ in range(batch_size)]
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        done = []
+        for tracker, token_id in zip(self.trackers, input_ids[:, -1].tolist()):
+            if not tracker.complete:
+                tracker.feed(self.tokenizer.decode([token_id], skip_special_tokens=True))
+            done.append(tracker.complete)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
@@ -8,10 +8,18 @@ from .views import (
     process_query,
     validate_query,
     execute_query,
-    inspect_session
+    inspect_session,
+    cache_statistics,
+    generation_statistics
 )
 urlpatterns = [
     path('query/', views.QueryView.as_view(), name='query'), 
+
+    # Same pipeline, streamed as Server-Sent Events while the SQL decodes
+    path('query/stream/', views.QueryStreamView.as_view(), name='query_stream'),
+
+    # Same pipeline as an async view (ASGI), with concurrent stages
+    path('query/async/', views.query_async, name='query_async'),
     
     # Stage 1: Connect to Database
     path('connect/', connect_to_db, name='connect_to_db'),
@@ -32,7 +40,13 @@ urlpatterns = [
     path('query/execute/', execute_query, name='execute_query'),
 
     # Debugging: Inspect Session Data
-    path('session/<str:session_id>/', inspect_session, name='inspect_session')
+    path('session/<str:session_id>/', inspect_session, name='inspect_session'),
+
+    # Debugging: Cache hit/miss counters
+    path('cache/stats/', cache_statistics, name='cache_statistics'),
+
+    # Debugging: SQL generation throughput
+    path('generation/stats/', generation_statistics, name='generation_statistics')
 
 
 
@@ -1,44 +1,143 @@
 # api_gateway/utils.py
 import os
-from pinecone import Pinecone, ServerlessSpec
+import zlib
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 
 from redis import Redis
 import json
 
-# Initialize Redis client
-redis_client = Redis(host="localhost", port=6379, decode_responses=True)
+from .registry import register
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def _redis_client(**kwargs):
+    return Redis.from_url(
+        getattr(settings, "REDIS_URL", "redis://localhost:6379/0"),
+        max_connections=getattr(settings, "REDIS_MAX_CONNECTIONS", 50),
+        **kwargs,
+    )
+
+
+# Redis clients are created on first use, each with its own connection pool
+_redis = register("redis", lambda: _redis_client(decode_responses=True))
+# Client for binary payloads (compressed snapshots, packed vectors, session values)
+_binary_redis = register("redis_binary", _redis_client)
+
+
+def get_redis():
+    return _redis.get()
+
+
+def get_binary_redis():
+    return _binary_redis.get()
+
+
+SESSION_KEY = "session:{session_id}"
+
+# Session values start with a one-byte tag; the tags can't begin a JSON document,
+# so values written before the tags existed still decode as plain JSON.
+TAG_JSON = b"\x01"
+TAG_MSGPACK = b"\x02"
+TAG_ZLIB = b"\x03"
+
+_json_encoder = DjangoJSONEncoder(separators=(",", ":"))
+
+
+def _encode_default(value):
+    # Decimals, dates, UUIDs... the same strings the JSON encoder produces
+    return _json_encoder.default(value)
+
+
+def encode_session_value(value):
+    """
+    Serialize a session value: msgpack when installed (else compact JSON), then
+    zlib above ``SESSION_COMPRESS_THRESHOLD`` bytes when that actually saves space.
+    """
+    if msgpack is not None:
+        payload = TAG_MSGPACK + msgpack.packb(value, default=_encode_default, use_bin_type=True)
+    else:
+        payload = TAG_JSON + _json_encoder.encode(value).encode()
+    if len(payload) > getattr(settings, "SESSION_COMPRESS_THRESHOLD", 1024):
+        compressed = TAG_ZLIB + zlib.compress(payload)
+        if len(compressed) < len(payload):
+            return compressed
+    return payload
+
+
+def decode_session_value(payload):
+    """
+    Inverse of ``encode_session_value()``; untagged values are legacy JSON.
+    """
+    if payload is None:
+        return None
+    tag = payload[:1]
+    if tag == TAG_ZLIB:
+        return decode_session_value(zlib.decompress(payload[1:]))
+    if tag == TAG_MSGPACK:
+        if msgpack is None:
+            raise RuntimeError("Session value was written with msgpack, which is not installed")
+        return msgpack.unpackb(payload[1:], raw=False)
+    if tag == TAG_JSON:
+        payload = payload[1:]
+    return json.loads(payload)
+
+
+def update_session(session_id, **fields):
+    """
+    Write several session fields in one round trip and refresh the session's TTL.
+
+    All fields go out as a single ``HSET`` mapping, pipelined with the ``EXPIRE``
+    (``SESSION_TTL`` seconds; 0 keeps sessions forever).
+    """
+    if not fields:
+        return
+    key = SESSION_KEY.format(session_id=session_id)
+    pipe = get_binary_redis().pipeline(transaction=False)
+    pipe.hset(key, mapping={name: encode_session_value(value) for name, value in fields.items()})
+    ttl = getattr(settings, "SESSION_TTL", 86400)
+    if ttl:
+        pipe.expire(key, ttl)
+    pipe.execute()
+
 
 def save_session_data(session_id, key, value):
     """
     Save a key-value pair to the session in Redis.
     """
-    redis_client.hset(f"session:{session_id}", key, json.dumps(value))
+    update_session(session_id, **{key: value})
 
 def get_session_data(session_id, key):
     """
     Retrieve a value by key from the session in Redis.
     """
-    data = redis_client.hget(f"session:{session_id}", key)
-    return json.loads(data) if data else None
+    data = get_binary_redis().hget(SESSION_KEY.format(session_id=session_id), key)
+    return decode_session_value(data) if data else None
 
 def get_full_session(session_id):
     """
     Retrieve all session data for a given session ID.
     """
-    data = redis_client.hgetall(f"session:{session_id}")
-    return {key: json.loads(value) for key, value in data.items()}
+    data = get_binary_redis().hgetall(SESSION_KEY.format(session_id=session_id))
+    return {key.decode(): decode_session_value(value) for key, value in data.items()}
 
 def delete_session(session_id):
     """
     Delete a session from Redis.
     """
-    redis_client.delete(f"session:{session_id}")
+    get_binary_redis().delete(SESSION_KEY.format(session_id=session_id))
 
 def update_pipeline_stage(session_id, stage):
     save_session_data(session_id, "pipeline_stage", stage)
 
 
 def initialize_pinecone():
+    from pinecone import Pinecone, ServerlessSpec
+
     # Create a Pinecone instance
     pc = Pinecone(
         api_key=os.getenv('PINECONE_API_KEY')
@@ -59,3 +158,32 @@ def initialize_pinecone():
         )
     
     return pc.Index(index_name)
+
+
+def initialize_vector_store():
+    """
+    Create the vector store selected by ``VECTOR_STORE_BACKEND``.
+
+    "pinecone" wraps the hosted Pinecone index; "local" opens the memory-mapped
+    in-process index under ``LOCAL_VECTOR_INDEX_DIR``.
+    """
+    from .vector_store import LocalVectorIndex, PineconeVectorStore
+
+    backend = getattr(settings, "VECTOR_STORE_BACKEND", "pinecone")
+    if backend == "local":
+        return LocalVectorIndex(
+            settings.LOCAL_VECTOR_INDEX_DIR,
+            dimension=384,
+            ivf_threshold=getattr(settings, "LOCAL_VECTOR_INDEX_IVF_THRESHOLD", 50000),
+            nprobe=getattr(settings, "LOCAL_VECTOR_INDEX_NPROBE", 8),
+        )
+    if backend == "pinecone":
+        return PineconeVectorStore(initialize_pinecone())
+    raise ValueError(f"Unknown VECTOR_STORE_BACKEND: {backend}")
+
+
+_vector_store = register("vector_store", initialize_vector_store)
+
+
+def get_vector_store():
+    return _vector_store.get()
@@ -0,0 +1,280 @@
+# api_gateway/vector_store.py
+import json
+import logging
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class VectorStore(ABC):
+    """
+    Minimal interface the embedding service needs from a vector index.
+
+    Matches Pinecone's ``Index`` calling convention so backends are interchangeable:
+    ``upsert`` takes ``(id, values, metadata)`` tuples and ``query`` returns
+    ``{"matches": [{"id", "score", "metadata"}]}``.
+    """
+
+    @abstractmethod
+    def upsert(self, vectors):
+        ...
+
+    @abstractmethod
+    def delete(self, ids):
+        ...
+
+    @abstractmethod
+    def query(self, vector, top_k, include_metadata=True):
+        ...
+
+    def flush(self):
+        """Persist buffered writes. A no-op for backends that write through."""
+
+
+class PineconeVectorStore(VectorStore):
+    """
+    Pinecone-backed store; every call is a network round trip.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def upsert(self, vectors):
+        return self.index.upsert(vectors)
+
+    def delete(self, ids):
+        return self.index.delete(ids=ids)
+
+    def query(self, vector, top_k, include_metadata=True):
+        return self.index.query(vector=vector, top_k=top_k, include_metadata=include_metadata)
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def _train_ivf(vectors, nlist, iterations=10, sample_size=50000, seed=0):
+    """
+    Spherical k-means over (a sample of) normalized vectors.
+
+    Returns:
+        np.ndarray: ``nlist`` x dim matrix of normalized centroids, fewer when the
+        sample has fewer than ``nlist`` vectors.
+    """
+    rng = np.random.default_rng(seed)
+    sample = vectors
+    if len(vectors) > sample_size:
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    nlist = min(nlist, len(sample))
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        empty = ~sums.any(axis=1)
+        # Re-seed empty lists so every centroid keeps a share of the data.
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def _assign(vectors, centroids, chunk_size=65536):
+    return np.concatenate([
+        np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), chunk_size)
+    ]) if len(vectors) else np.zeros(0, dtype=np.int64)
+
+
+# One loaded index version, swapped as a unit so readers never mix versions.
+_IndexState = namedtuple("_IndexState", "version ids metadata vectors centroids offsets")
+
+
+class LocalVectorIndex(VectorStore):
+    """
+    In-process cosine index persisted as memory-mapped files.
+
+    Vectors are stored normalized in a single float32 ``.npy`` matrix that readers
+    open with ``mmap_mode="r"``, so every worker on a host shares one copy of the
+    pages through the OS page cache. Small indexes are searched exhaustively with
+    one matrix-vector product; above ``ivf_threshold`` vectors an IVF partitioning
+    (spherical k-means) is built and only the ``nprobe`` nearest lists are scanned.
+    Rows are stored grouped by list, so each probed list is a contiguous slice.
+
+    Each write produces a new version directory and atomically repoints
+    ``CURRENT`` at it; readers notice the new version on their next query.
+    Writes are buffered until ``flush()`` (or the next query on the same instance).
+    """
+
+    CURRENT_FILENAME = "CURRENT"
+
+    def __init__(self, path, dimension=384, ivf_threshold=50000, nprobe=8):
+        self.path = str(path)
+        self.dimension = dimension
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        os.makedirs(self.path, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._state = _IndexState(None, [], [], np.zeros((0, dimension), dtype=np.float32), None, None)
+        self._pending_upserts = {}
+        self._pending_deletes = set()
+        self._reload_if_changed()
+
+    # -- persistence -----------------------------------------------------------------
+
+    def _current_version(self):
+        try:
+            with open(os.path.join(self.path, self.CURRENT_FILENAME)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _reload_if_changed(self):
+        version = self._current_version()
+        if version is None or version == self._state.version:
+            return
+        with self._lock:
+            if version == self._state.version:
+                return
+            version_dir = os.path.join(self.path, version)
+            vectors = np.load(os.path.join(version_dir, "vectors.npy"), mmap_mode="r")
+            with open(os.path.join(version_dir, "metadata.json")) as f:
+                rows = json.load(f)
+            centroids, offsets = None, None
+            ivf_path = os.path.join(version_dir, "ivf.npz")
+            if os.path.exists(ivf_path):
+                with np.load(ivf_path) as ivf:
+                    centroids, offsets = ivf["centroids"], ivf["offsets"]
+
+            self._state = _IndexState(
+                version, [row[0] for row in rows], [row[1] for row in rows], vectors, centroids, offsets
+            )
+            logger.info(f"Loaded local vector index {version} ({len(rows)} vectors)")
+
+    def _write_version(self, ids, metadata, vectors):
+        centroids, offsets = None, None
+        if len(vectors) >= self.ivf_threshold:
+            nlist = max(1, int(4 * np.sqrt(len(vectors))))
+            centroids = _train_ivf(vectors, nlist)
+            nlist = len(centroids)
+            assignments = _assign(vectors, centroids)
+            order = np.argsort(assignments, kind="stable")
+            vectors = vectors[order]
+            ids = [ids[i] for i in order]
+            metadata = [metadata[i] for i in order]
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))])
+
+        previous = self._current_version()
+        version = f"v{int(previous[1:]) + 1 if previous else 1:08d}"
+        version_dir = os.path.join(self.path, version)
+        os.makedirs(version_dir, exist_ok=True)
+
+        np.save(os.path.join(version_dir, "vectors.npy"), np.ascontiguousarray(vectors, dtype=np.float32))
+        with open(os.path.join(version_dir, "metadata.json"), "w") as f:
+            json.dump([[vector_id, meta] for vector_id, meta in zip(ids, metadata)], f)
+        if centroids is not None:
+            np.savez(os.path.join(version_dir, "ivf.npz"), centroids=centroids, offsets=offsets)
+
+        current_path = os.path.join(self.path, self.CURRENT_FILENAME)
+        with open(f"{current_path}.tmp", "w") as f:
+            f.write(version)
+        os.replace(f"{current_path}.tmp", current_path)
+
+        # Readers that still map the previous version keep their pages until they
+        # reload; anything older than that is no longer referenced.
+        for entry in os.listdir(self.path):
+            if entry.startswith("v") and entry not in (version, previous):
+                shutil.rmtree(os.path.join(self.path, entry), ignore_errors=True)
+
+    # -- VectorStore interface -------------------------------------------------------
+
+    def upsert(self, vectors):
+        with self._lock:
+            for item in vectors:
+                if isinstance(item, dict):
+                    vector_id, values, metadata = item["id"], item["values"], item.get("metadata", {})
+                else:
+                    vector_id, values, metadata = item
+                self._pending_deletes.discard(vector_id)
+                self._pending_upserts[vector_id] = (values, metadata or {})
+
+    def delete(self, ids):
+        with self._lock:
+            for vector_id in ids:
+                self._pending_upserts.pop(vector_id, None)
+                self._pending_deletes.add(vector_id)
+
+    def flush(self):
+        with self._lock:
+            if not self._pending_upserts and not self._pending_deletes:
+                return
+            self._reload_if_changed()
+            state = self._state
+
+            replaced = self._pending_deletes | self._pending_upserts.keys()
+            keep = [i for i, vector_id in enumerate(state.ids) if vector_id not in replaced]
+            new_ids = list(self._pending_upserts)
+
+            ids = [state.ids[i] for i in keep] + new_ids
+            metadata = [state.metadata[i] for i in keep] + [self._pending_upserts[i][1] for i in new_ids]
+            new_vectors = np.asarray(
+                [self._pending_upserts[i][0] for i in new_ids], dtype=np.float32
+            ).reshape(-1, self.dimension)
+            vectors = np.concatenate([np.asarray(state.vectors)[keep], _normalize(new_vectors)])
+
+            self._write_version(ids, metadata, vectors)
+            self._pending_upserts.clear()
+            self._pending_deletes.clear()
+            self._reload_if_changed()
+
+    def _candidate_ranges(self, state, query):
+        if state.centroids is None:
+            return None
+        nprobe = min(self.nprobe, len(state.centroids))
+        lists = np.argpartition(-(state.centroids @ query), nprobe - 1)[:nprobe]
+        return [(int(state.offsets[i]), int(state.offsets[i + 1])) for i in lists]
+
+    def query(self, vector, top_k, include_metadata=True):
+        if self._pending_upserts or self._pending_deletes:
+            self.flush()
+        self._reload_if_changed()
+
+        state = self._state
+        vectors, ids, metadata = state.vectors, state.ids, state.metadata
+        if not ids:
+            return {"matches": []}
+
+        query = _normalize(np.asarray(vector, dtype=np.float32))
+        ranges = self._candidate_ranges(state, query)
+        if ranges is None:
+            rows = np.arange(len(ids))
+            scores = vectors @ query
+        else:
+            rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+            scores = np.concatenate([vectors[start:end] @ query for start, end in ranges])
+
+        k = min(top_k, len(scores))
+        if k == 0:
+            return {"matches": []}
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+
+        return {
+            "matches": [
+                {
+                    "id": ids[rows[i]],
+                    "score": float(scores[i]),
+                    "metadata": metadata[rows[i]] if include_metadata else None,
+                }
+                for i in best
+            ]
+        }
@@ -1,13 +1,24 @@
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
 from rest_framework.views import APIView
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.response import Response
 from rest_framework import status
 from .schema_extractor import get_schema, map_relevant_schemas_to_tables,standardize_table_names
+from .schema_cache import get_schema_snapshot
+from .answer_cache import lookup_answer, store_answer
 from .embedding_service import retrieve_relevant_schema
-from .sql_service import  execute_sql_query
-from .llm_service import generate_sql_from_nl
-from .utils import save_session_data ,get_session_data,get_full_session
-import psycopg2
+from .sql_service import  ResultSet, open_sql_query, process_query_pipeline, stream_query_json
+from .renderers import RESULT_RENDERERS, dumps_json
+from .async_pipeline import run_query_pipeline
+from .llm_service import generate_sql_from_nl, get_generation_stats, stream_sql_from_nl
+from .utils import get_session_data, get_full_session, update_session
+from .cache import cache_stats
+from .db_pool import get_pool_manager
+from .query_guard import QueryRejected, guard_query
+from .result_cache import execute_cached
+from django.conf import settings
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,6 +26,9 @@ logger = logging.getLogger(__name__)
 
 
 class QueryView(APIView):
+    # Results as JSON records (default), columnar JSON or Arrow, per the Accept header
+    renderer_classes = RESULT_RENDERERS
+
     def post(self, request):
         nl_query = request.data.get("query")
         session_id = request.data.get("session_id")
@@ -23,8 +37,9 @@ class QueryView(APIView):
             return Response({"error": "A valid natural language query (at least 5 characters) is required."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            # Step 1: Retrieve schema information
-            schema_info = get_schema()
+            # Step 1: Retrieve schema information (cached snapshot, refreshed on DDL)
+            snapshot = get_schema_snapshot()
+            schema_info = snapshot.schema_info if snapshot else None
             print(" \n Fetched SChema Info : ", type(schema_info))
 
 
@@ -34,12 +49,19 @@ class QueryView(APIView):
 
 
             # Step 3: Map relevant schemas to tables
-            mapped_schema_info = map_relevant_schemas_to_tables(relevant_schemas, schema_info)
+            mapped_schema_info = map_relevant_schemas_to_tables(
+                relevant_schemas, schema_info, catalog=snapshot.catalog if snapshot else None
+            )
             print(" \n Mapped  SChema Info : ", mapped_schema_info)
             logger.info(f"Mapped schema info: {mapped_schema_info}")
 
-            # Step 4: Generate SQL using SQLCoder
-            sql_query = generate_sql_from_nl(nl_query, mapped_schema_info)
+            # Step 4: Generate SQL using SQLCoder, unless this question (or a close
+            # paraphrase) was already answered against the same schema
+            schema_version = snapshot.fingerprint if snapshot else ""
+            sql_query = lookup_answer(nl_query, mapped_schema_info, schema_version)
+            if sql_query is None:
+                sql_query = generate_sql_from_nl(nl_query, mapped_schema_info)
+                store_answer(nl_query, mapped_schema_info, schema_version, sql_query)
             
             
             print(f" \n Generated SQL Query before STD \n: {sql_query} ")
@@ -51,19 +73,41 @@ class QueryView(APIView):
             if not sql_query:
                 return Response({"error": "Failed to generate SQL query."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            # Step 5: Validate SQL query (Optional: Uncomment if required)
-            
-            #corrected_query = process_query_pipeline(sql_query, mapped_schema_info)
-            
-
-            # Step 6: Execute SQL query
-            results = execute_sql_query(std_query)
+            # Step 5: Validate tables and columns against the schema and correct
+            # misspelled columns; if validation fails the query runs as generated
+            corrected_query = process_query_pipeline(std_query, mapped_schema_info)
+            if corrected_query.startswith("Error:"):
+                logger.info(f"SQL validation skipped: {corrected_query}")
+            else:
+                std_query = corrected_query
+
+            # Step 6: Guard: EXPLAIN cost/row estimates and a LIMIT on unbounded
+            # selects. Streams are bounded by QUERY_MAX_ROWS instead.
+            stream = request.data.get("stream")
+            confirmed = bool(request.data.get("confirm"))
+            try:
+                row_limit = getattr(settings, "QUERY_MAX_ROWS", 100000) + 1 if stream else None
+                guarded = guard_query(std_query, confirmed=confirmed, row_limit=row_limit)
+            except QueryRejected as e:
+                return Response({"sql_query": sql_query, **e.payload()}, status=e.status_code)
+
+            # Step 7: Execute SQL query. With "stream", rows are fetched from a
+            # server-side cursor and written out as they arrive, up to the row/byte caps.
+            # Results beyond one fetch batch hold their connection until the
+            # client has read the response (see iter_sql_query).
+            if stream:
+                batches = open_sql_query(guarded.sql)
+                update_session(session_id, last_query=nl_query, last_sql=sql_query)
+                return StreamingHttpResponse(
+                    stream_query_json(batches, head={"sql_query": sql_query}), content_type="application/json"
+                )
+
+            results = execute_cached(guarded.sql)
             """if "error" in results:
                 return Response({"error": results["error"]}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)"""
 
             # Save session details
-            save_session_data(session_id, "last_query", nl_query)
-            save_session_data(session_id, "last_sql", sql_query)
+            update_session(session_id, last_query=nl_query, last_sql=sql_query)
 
             return Response({"sql_query": sql_query, "results": results}, status=status.HTTP_200_OK)
 
@@ -73,6 +117,110 @@ class QueryView(APIView):
 
 
 
+def _sse(event, data):
+    # Same encoding as the application/json responses; result sets become row dicts
+    return f"event: {event}\ndata: {dumps_json(data).decode()}\n\n"
+
+
+class QueryStreamView(APIView):
+    """
+    The QueryView pipeline served as Server-Sent Events.
+
+    Emits ``token`` events while the SQL decodes, then ``sql``, ``results`` and
+    ``done``, or a single ``error`` event if any step fails or the query guard
+    refuses the query (``requires_confirmation`` tells the two guard outcomes apart).
+    """
+
+    def post(self, request):
+        nl_query = request.data.get("query")
+        session_id = request.data.get("session_id")
+
+        if not nl_query or len(nl_query.strip()) < 5:
+            return Response({"error": "A valid natural language query (at least 5 characters) is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        confirmed = bool(request.data.get("confirm"))
+        response = StreamingHttpResponse(self._events(nl_query, session_id, confirmed), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        # Keep reverse proxies (nginx) from buffering the event stream
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    def _events(self, nl_query, session_id, confirmed=False):
+        try:
+            snapshot = get_schema_snapshot()
+            schema_info = snapshot.schema_info if snapshot else None
+            relevant_schemas = retrieve_relevant_schema(nl_query)
+            mapped_schema_info = map_relevant_schemas_to_tables(
+                relevant_schemas, schema_info, catalog=snapshot.catalog if snapshot else None
+            )
+
+            schema_version = snapshot.fingerprint if snapshot else ""
+            sql_query = lookup_answer(nl_query, mapped_schema_info, schema_version)
+            if sql_query is None:
+                for event, data in stream_sql_from_nl(nl_query, mapped_schema_info):
+                    if event == "token":
+                        yield _sse("token", {"text": data})
+                    else:
+                        sql_query = data
+                store_answer(nl_query, mapped_schema_info, schema_version, sql_query)
+
+            if not sql_query:
+                yield _sse("error", {"error": "Failed to generate SQL query."})
+                return
+            yield _sse("sql", {"sql_query": sql_query})
+
+            std_query = standardize_table_names(sql_query, mapped_schema_info)
+            corrected_query = process_query_pipeline(std_query, mapped_schema_info)
+            if not corrected_query.startswith("Error:"):
+                std_query = corrected_query
+            try:
+                guarded = guard_query(std_query, confirmed=confirmed)
+            except QueryRejected as e:
+                yield _sse("error", e.payload())
+                return
+            results = execute_cached(guarded.sql)
+            yield _sse("results", {"results": results})
+
+            update_session(session_id, last_query=nl_query, last_sql=sql_query)
+            yield _sse("done", {})
+
+        except Exception as e:
+            logger.error(f"Error streaming query: {e}")
+            yield _sse("error", {"error": f"An error occurred while processing the query. {e}"})
+
+
+async def query_async(request):
+    """
+    QueryView for ASGI deployments: the pipeline runs as a coroutine, so a worker
+    holds many in-flight queries instead of one blocked request each.
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return HttpResponse(dumps_json({"error": "Request body must be JSON."}), status=400, content_type="application/json")
+
+    nl_query = data.get("query")
+    session_id = data.get("session_id")
+    if not nl_query or len(nl_query.strip()) < 5:
+        return HttpResponse(
+            dumps_json({"error": "A valid natural language query (at least 5 characters) is required."}),
+            status=400,
+            content_type="application/json",
+        )
+
+    # Under WSGI every call runs on a new event loop, which must not get an asyncpg pool
+    payload, status_code = await run_query_pipeline(
+        nl_query, session_id, confirmed=bool(data.get("confirm")), use_asyncpg=isinstance(request, ASGIRequest)
+    )
+    return HttpResponse(dumps_json(payload), status=status_code, content_type="application/json")
+
+
+# Set directly: csrf_exempt() only wraps async views correctly from Django 5.0 on.
+query_async.csrf_exempt = True
+
+
 @api_view(['POST'])
 def connect_to_db(request):
     session_id = request.data.get("session_id")
@@ -85,15 +233,13 @@ def connect_to_db(request):
     }
 
     try:
-        # Test the connection using psycopg2
-        conn = psycopg2.connect(**db_credentials)
-        conn.close()
-
-        # Save DB credentials to Redis
-        save_session_data(session_id, "db_credentials", db_credentials)
+        # Test the connection; it stays open in the session database's pool
+        with get_pool_manager().connection(db_credentials) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
 
-        # Update pipeline stage
-        save_session_data(session_id, "pipeline_stage", "db_connected")
+        # Save DB credentials and the pipeline stage to Redis
+        update_session(session_id, db_credentials=db_credentials, pipeline_stage="db_connected")
 
         return Response({"message": "Database connected successfully."}, status=status.HTTP_200_OK)
     except Exception as e:
@@ -112,11 +258,8 @@ def fetch_schemas(request):
         # Fetch schemas from the database
         schema_info = get_schema(db_credentials)
 
-        # Save schemas to Redis
-        save_session_data(session_id, "available_schemas", schema_info)
-
-        # Update pipeline stage
-        save_session_data(session_id, "pipeline_stage", "schemas_discovered")
+        # Save schemas and the pipeline stage to Redis
+        update_session(session_id, available_schemas=schema_info, pipeline_stage="schemas_discovered")
 
         return Response({"schemas": schema_info}, status=status.HTTP_200_OK)
     except Exception as e:
@@ -137,11 +280,8 @@ def update_selected_schemas(request):
         if invalid_schemas:
             return Response({"error": f"Invalid schemas: {invalid_schemas}"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Save selected schemas to Redis
-        save_session_data(session_id, "selected_schemas", selected_schemas)
-
-        # Update pipeline stage
-        save_session_data(session_id, "pipeline_stage", "schemas_selected")
+        # Save selected schemas and the pipeline stage to Redis
+        update_session(session_id, selected_schemas=selected_schemas, pipeline_stage="schemas_selected")
 
         return Response({"message": "Schemas updated successfully."}, status=status.HTTP_200_OK)
     except Exception as e:
@@ -161,12 +301,8 @@ def process_query(request):
         # Generate SQL query using the LLM
         sql_query = generate_sql_from_nl(nl_query, selected_schemas)
 
-        # Save the NL query and generated SQL to Redis
-        save_session_data(session_id, "nl_query", nl_query)
-        save_session_data(session_id, "sql_query", sql_query)
-
-        # Update pipeline stage
-        save_session_data(session_id, "pipeline_stage", "query_processed")
+        # Save the NL query, generated SQL and pipeline stage to Redis
+        update_session(session_id, nl_query=nl_query, sql_query=sql_query, pipeline_stage="query_processed")
 
         return Response({"sql_query": sql_query}, status=status.HTTP_200_OK)
     except Exception as e:
@@ -187,14 +323,22 @@ def validate_query(request):
             return Response({"error": "Generated SQL query is invalid or potentially unsafe."}, status=status.HTTP_400_BAD_REQUEST)
 
         # Update pipeline stage
-        save_session_data(session_id, "pipeline_stage", "query_validated")
+        update_session(session_id, pipeline_stage="query_validated")
 
         return Response({"message": "SQL query validated successfully."}, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({"error": f"Failed to validate query: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
+@renderer_classes(RESULT_RENDERERS)
 def execute_query(request):
+    """
+    Guard and execute the session's ``sql_query``.
+
+    The session's ``query_results`` holds the result column-oriented as
+    ``{"columns": [...], "types": [...], "rows": [[...], ...], "row_count": n}``
+    rather than one dict per row; large results are stored compressed.
+    """
     session_id = request.data.get("session_id")
 
     try:
@@ -202,14 +346,23 @@ def execute_query(request):
         sql_query = get_session_data(session_id, "sql_query")
         db_credentials = get_session_data(session_id, "db_credentials")
 
-        # Execute the SQL query
-        results = execute_sql_query(sql_query, db_credentials)
-
-        # Save results to Redis
-        save_session_data(session_id, "query_results", results)
-
-        # Update pipeline stage
-        save_session_data(session_id, "pipeline_stage", "query_executed")
+        # Guard, then execute the SQL query
+        try:
+            guarded = guard_query(sql_query, confirmed=bool(request.data.get("confirm")), db_credentials=db_credentials)
+        except QueryRejected as e:
+            return Response(e.payload(), status=e.status_code)
+        results = execute_cached(guarded.sql, db_credentials)
+
+        # Save the results and the pipeline stage to Redis; the result cache may
+        # not hold the rows (writes, volatile queries, large or expired results)
+        if isinstance(results, ResultSet):
+            stored = {
+                "columns": results.columns, "types": results.types,
+                "rows": [list(row) for row in results.rows], "row_count": len(results),
+            }
+        else:
+            stored = results
+        update_session(session_id, query_results=stored, pipeline_stage="query_executed")
 
         return Response({"results": results}, status=status.HTTP_200_OK)
     except Exception as e:
@@ -227,3 +380,11 @@ def inspect_session(request, session_id):
         return Response({"error": f"Failed to inspect session: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+def cache_statistics(request):
+    return Response({"caches": cache_stats()}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def generation_statistics(request):
+    return Response({"generation": get_generation_stats()}, status=status.HTTP_200_OK)